@@ -0,0 +1,101 @@
+
+# Host simulation for mqtt_tiny_controller
+# Stand-ins for the MicroPython modules (machine, network, utime, uasyncio, ntptime, urequests, usocket, ...) so the
+# controller, mqtt_as and the common library run unmodified on CPython (e.g. to benchmark latency and throughput on Linux).
+#
+# e.g.
+#     import host_sim
+#     controller = host_sim.load_controller()   # Imports the controller without starting Wi-Fi or the event loop
+#     controller.init()
+#     host_sim.get_board().set_input(0, 0)       # Close contact switch GP0
+
+import gc
+import importlib
+import importlib.util
+import os
+import sys
+
+from host_sim.board import SimBoard, MachineReset, get_board, set_board, reset_board
+
+# MicroPython module name -> module implementing it on CPython
+simulated_modules = {
+    "machine": "host_sim.machine",
+    "network": "host_sim.network",
+    "utime": "host_sim.utime",
+    "uasyncio": "host_sim.uasyncio",
+    "ntptime": "host_sim.ntptime",
+    "urequests": "host_sim.urequests",
+    "usocket": "host_sim.usocket",
+    "ussl": "host_sim.ussl",
+    "micropython": "host_sim.micropython",
+    "ustruct": "struct",
+    "ubinascii": "binascii",
+    "uerrno": "errno",
+    "ujson": "json",
+}
+
+# PicoW heap size for gc.mem_free(), around 190KB is free after MicroPython boots with Wi-Fi enabled
+heap_size = 192 * 1024
+
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _mem_alloc():
+    import tracemalloc
+    if (tracemalloc.is_tracing()):
+        return tracemalloc.get_traced_memory()[0]
+    return 0
+
+
+def _mem_free():
+    return max(0, heap_size - _mem_alloc())
+
+
+# Imports a MicroPython module (e.g. "ntptime") from its stand-in on first import, so modules that are never imported
+# stay out of sys.modules like on PicoW (e.g. to check lazy imports in the startup benchmark)
+class SimulatedModuleFinder:
+
+    def find_spec(self, name, path=None, target=None):
+        if (name not in simulated_modules):
+            return None
+        return importlib.util.spec_from_loader(name, self)
+
+    def create_module(self, spec):
+        return importlib.import_module(simulated_modules[spec.name])
+
+    def exec_module(self, module):
+        pass
+
+
+_finder = SimulatedModuleFinder()
+
+
+# Register the simulated modules (imported on first use), safe to call more than once
+def install():
+    if (_finder not in sys.meta_path):
+        sys.meta_path.insert(0, _finder)
+    if (not hasattr(gc, "mem_alloc")):
+        gc.mem_alloc = _mem_alloc   # MicroPython only functions
+        gc.mem_free = _mem_free
+    if (project_path not in sys.path):
+        sys.path.insert(0, project_path)
+
+
+# Import mqtt_tiny_controller without import time side effects (the program main only runs in main())
+# fresh=True loads a separate copy of the module with its own globals, e.g. one per simulated device
+# The controller uses the simulated GPIO backend (host_sim.gpio), use init(gpio_backend_name="pin") to test the Pin fallback
+def load_controller(fresh=False, module_name="mqtt_tiny_controller"):
+    install()
+    import host_sim.gpio   # Registers backend "sim"
+    if (not fresh):
+        module = importlib.import_module(module_name)
+    else:
+        load_controller.counter += 1
+        spec = importlib.util.spec_from_file_location(f"{module_name}_{load_controller.counter}", os.path.join(project_path, module_name + ".py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    module.config_overrides["gpio_backend_name"] = "sim"   # Applied when init() compiles the config
+    return module
+
+
+load_controller.counter = 0
@@ -0,0 +1,47 @@
+
+# Host simulation smoke run: python -m host_sim
+# Runs init(), a contact switch change, a relay command, a momentary press, a multi-relay command and a binary command on the simulated board without any broker
+
+import host_sim
+import mqtt_tiny_controller_codec as codec
+
+controller = host_sim.load_controller()
+board = host_sim.get_board()
+asyncio = controller.asyncio
+
+
+async def run():
+    controller.init()
+    asyncio.create_task(controller.mqtt_timer.run())   # Releases momentary relays (started by worker() on PicoW)
+    print(f"Full status: {dict(controller.get_gpio_status(True))}")
+
+    board.set_input(0, 0)   # Close contact switch GP0 (pull up input reads 0 = connected)
+    print(f"Contact changed: {controller.is_gpio_values_changed()}, status={dict(controller.get_gpio_status(False))}")
+    controller.reset_gpio_changed_status()
+
+    await asyncio.sleep(controller.mqtt_config.hardware_modified_cooldown_period_in_seconds + 1)   # Relays are in cooldown right after init()
+    controller.set_gpio_value_on_hardware("GP16", 1)
+    print(f"GP16 relay on, pin level={board.get_level(16)}, status={controller.get_current_gpio_value('GP16')}")
+
+    controller.set_gpio_value_on_hardware("GP18", 1)
+    print(f"GP18 momentary pressed, pin level={board.get_level(18)}, timers pending={controller.mqtt_timer.get_pending_count()}")
+    await asyncio.sleep(controller.mqtt_gpio_hardware["GP18"].momentary_wait_in_seconds + 0.1)
+    print(f"GP18 momentary released, pin levels written={board.get_output_history(18)}")
+
+    await asyncio.sleep(controller.mqtt_config.hardware_modified_cooldown_period_in_seconds + 1)
+    apply_counter = controller.gpio_backend.apply_counter
+    controller.set_gpio_values_on_hardware({"GP16": 0, "GP17": 1})   # Multi-relay command, e.g. {"GP16": 0, "GP17": 1}
+    print(f"GP16 off and GP17 on with {controller.gpio_backend.apply_counter - apply_counter} write, pin levels={board.get_level(16)}{board.get_level(17)}")
+
+    # Binary payloads (mqtt_binary_topic): command as opcode, status as pin bitmask + changed mask + epoch
+    await asyncio.sleep(controller.mqtt_config.hardware_modified_cooldown_period_in_seconds + 1)
+    controller.handle_binary_message(codec.encode_set_command({"GP16": 1}), controller.utime.ticks_ms(), None)
+    await asyncio.sleep(0.1)
+    full_status = controller.get_gpio_status(True)
+    binary_status = codec.encode_state(full_status, controller.utime.time(), True, controller.mqtt_publish_stats.state_seq)
+    full_status[controller.mqtt_config.time_keyname] = controller.get_formatted_time_now(controller.mqtt_config.time_zone_name)
+    print(f"Binary GP16 on, pin level={board.get_level(16)}, status {len(binary_status)} bytes (JSON {len(controller.json.dumps(full_status))} bytes), decoded={codec.decode_state(binary_status)}")
+
+    print(f"Log: {[message for queue in controller.mqtt_outbox.queues for topic, message, retain, queued_time in queue]}")
+
+asyncio.run(run())
@@ -0,0 +1,135 @@
+
+# Simulated PicoW board for host simulation
+# All hardware state of one device (pins, Wi-Fi, temperature, RTC, reset) is kept in SimBoard.
+# The current board is a context variable, so several simulated devices can run in one asyncio loop (each task inherits the board it was created with)
+
+import contextvars
+from host_sim import clock as _clock
+
+# PicoW RTC starts at 2021-01-01 00:00:00 UTC after power up
+default_rtc_time = 1609459200
+
+
+# Raised by machine.reset(), BaseException so it is not swallowed by "except Exception" in controller code
+class MachineReset(BaseException):
+    pass
+
+
+# Real time clock of the board, time() keeps counting from the last datetime set (e.g. by ntptime.settime)
+class SimRtc:
+
+    def __init__(self, start_time=default_rtc_time):
+        self.set_time(start_time)
+
+    def set_time(self, seconds):
+        self._clock = _clock.get_clock()
+        self._base = seconds
+        self._set_at = self._clock.monotonic()
+
+    def time(self):
+        if (self._clock is not _clock.get_clock()):   # Clock was replaced (e.g. virtual clock), keep counting from the current time
+            self.set_time(self._base + (self._clock.monotonic() - self._set_at))
+        return self._base + (self._clock.monotonic() - self._set_at)
+
+
+# Simulated Wi-Fi interface (network.WLAN)
+class SimWlan:
+
+    def __init__(self, board):
+        self.board = board
+        self._active = False
+        self._connect_started = None   # Monotonic time when connect() was called
+        self._ssid = None
+        self.config_values = {}
+        self.connect_counter = 0
+
+    def _connected(self):
+        if (self._connect_started is None or not self._active or not self.board.wifi_available):
+            return False
+        return (_clock.get_clock().monotonic() - self._connect_started) * 1000 >= self.board.wifi_association_delay_in_ms
+
+
+class SimBoard:
+
+    def __init__(self, name="picow"):
+        self.name = name
+        self.pins = {}   # Pin id -> SimPinState
+        self.outputs = []   # Recorded output writes [(ticks_ms, pin id, value)]
+        self.rtc = SimRtc()
+        self.temperature_celcius = 25.0
+        self.reset_counter = 0
+        self.reset_hook = None   # Optional callable(board), if it returns normally machine.reset() returns as well
+        self.wifi_ssid = None     # None accepts any SSID
+        self.wifi_available = True    # Set to False to simulate router down (SSID is not available)
+        self.wifi_association_delay_in_ms = 0
+        self.wifi_rssi = -55
+        self.wifi_scan_in_ms = 0   # Blocking time of wlan.scan()
+        self.wlan = SimWlan(self)
+        self.ntp_available = True
+        self.ntp_latency_in_ms = 0
+        self.http_responses = {}   # url -> (status_code, json dict)
+        self.http_latency_in_ms = 0
+        self.unique_id = name.encode()[:8]
+
+    # Get pin state, created on first use
+    def get_pin(self, pin_id):
+        state = self.pins.get(pin_id)
+        if (state is None):
+            state = SimPinState(pin_id)
+            self.pins[pin_id] = state
+        return state
+
+    # Drive an input pin from outside, e.g. method(0, 0) closes a contact switch on GP0 (pull up input reads 0)
+    def set_input(self, pin_id, level):
+        self.get_pin(pin_id).external_level = level
+
+    # Release an input pin, it reads its pull resistor level again
+    def release_input(self, pin_id):
+        self.get_pin(pin_id).external_level = None
+
+    # Get the level of a pin as seen on hardware
+    def get_level(self, pin_id):
+        return self.get_pin(pin_id).read()
+
+    # Recorded output writes for a pin, e.g. method(18) returns [0, 1] for one momentary press
+    def get_output_history(self, pin_id):
+        return [value for ticks, pid, value in self.outputs if pid == pin_id]
+
+
+# Level of one GPIO pin, shared by all Pin objects created with the same id
+class SimPinState:
+
+    def __init__(self, pin_id):
+        self.pin_id = pin_id
+        self.mode = None
+        self.pull = None
+        self.level = 0   # Output level driven by the board
+        self.external_level = None   # Level driven from outside (input), None = floating
+
+    def read(self):
+        if (self.mode == 1):   # Pin.OUT
+            return self.level
+        if (self.external_level is not None):
+            return self.external_level
+        if (self.pull == 1):   # Pin.PULL_UP
+            return 1
+        return 0
+
+
+_default_board = SimBoard()
+_current_board = contextvars.ContextVar("host_sim_board", default=_default_board)
+
+
+# Get the board of the running device
+def get_board():
+    return _current_board.get()
+
+
+# Select the board for the current context, tasks created afterwards inherit it
+# Returns token for reset_board(), e.g. token = method(SimBoard("device1"))
+def set_board(board):
+    return _current_board.set(board)
+
+
+def reset_board(token):
+    _current_board.reset(token)
@@ -0,0 +1,340 @@
+
+# Local MQTT 3.1.1 broker stand-in for host simulation (asyncio, localhost only)
+# Supports what mqtt_as and the controller use: QoS 0/1, retained messages, last will, persistent sessions (clean=False)
+# with offline QoS1 queue and unacknowledged QoS1 resent with DUP on reconnect, keepalive timeout, wildcard subscriptions (+ and #). Not for production use.
+#
+# e.g.
+#     broker = MQTTBroker()
+#     await broker.start()        # broker.port is the bound port
+#     broker.publish("topicname/actionname", '{"GP16": 1}', qos=1)   # Inject a message like a backend client
+#     await broker.stop()         # All connections are dropped (broker outage), start() again to recover
+#     broker = MQTTBroker(ssl_context=context)   # MQTT over TLS with a server side ssl.SSLContext
+#     broker.drop_pubacks = True  # The link of a subscriber is cut at its next PUBACK: it and every later packet are lost (TCP keeps the order),
+#                                 # messages stay unacknowledged until the next reconnect
+
+import asyncio
+import struct
+
+
+# Match MQTT topic filter with wildcards, e.g. method("fleet/+/state", "fleet/device1/state") returns True
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i in range(len(filter_levels)):
+        if (filter_levels[i] == "#"):
+            return True
+        if (i >= len(topic_levels)):
+            return False
+        if (filter_levels[i] != "+" and filter_levels[i] != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(n):
+    result = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if (n > 0):
+            byte |= 0x80
+        result.append(byte)
+        if (n == 0):
+            return bytes(result)
+
+
+def _encode_str(s):
+    return struct.pack("!H", len(s)) + s
+
+
+def _decode_str(data, offset):
+    n = struct.unpack_from("!H", data, offset)[0]
+    return bytes(data[offset + 2:offset + 2 + n]), offset + 2 + n
+
+
+# Session state of one client id, kept after disconnect when clean session is False
+class Session:
+
+    def __init__(self, client_id, clean):
+        self.client_id = client_id
+        self.clean = clean
+        self.subscriptions = {}   # topic filter (str) -> granted qos
+        self.pending = []   # QoS1 messages queued while offline [(topic, msg)]
+        self.inflight = {}   # QoS1 messages sent but not acknowledged, pid -> (topic, msg)
+        self.connection = None
+        self.next_pid = 0
+
+    def new_pid(self):
+        self.next_pid = self.next_pid % 65535 + 1
+        return self.next_pid
+
+
+# Counters of the broker, rates are computed by the caller over the run time
+class BrokerStats:
+
+    def __init__(self):
+        self.connects = 0
+        self.disconnects = 0
+        self.publishes_in = 0
+        self.publishes_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.publishes_by_client = {}   # client id -> number of PUBLISH received
+        self.wills = 0
+        self.queued_offline = 0
+
+
+class Connection:
+
+    def __init__(self, broker, reader, writer):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.session = None
+        self.will = None   # (topic, msg, qos, retain)
+        self.keepalive = 0
+        self.is_closed = False
+        self.is_link_cut = False   # A PUBACK was dropped (drop_pubacks), later packets are lost too
+
+    def send(self, packet):
+        if (self.is_closed):
+            return
+        try:
+            self.writer.write(packet)
+            self.broker.stats.bytes_out += len(packet)
+        except (ConnectionError, RuntimeError):
+            self.close()
+
+    def send_publish(self, topic, msg, qos, retain=False, pid=None):
+        header = 0x30 | (qos << 1) | (1 if retain else 0) | (0x08 if pid is not None else 0)   # DUP when resent with its pid
+        body = _encode_str(topic.encode())
+        if (qos > 0):
+            pid = pid if pid is not None else self.session.new_pid()
+            self.session.inflight[pid] = (topic, msg)
+            body += struct.pack("!H", pid)
+        body += msg
+        self.send(bytes([header]) + _encode_length(len(body)) + body)
+        self.broker.stats.publishes_out += 1
+
+    def close(self):
+        if (not self.is_closed):
+            self.is_closed = True
+            try:
+                self.writer.close()
+            except (ConnectionError, RuntimeError):
+                pass
+
+    async def read_packet(self):
+        timeout = self.keepalive * 1.5 if self.keepalive > 0 else None
+        header = await asyncio.wait_for(self.reader.readexactly(1), timeout)
+        length = 0
+        shift = 0
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if (not byte & 0x80):
+                break
+            shift += 7
+        body = await self.reader.readexactly(length) if length > 0 else b""
+        self.broker.stats.bytes_in += 2 + length
+        return header[0], body
+
+    async def run(self):
+        clean_exit = False
+        try:
+            while not self.is_closed:
+                packet_type, body = await self.read_packet()
+                kind = packet_type & 0xF0
+                if (self.is_link_cut):
+                    continue
+                if (kind == 0x10):
+                    self.handle_connect(body)
+                elif (self.session is None):
+                    break   # First packet must be CONNECT
+                elif (kind == 0x30):
+                    self.handle_publish(packet_type, body)
+                elif (kind == 0x40):
+                    if (self.broker.drop_pubacks):
+                        self.is_link_cut = True
+                    else:
+                        self.session.inflight.pop(struct.unpack_from("!H", body, 0)[0], None)
+                elif (kind == 0x80):
+                    self.handle_subscribe(body)
+                elif (kind == 0xA0):
+                    self.handle_unsubscribe(body)
+                elif (kind == 0xC0):
+                    self.send(b"\xd0\x00")   # PINGRESP
+                elif (kind == 0xE0):
+                    clean_exit = True
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, OSError, asyncio.CancelledError):   # OSError: connection and TLS errors
+            pass
+        finally:
+            self.broker.on_disconnect(self, clean_exit)
+            self.close()
+
+    def handle_connect(self, body):
+        protocol, offset = _decode_str(body, 0)
+        level, flags, self.keepalive = struct.unpack_from("!BBH", body, offset)
+        offset += 4
+        client_id, offset = _decode_str(body, offset)
+        if (flags & 0x04):
+            will_topic, offset = _decode_str(body, offset)
+            will_msg, offset = _decode_str(body, offset)
+            self.will = (will_topic.decode(), will_msg, (flags >> 3) & 0x03, bool(flags & 0x20))
+        session_present = self.broker.on_connect(self, client_id.decode(), bool(flags & 0x02))
+        self.send(bytes([0x20, 0x02, 1 if session_present else 0, 0]))
+        for pid, (topic, msg) in list(self.session.inflight.items()):
+            self.send_publish(topic, msg, 1, pid=pid)
+        self.broker.flush_pending(self.session)
+
+    def handle_publish(self, packet_type, body):
+        qos = (packet_type >> 1) & 0x03
+        retain = bool(packet_type & 0x01)
+        topic, offset = _decode_str(body, 0)
+        if (qos > 0):
+            pid = struct.unpack_from("!H", body, offset)[0]
+            offset += 2
+        msg = bytes(body[offset:])
+        if (qos == 1):
+            self.send(b"\x40\x02" + struct.pack("!H", pid))
+        self.broker.route(topic.decode(), msg, qos, retain, self.session.client_id)
+
+    def handle_subscribe(self, body):
+        pid = struct.unpack_from("!H", body, 0)[0]
+        offset = 2
+        granted = bytearray()
+        topic_filters = []
+        while offset < len(body):
+            topic_filter, offset = _decode_str(body, offset)
+            qos = min(body[offset], 1)
+            offset += 1
+            self.session.subscriptions[topic_filter.decode()] = qos
+            topic_filters.append(topic_filter.decode())
+            granted.append(qos)
+        self.send(b"\x90" + _encode_length(2 + len(granted)) + struct.pack("!H", pid) + bytes(granted))
+        self.broker.on_subscribe(self.session, topic_filters)
+
+    def handle_unsubscribe(self, body):
+        pid = struct.unpack_from("!H", body, 0)[0]
+        offset = 2
+        while offset < len(body):
+            topic_filter, offset = _decode_str(body, offset)
+            self.session.subscriptions.pop(topic_filter.decode(), None)
+        self.send(b"\xb0\x02" + struct.pack("!H", pid))
+
+
+class MQTTBroker:
+
+    def __init__(self, host="127.0.0.1", port=0, ssl_context=None):
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.sessions = {}   # client id -> Session
+        self.retained = {}   # topic -> msg
+        self.stats = BrokerStats()
+        self.listeners = []   # callable(client_id, topic, msg, qos, retain) for every routed PUBLISH
+        self.subscribe_listeners = []   # callable(client_id, topic_filters)
+        self.connect_listeners = []   # callable(client_id)
+        self.connections = set()
+        self.drop_pubacks = False
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._accept, self.host, self.port, reuse_address=True, ssl=self.ssl_context)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    # Broker outage: stop listening and drop every connection (wills are published like after a network failure)
+    async def stop(self):
+        if (self._server is not None):
+            self._server.close()
+            self._server = None
+        for connection in list(self.connections):
+            connection.close()
+        await asyncio.sleep(0)
+
+    def is_running(self):
+        return self._server is not None
+
+    async def _accept(self, reader, writer):
+        connection = Connection(self, reader, writer)
+        self.connections.add(connection)
+        try:
+            await connection.run()
+        finally:
+            self.connections.discard(connection)
+
+    def on_connect(self, connection, client_id, clean):
+        self.stats.connects += 1
+        session = self.sessions.get(client_id)
+        if (session is not None and session.connection is not None):
+            session.connection.will = None   # Session takeover, old connection is closed without will
+            session.connection.close()
+        session_present = session is not None and not clean
+        if (session is None or clean):
+            session = Session(client_id, clean)
+            self.sessions[client_id] = session
+        session.clean = clean
+        session.connection = connection
+        connection.session = session
+        for listener in self.connect_listeners:
+            listener(client_id)
+        return session_present
+
+    def on_disconnect(self, connection, clean_exit):
+        session = connection.session
+        if (session is None or session.connection is not connection):
+            return
+        self.stats.disconnects += 1
+        session.connection = None
+        if (not clean_exit and connection.will is not None):
+            self.stats.wills += 1
+            topic, msg, qos, retain = connection.will
+            self.route(topic, msg, qos, retain, session.client_id)
+        if (session.clean):
+            self.sessions.pop(session.client_id, None)
+
+    def on_subscribe(self, session, topic_filters):
+        for topic_filter in topic_filters:
+            for topic in self.retained:
+                if (topic_matches(topic_filter, topic)):
+                    session.connection.send_publish(topic, self.retained[topic], session.subscriptions[topic_filter], True)
+        for listener in self.subscribe_listeners:
+            listener(session.client_id, topic_filters)
+
+    def flush_pending(self, session):
+        pending = session.pending
+        session.pending = []
+        for topic, msg in pending:
+            session.connection.send_publish(topic, msg, 1)
+
+    # Deliver a message to all matching subscriptions, queue QoS1 for offline persistent sessions
+    def route(self, topic, msg, qos, retain, sender_id=None):
+        if (sender_id is not None):
+            self.stats.publishes_in += 1
+            self.stats.publishes_by_client[sender_id] = self.stats.publishes_by_client.get(sender_id, 0) + 1
+        if (retain):
+            if (len(msg) == 0):
+                self.retained.pop(topic, None)   # Empty retained message clears the topic
+            else:
+                self.retained[topic] = msg
+        for listener in self.listeners:
+            listener(sender_id, topic, msg, qos, retain)
+        for session in list(self.sessions.values()):
+            granted = None
+            for topic_filter in session.subscriptions:
+                if (topic_matches(topic_filter, topic)):
+                    granted = max(granted or 0, session.subscriptions[topic_filter])
+            if (granted is None):
+                continue
+            delivery_qos = min(qos, granted)
+            if (session.connection is not None):
+                session.connection.send_publish(topic, msg, delivery_qos)
+            elif (delivery_qos == 1 and not session.clean):
+                session.pending.append((topic, msg))
+                self.stats.queued_offline += 1
+
+    # Publish from the broker side, e.g. a backend client sending commands
+    def publish(self, topic, msg, retain=False, qos=1):
+        if (isinstance(msg, str)):
+            msg = msg.encode()
+        self.route(topic, msg, qos, retain)
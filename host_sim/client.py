@@ -0,0 +1,68 @@
+
+# In-process MQTT client stand-in for host simulation, same event interface as mqtt_as.MQTTClient (queue, up, down)
+# No socket or broker is needed: publishes are recorded and echoed back to the subscribed topic like a broker would.
+# Use it for deterministic virtual time scenarios, use mqtt_as with host_sim.broker for network level scenarios.
+
+import uasyncio as asyncio
+import utime
+from mqtt_as import MsgQueue
+
+
+class SimMQTTClient:
+    REPUB_COUNT = 0
+
+    # puback_delay_in_ms simulates the PUBACK round trip of QoS1 publishes (mqtt_as waits for it), e.g. 300 for a cloud broker over Wi-Fi
+    def __init__(self, queue_len=10, echo=True, puback_delay_in_ms=0):
+        self.queue = MsgQueue(queue_len)
+        self.puback_delay_in_ms = puback_delay_in_ms
+        self.up = asyncio.Event()
+        self.down = asyncio.Event()
+        self.echo = echo
+        self.subscriptions = set()
+        self.published = []   # [(ticks_ms, topic, msg, retain, qos)]
+        self.is_connected = False
+
+    async def resolve(self):
+        pass
+
+    async def connect(self, *, quick=False):
+        self.is_connected = True
+        self.up.set()
+
+    async def subscribe(self, topic, qos=0):
+        self.subscriptions.add(topic)
+
+    async def publish(self, topic, msg, retain=False, qos=0):
+        while (not self.is_connected):   # mqtt_as blocks publish until the connection is back
+            await asyncio.sleep_ms(100)
+        self.published.append((utime.ticks_ms(), topic, msg, retain, qos))
+        if (self.echo and topic in self.subscriptions):
+            self.deliver(topic, msg)
+        await asyncio.sleep_ms(self.puback_delay_in_ms if qos > 0 else 0)
+
+    # Inbound message from another client, e.g. method("topicname/actionname", '{"GP16": 1}')
+    def deliver(self, topic, msg, retained=False):
+        topic = topic.encode() if isinstance(topic, str) else topic
+        msg = msg.encode() if isinstance(msg, str) else msg
+        self.queue.put(topic, msg, retained)
+
+    # Simulate Wi-Fi or broker outage
+    def go_down(self):
+        if (self.is_connected):
+            self.is_connected = False
+            self.down.set()
+
+    def go_up(self):
+        if (not self.is_connected):
+            self.is_connected = True
+            self.up.set()
+
+    # Published messages (str) on a topic, e.g. method("topicname/actionname")
+    def get_published(self, topic=None):
+        return [msg if isinstance(msg, str) else msg.decode() for ticks, t, msg, retain, qos in self.published if topic is None or t == topic]
+
+    def isconnected(self):
+        return self.is_connected
+
+    def close(self):
+        self.is_connected = False
@@ -0,0 +1,59 @@
+
+# Clock for host simulation
+# Drives utime (ticks and RTC) so the same controller code can run on CPython in real time or virtual time
+
+import time as _time
+
+
+# Real clock, monotonic time follows the host clock
+class RealClock:
+
+    # Monotonic time in seconds (float)
+    def monotonic(self):
+        return _time.monotonic()
+
+    # Wall clock time in seconds since epoch (for ntptime)
+    def wall_time(self):
+        return _time.time()
+
+    # Blocking call such as utime.sleep, urequests, wlan.scan (blocks the event loop like on PicoW)
+    def block(self, seconds):
+        if (seconds > 0):
+            _time.sleep(seconds)
+
+
+# Virtual clock, time only moves when the event loop is idle (or a blocking call is simulated)
+# Days of device behaviour can be simulated in seconds, e.g. a 2 hour scheduled publish fires after ~0 real time
+class VirtualClock:
+
+    # wall_start_time: wall clock (seconds since epoch) at virtual time 0, e.g. for NTP sync and schedules
+    def __init__(self, wall_start_time=None):
+        self.now = 0.0
+        self.wall_start_time = _time.time() if wall_start_time is None else wall_start_time
+
+    def monotonic(self):
+        return self.now
+
+    def wall_time(self):
+        return self.wall_start_time + self.now
+
+    def block(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        if (seconds > 0):
+            self.now += seconds
+
+
+clock = RealClock()
+
+
+# Replace the clock used by all simulated modules, e.g. method(VirtualClock())
+def set_clock(new_clock):
+    global clock
+    clock = new_clock
+    return new_clock
+
+
+def get_clock():
+    return clock
@@ -0,0 +1,184 @@
+
+# Core 1 service benchmark in real time with CPython threads: python -m host_sim.core1 [seconds]
+# Runs the same load with core1_enabled False and True: MFA checks on GP16 (2 TOTP keys) every 100 ms, a bouncing contact switch GP0
+# and change detection every 10 ms on the event loop. Reports per mode:
+#   mfa_check   time of is_gpio_mfa_passed() on the event loop
+#   loop_lag    event loop lag measured every 10 ms
+#   contact     time from the last bounce until the event loop sees the change, changes seen
+#   ring        drops and lock contentions of the ring buffers
+# The debounce itself is checked on the virtual clock without the thread (debounce), bounce timing on the event loop depends on the host load
+# Note: CPython threads share the GIL, so SHA1 on the thread still competes with the event loop (on RP2040 both cores run in parallel)
+# The service thread reads the default board (board context is not inherited by threads)
+
+import random
+import sys
+import time
+
+import host_sim
+from host_sim import clock
+
+host_sim.install()
+import uasyncio as asyncio
+from mqtt_tiny_controller_core1 import Core1Service
+
+totp_keys = {16: ["ONSWG4TFOQQHI33UOAQGG3DJMVXHIIBR", "MNWGSZLOOQQDEIDTMVRXEZLU"]}
+bounce_levels = (0, 1, 0, 1, 0, 1, 0)   # Contact switch bouncing for ~24 ms before it settles
+bounce_interval_in_seconds = 0.004
+
+
+def _silent_print(*args, **kwargs):
+    pass
+
+
+# gpio_backend stand-in with contact switch GP0 only
+class BouncingSwitch:
+
+    def __init__(self):
+        self.level = 1
+
+    def read_inputs(self):
+        return self.level
+
+
+# Core1Service debounce on the virtual clock, sample_inputs() is called every sample_period_in_ms and core 0 reads every 10 ms
+# Every press bounces for less than debounce_in_ms, each level held 1 to 3 ms (seeded), then the switch stays settled for 300 ms
+def check_debounce(presses=100, sample_period_in_ms=5, debounce_in_ms=20):
+    rng = random.Random(1)
+    schedule = []       # (ms, level)
+    settled_ms = []     # Time of the last bounce per press
+    now = 0
+    for i in range(presses):
+        for level in bounce_levels[:-1]:
+            schedule.append((now, level if i % 2 == 0 else 1 - level))
+            now += rng.randint(1, (debounce_in_ms - 1) // (len(bounce_levels) - 1))
+        schedule.append((now, bounce_levels[-1] if i % 2 == 0 else 1 - bounce_levels[-1]))
+        settled_ms.append(now)
+        now += 300
+
+    previous_clock = clock.get_clock()
+    virtual_clock = clock.set_clock(clock.VirtualClock())
+    try:
+        switch = BouncingSwitch()
+        service = Core1Service(switch, 1, sample_period_in_ms, debounce_in_ms)
+        service.sample_first()
+        result = {"changes": 0, "presses": presses, "latency": []}
+        seen = service.get_input_levels()
+        index = 0
+        for ms in range(now):
+            virtual_clock.now = ms / 1000
+            while (index < len(schedule) and schedule[index][0] <= ms):
+                switch.level = schedule[index][1]
+                index += 1
+            if (ms % sample_period_in_ms == 0):
+                service.sample_inputs()
+            if (ms % 10 == 0):
+                levels = service.get_input_levels()
+                if (levels != seen):
+                    seen = levels
+                    if (result["changes"] < presses):
+                        result["latency"].append(ms - settled_ms[result["changes"]])
+                    result["changes"] += 1
+    finally:
+        clock.set_clock(previous_clock)
+    print(f"debounce changes={result['changes']} presses={presses} latency min={min(result['latency'])}ms max={max(result['latency'])}ms")
+    return result
+
+
+def percentile(values, p):
+    if (len(values) == 0):
+        return 0
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, (len(ordered) * p + 99) // 100 - 1))]
+
+
+def format_ms(values):
+    return f"n={len(values)} p50={percentile(values, 50):.2f}ms p90={percentile(values, 90):.2f}ms max={max(values) if values else 0:.2f}ms"
+
+
+async def run_mode(core1_enabled, seconds):
+    controller = host_sim.load_controller(fresh=True)
+    controller.print = _silent_print
+    controller.init(core1_enabled=core1_enabled, gpio_pins_for_totp_enabled=totp_keys, loop_lag_monitor_period_in_ms=10)
+    if (core1_enabled):
+        controller.mqtt_core1.start()   # Started by worker() on PicoW
+    board = host_sim.get_board()
+    board.set_input(0, 1)
+    metrics = controller.mqtt_metrics
+    lag_task = asyncio.create_task(controller.loop_lag_monitor(metrics, 10))
+    secret = controller.mqtt_config.totp_secrets["GP16"][1]
+    result = {"mfa": [], "latency": [], "changes": 0, "presses": 0, "mfa_failed": 0}
+    settled = {}   # Expected human readable GP0 value -> time.monotonic() of the last bounce
+
+    async def press_contact():
+        value = 1
+        while True:
+            for level in bounce_levels:
+                board.set_input(0, level if value == 1 else 1 - level)
+                await asyncio.sleep(bounce_interval_in_seconds)
+            settled[value] = time.monotonic()
+            result["presses"] += 1
+            value = 1 - value
+            await asyncio.sleep(0.3)
+
+    async def detect_changes():
+        while True:
+            if (controller.is_gpio_values_changed()):
+                result["changes"] += 1
+                value = controller.get_current_gpio_value("GP0")
+                if (value in settled):
+                    result["latency"].append((time.monotonic() - settled.pop(value)) * 1000)
+                controller.reset_gpio_changed_status()
+            await asyncio.sleep(0.01)
+
+    async def check_mfa():
+        step, code = -1, 0
+        while True:
+            if (controller.utime.time() // 30 != step):
+                step = controller.utime.time() // 30
+                code = controller.get_totp(secret, 1)[0]   # Code sent by the client app
+            controller.mqtt_publish_stats.totp_number = code
+            start = time.perf_counter()
+            if (not controller.is_gpio_mfa_passed("GP16")):
+                result["mfa_failed"] += 1
+            result["mfa"].append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(0.1)
+
+    await asyncio.sleep(0.1)   # Core 1 computes the first TOTP codes
+    tasks = [asyncio.create_task(x()) for x in (press_contact, detect_changes, check_mfa)]
+    await asyncio.sleep(seconds)
+    for task in tasks + [lag_task]:
+        task.cancel()
+
+    lag = metrics.get_histogram("loop_lag_ms")
+    core1 = controller.mqtt_core1
+    print(f"core1_enabled={core1_enabled}")
+    print(f"  mfa_check {format_ms(result['mfa'])} failed={result['mfa_failed']} core1_misses={metrics.get_counter('totp_core1_misses')}")
+    print(f"  loop_lag p90={lag.percentile(90)}ms max={lag.max}ms")
+    print(f"  contact {format_ms(result['latency'])} changes={result['changes']} presses={result['presses']}")
+    if (core1 is not None):
+        core1.stop()
+        print(f"  ring drops={core1.gpio_events.drops + core1.totp_results.drops} lock_contentions={core1.gpio_events.contentions + core1.totp_results.contentions} samples={core1.samples}")
+    return result
+
+
+async def run(seconds):
+    results = {}
+    for core1_enabled in (False, True):
+        results[core1_enabled] = await run_mode(core1_enabled, seconds)
+        await asyncio.sleep(0.1)   # Service thread exits
+    return results
+
+
+def main(seconds=5):
+    results = asyncio.run(run(seconds))
+    debounce = check_debounce()
+    assert results[True]["mfa_failed"] == 0 and results[False]["mfa_failed"] == 0, "MFA check failed"
+    assert len(results[True]["latency"]) > 0, "Contact switch changes were not detected"
+    assert debounce["changes"] <= debounce["presses"], "Bounce should be filtered by core 1"
+    assert debounce["changes"] == debounce["presses"], "Contact switch changes were missed"
+    assert max(debounce["latency"]) <= 20 + 5 + 10, "Debounce latency"   # Debounce, one sample period and one core 0 read (shorter if sampling missed the last bounce)
+    print("Core1 OK")
+
+
+if __name__ == "__main__":
+    sys.exit(main(float(sys.argv[1]) if len(sys.argv) > 1 else 5))
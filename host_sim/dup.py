@@ -0,0 +1,107 @@
+
+# Duplicate QoS1 delivery scenario in virtual time with a local broker stand-in: python -m host_sim.dup
+# Runs the real controller worker and mqtt_as client over CPython sockets, loses the PUBACK of a momentary relay command and drops the connection,
+# so the broker resends the command with the DUP flag after reconnect. Checks that the relay pulses once, that the duplicate is still acknowledged
+# (nothing left unacknowledged on the broker), that it is counted in "dup_discarded", and that later commands are executed again. Then a new
+# command reuses the pid of an acknowledged one with DUP after another reconnect (brokers reuse free pids) and must be executed.
+
+import sys
+
+import host_sim
+from host_sim import loop as virtual_loop
+from host_sim.board import SimBoard, set_board, reset_board
+from host_sim.broker import MQTTBroker
+
+host_sim.install()
+import uasyncio as asyncio
+
+topic = "dup/device1"
+client_id = b"dup1"
+
+
+def _silent_print(*args, **kwargs):
+    pass
+
+
+def is_connected(broker):
+    session = broker.sessions.get(client_id.decode())
+    return session is not None and session.connection is not None and len(session.subscriptions) > 0
+
+
+async def wait_connected(broker, timeout_in_seconds=120):
+    for i in range(timeout_in_seconds * 10):
+        if (is_connected(broker)):
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+
+def get_pulses(board, pin):
+    return board.get_output_history(pin).count(0)   # Momentary relay is active low
+
+
+async def run(result):
+    broker = MQTTBroker()
+    await broker.start()
+    board = SimBoard("dup")
+    token = set_board(board)   # Tasks created here inherit the board
+    try:
+        controller = host_sim.load_controller(fresh=True)
+        controller.print = _silent_print
+        sys.modules["mqtt_tiny_controller_common"].print = _silent_print
+        controller.init(mqtt_topic=topic, mqtt_client_id=client_id, broker_server="127.0.0.1", broker_port=broker.port)
+        controller.init_mqtt_as()
+        controller.config["ssl"] = False
+        controller.config["ssl_params"] = {}
+        client = controller.MQTTClient(controller.config)
+        task = asyncio.create_task(controller.worker(client))
+    finally:
+        reset_board(token)
+
+    result["connected"] = await wait_connected(broker)
+    session = broker.sessions[client_id.decode()]
+    broker.drop_pubacks = True   # PUBACK lost on the link
+    broker.publish(topic, '{"GP18": 1}')
+    command_pid = session.next_pid
+    await asyncio.sleep(10)
+    result["first_pulse"] = get_pulses(board, 18) == 1 and board.get_level(18) == 1
+    result["unacknowledged"] = command_pid in session.inflight
+    result["resent"] = len(session.inflight)   # Also the status published by the device (it subscribes to its own topic)
+
+    broker.drop_pubacks = False
+    session.connection.close()   # Flaky link, the broker resends GP18 with DUP after reconnect
+    result["reconnected"] = await wait_connected(broker)
+    await asyncio.sleep(30)   # Settle window after reconnect and the momentary pulse
+    result["no_second_pulse"] = get_pulses(board, 18) == 1
+    result["duplicate_acknowledged"] = command_pid not in session.inflight
+    result["dup_discarded"] = controller.mqtt_metrics.get_counter("dup_discarded")
+
+    broker.publish(topic, '{"GP18": 1}')   # New message, new pid
+    reused_pid = session.next_pid
+    await asyncio.sleep(10)
+    result["next_command_pulse"] = get_pulses(board, 18) == 2
+
+    session.connection.close()   # The broker sent a new command with the free pid right before the link dropped, resent with DUP
+    result["reconnected_again"] = await wait_connected(broker)
+    session.connection.send_publish(topic, b'{"GP18": 1}', 1, pid=reused_pid)
+    await asyncio.sleep(30)
+    result["reused_pid_pulse"] = get_pulses(board, 18) == 3
+    task.cancel()
+    await broker.stop()
+
+
+def main():
+    result = {}
+    virtual_loop.run_virtual(run(result))
+    for key in result:
+        print(f"{key}={result[key]}")
+
+    for key in ("connected", "first_pulse", "unacknowledged", "reconnected", "no_second_pulse", "duplicate_acknowledged", "next_command_pulse",
+                "reconnected_again", "reused_pid_pulse"):
+        assert result[key], key
+    assert result["dup_discarded"] == result["resent"], "Duplicate counter"
+    print("Dup OK")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+
+# Broker failover scenario in virtual time with two local broker stand-ins: python -m host_sim.failover
+# Runs the real controller worker and mqtt_as client over CPython sockets with broker_failover_servers, then kills the preferred broker and checks
+# that the device fails over to the backup after broker_failover_after_failures failed connects, that commands and status use the same topic
+# there, that it fails back when the preferred broker is up again (TCP probe to the cached address, DNS of the preferred broker fails meanwhile),
+# and that it boots on the backup when the preferred broker is down.
+# Reports failover and fail-back times and connect time per broker.
+
+import json
+import sys
+
+import host_sim
+from host_sim import loop as virtual_loop
+from host_sim.board import SimBoard, set_board, reset_board
+from host_sim.broker import MQTTBroker
+
+host_sim.install()
+import uasyncio as asyncio
+import usocket
+
+topic = "failover/device1"
+client_id = b"failover1"
+
+
+def _silent_print(*args, **kwargs):
+    pass
+
+
+def is_connected(broker):
+    session = broker.sessions.get(client_id.decode())
+    return session is not None and session.connection is not None and len(session.subscriptions) > 0
+
+
+async def wait_connected(broker, timeout_in_seconds):
+    loop = asyncio.get_event_loop()
+    start_time = loop.time()
+    while (not is_connected(broker) and loop.time() - start_time < timeout_in_seconds):
+        await asyncio.sleep(0.1)
+    return is_connected(broker), round(loop.time() - start_time, 1)
+
+
+# Command on the topic of one broker, returns True when the relay switched and the device published the new value on that broker
+# Note: every QoS1 round trip over the real sockets lets the virtual clock jump to the next timer, publishes take seconds in virtual time
+async def send_command(board, broker, name, value, published, timeout_in_seconds=120):
+    pin = int(name[2:])
+    start_index = len(published)
+    broker.publish(topic, json.dumps({name: value}))
+    for i in range(timeout_in_seconds):
+        await asyncio.sleep(1)
+        values = [json.loads(msg).get(name) for broker_name, msg in published[start_index:] if broker_name == broker.host_name and msg.startswith(b"{")]
+        if (value in values):
+            break
+    return board.get_level(pin) == 1 - value and value in values
+
+
+def start_device(primary, backup, probe_in_seconds):
+    board = SimBoard("failover")
+    token = set_board(board)   # Tasks created here inherit the board
+    try:
+        controller = host_sim.load_controller(fresh=True)
+        controller.print = _silent_print
+        sys.modules["mqtt_tiny_controller_common"].print = _silent_print
+        controller.init(mqtt_topic=topic, mqtt_client_id=client_id, broker_server=primary.host_name, broker_port=primary.port,
+                        broker_failover_servers=[{"server": backup.host_name, "port": backup.port}], broker_failback_probe_in_seconds=probe_in_seconds)
+        controller.init_mqtt_as()
+        controller.config["ssl"] = False
+        controller.config["ssl_params"] = {}
+        client = controller.MQTTClient(controller.config)
+        task = asyncio.create_task(controller.worker(client))
+    finally:
+        reset_board(token)
+    return controller, board, task
+
+
+async def run(result):
+    primary, backup = MQTTBroker(), MQTTBroker()
+    published = []   # (broker host name, msg) published by the device
+    for broker, host_name in ((primary, "broker-a.local"), (backup, "broker-b.local")):
+        broker.host_name = host_name
+        usocket.hosts[host_name] = "127.0.0.1"
+        broker.listeners.append(lambda sender_id, t, msg, qos, retain, name=host_name: published.append((name, msg)) if (sender_id and t == topic) else None)
+        await broker.start()
+
+    controller, board, task = start_device(primary, backup, 60)
+    result["boot_on_primary"] = (await wait_connected(primary, 60))[0]
+    result["command_on_primary"] = await send_command(board, primary, "GP16", 1, published)
+
+    await primary.stop()   # Preferred broker outage
+    result["failover"], result["failover_s"] = await wait_connected(backup, 300)
+    result["command_on_backup"] = await send_command(board, backup, "GP16", 0, published)
+
+    usocket.hosts[primary.host_name] = None   # No DNS lookup by the probe, the connect falls back to the last good address
+    await primary.start()   # Probed every 60 seconds
+    result["failback"], result["failback_s"] = await wait_connected(primary, 300)
+    usocket.hosts[primary.host_name] = "127.0.0.1"
+    result["command_after_failback"] = await send_command(board, primary, "GP17", 1, published)
+    pool = controller.mqtt_broker_pool
+    result["connect_ms"] = [x.connect_ms for x in pool.health]
+    metrics = controller.mqtt_metrics
+    for name in ("broker_failovers", "broker_failbacks", "connect_fail"):
+        result[name] = metrics.get_counter(name)
+    task.cancel()
+
+    await primary.stop()   # Power up while the preferred broker is down
+    controller, board, task = start_device(primary, backup, -1)
+    result["boot_on_backup"], result["boot_on_backup_s"] = await wait_connected(backup, 300)
+    task.cancel()
+    await backup.stop()
+
+
+def main():
+    result = {}
+    virtual_loop.run_virtual(run(result))
+    for key in result:
+        print(f"{key}={result[key]}")
+
+    for key in ("boot_on_primary", "command_on_primary", "failover", "command_on_backup", "failback", "command_after_failback", "boot_on_backup"):
+        assert result[key], key
+    assert result["broker_failovers"] == 1 and result["broker_failbacks"] == 1, "Broker counters"
+    print("Failover OK")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+
+# Fleet simulator and load generator against a local broker stand-in (localhost only)
+# Spawns N simulated controllers (each with its own board and copy of the controller module) running the real mqtt_as client
+# over CPython sockets, drives relay commands and contact switch events, injects outages and reports publish rates,
+# end-to-end latencies and reconnect convergence time.
+#
+# e.g. python -m host_sim.fleet --devices 20 --duration 600 --command-rate 1 --contact-rate 0.5 --outage-at 300 --outage-duration 60
+#      python -m host_sim.fleet --devices 5 --state-topic --outage-at 60 --outage-kind wifi   (retained snapshots cleared by last will and restored)
+
+import argparse
+import json
+import random
+import sys
+
+import host_sim
+from host_sim import loop as virtual_loop
+from host_sim.board import SimBoard, set_board, reset_board
+from host_sim.broker import MQTTBroker
+
+host_sim.install()
+import uasyncio as asyncio
+
+
+def _silent_print(*args, **kwargs):
+    pass
+
+
+# Percentile of a list of numbers, e.g. method([1, 2, 3, 4], 50) returns 2
+def percentile(values, p):
+    if (len(values) == 0):
+        return 0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, (len(ordered) * p + 99) // 100 - 1))
+    return ordered[index]
+
+
+def format_latency(values):
+    if (len(values) == 0):
+        return "n=0"
+    return f"n={len(values)} p50={percentile(values, 50):.0f}ms p90={percentile(values, 90):.0f}ms p99={percentile(values, 99):.0f}ms max={max(values):.0f}ms"
+
+
+# One simulated controller: own board (pins, Wi-Fi), own controller module globals, own mqtt_as client
+class SimDevice:
+
+    def __init__(self, index, verbose=False, state_topic=False):
+        self.name = f"device{index}"
+        self.topic = f"fleet/{self.name}"
+        self.state_topic = f"{self.topic}/state" if state_topic else ""
+        self.board = SimBoard(self.name)
+        self.controller = host_sim.load_controller(fresh=True)
+        if (not verbose):
+            self.controller.print = _silent_print
+            sys.modules["mqtt_tiny_controller_common"].print = _silent_print
+        self.client = None
+        self.task = None
+
+    # Start the device like main() does, but against the local broker and without TLS
+    def start(self, broker_port):
+        token = set_board(self.board)   # Tasks created here inherit the board
+        try:
+            controller = self.controller
+            controller.init(mqtt_topic=self.topic, mqtt_state_topic=self.state_topic, mqtt_client_id=self.name.encode())
+            controller.init_mqtt_as()
+            config = controller.config
+            config["server"] = "127.0.0.1"
+            config["port"] = broker_port
+            config["ssl"] = False
+            config["ssl_params"] = {}
+            self.client = controller.MQTTClient(config)
+            self.task = asyncio.create_task(controller.worker(self.client))
+        finally:
+            reset_board(token)
+
+    def get_relay_names(self):
+        c = self.controller
+        return [c.mqtt_config.gpio_names[x] for x in sorted(c.mqtt_config.gpio_pins_for_relay_switch)]
+
+    def get_contact_pins(self):
+        return list(self.controller.mqtt_config.contact_pins)
+
+
+# Match expected values against device responses to measure end-to-end latency
+class LatencyTracker:
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.pending = {}   # (device topic, key) -> (value, sent time, kind)
+        self.latencies = {"command": [], "contact": []}
+        self.replaced = 0
+        self.last_seq = {}   # Device topic -> last SEQ seen in status publishes
+        self.seq_gaps = 0
+
+    def expect(self, topic, key, value, kind):
+        if ((topic, key) in self.pending):
+            self.replaced += 1   # Previous change was never reported (e.g. rejected by burnout protection)
+        self.pending[(topic, key)] = (value, self.loop.time(), kind)
+
+    def on_publish(self, sender_id, topic, msg, qos, retain):
+        if (sender_id is None):
+            return
+        try:
+            payload = json.loads(msg)
+        except ValueError:
+            return
+        if (not isinstance(payload, dict) or "TIME" not in payload):
+            return
+        if ("SEQ" in payload and "SINCE" not in payload and not retain):   # Retained snapshots skip SEQ numbers
+            last_seq = self.last_seq.get(topic)
+            if (last_seq is not None and payload["SEQ"] > last_seq + 1):
+                self.seq_gaps += 1
+            if (last_seq is None or payload["SEQ"] > last_seq or payload["SEQ"] == 1):   # Ignore QoS1 redelivery, SEQ 1 after device restart
+                self.last_seq[topic] = payload["SEQ"]
+        for key in payload:
+            expected = self.pending.get((topic, key))
+            if (expected is not None and expected[0] == payload[key]):
+                del self.pending[(topic, key)]
+                self.latencies[expected[2]].append((self.loop.time() - expected[1]) * 1000)
+
+
+class Fleet:
+
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.broker = MQTTBroker()
+        self.devices = []
+        self.relay_state = {}   # (topic, key) -> last commanded value
+        self.convergence = []   # Reconnect convergence time (seconds) per outage
+        self._resubscribed = None
+        self.state_publishes = 0
+
+    async def command_load(self):
+        while True:
+            await asyncio.sleep(self.rng.expovariate(self.args.command_rate))
+            device = self.rng.choice(self.devices)
+            key = self.rng.choice(device.get_relay_names())
+            value = 1 - self.relay_state.get((device.topic, key), 0)
+            self.relay_state[(device.topic, key)] = value
+            self.tracker.expect(device.topic, key, value, "command")
+            self.broker.publish(device.topic, json.dumps({key: value}), qos=1)
+
+    async def contact_load(self):
+        while True:
+            await asyncio.sleep(self.rng.expovariate(self.args.contact_rate))
+            device = self.rng.choice(self.devices)
+            pin_id = self.rng.choice(device.get_contact_pins())
+            level = 1 - device.board.get_level(pin_id)
+            device.board.set_input(pin_id, level)
+            key = device.controller.mqtt_config.gpio_names[pin_id]
+            self.tracker.expect(device.topic, key, 1 - level, "contact")   # Pull up input, connected (0) is reported as 1
+
+    # Retained snapshot matches the device GPIO values, e.g. what a dashboard connecting now would see
+    def is_snapshot_current(self, device):
+        snapshot = json.loads(self.broker.retained[device.state_topic])
+        status = device.controller.get_gpio_status(True)
+        return all([snapshot.get(key) == status[key] for key in status])
+
+    def on_state_publish(self, sender_id, topic, msg, qos, retain):
+        if (retain and topic.endswith("/state")):
+            self.state_publishes += 1
+
+    def on_subscribe(self, client_id, topic_filters):
+        if (self._resubscribed is not None):
+            self._resubscribed.add(client_id)
+
+    # Broker outage (all connections dropped) or Wi-Fi outage (all boards lose the SSID)
+    async def outage(self):
+        await asyncio.sleep(self.args.outage_at)
+        if (self.args.outage_kind == "broker"):
+            await self.broker.stop()
+        else:
+            for device in self.devices:
+                device.board.wifi_available = False
+        await asyncio.sleep(self.args.outage_duration)
+        self._resubscribed = set()
+        restored_time = self.loop.time()
+        if (self.args.outage_kind == "broker"):
+            await self.broker.start()
+        else:
+            for device in self.devices:
+                device.board.wifi_available = True
+        while len(self._resubscribed) < len(self.devices):
+            await asyncio.sleep(0.1)
+        self.convergence.append(self.loop.time() - restored_time)
+        self._resubscribed = None
+
+    async def run(self):
+        self.loop = asyncio.get_event_loop()
+        self.tracker = LatencyTracker(self.loop)
+        self.broker.listeners.append(self.tracker.on_publish)
+        self.broker.listeners.append(self.on_state_publish)
+        self.broker.subscribe_listeners.append(self.on_subscribe)
+        await self.broker.start()
+
+        for i in range(self.args.devices):
+            device = SimDevice(i, self.args.verbose, self.args.state_topic)
+            device.board.wifi_association_delay_in_ms = self.args.wifi_delay * 1000   # Power up: Wi-Fi associates while the boot sequence waits
+            device.board.ntp_latency_in_ms = self.args.ntp_latency * 1000
+            self.devices.append(device)
+            device.start(self.broker.port)
+            await asyncio.sleep(self.rng.uniform(0, self.args.start_jitter))
+        await asyncio.sleep(self.args.warmup)   # First connect (clean session, then unclean session) and first full publish
+
+        start_time = self.loop.time()
+        start_publishes = self.broker.stats.publishes_in
+        tasks = []
+        if (self.args.command_rate > 0):
+            tasks.append(asyncio.create_task(self.command_load()))
+        if (self.args.contact_rate > 0):
+            tasks.append(asyncio.create_task(self.contact_load()))
+        if (self.args.outage_at >= 0):
+            tasks.append(asyncio.create_task(self.outage()))
+        await asyncio.sleep(self.args.duration)
+        for task in tasks:
+            task.cancel()
+        elapsed = self.loop.time() - start_time
+        if (self.args.state_topic):
+            await asyncio.sleep(15)   # Let pending changes reach the snapshots (worker publishes every 5 seconds)
+        self.report(elapsed, self.broker.stats.publishes_in - start_publishes)
+        for device in self.devices:
+            device.task.cancel()
+        await self.broker.stop()
+
+    # Boot phase durations from the gauges of each device (p50), e.g. "boot_first_publish n=3 p50=1200ms ... phases p50 wifi=1000ms dns=0ms ..."
+    def format_boot(self):
+        gauges = [device.controller.mqtt_metrics.gauges for device in self.devices]
+        phases = " ".join([f"{name}={percentile([g[f'boot_{name}_ms'] for g in gauges if f'boot_{name}_ms' in g], 50)}ms" for name in ("hardware", "wifi", "dns", "broker", "ntp", "online")])
+        return f"boot_first_publish {format_latency([g['boot_first_publish_ms'] for g in gauges if 'boot_first_publish_ms' in g])} phases p50 {phases}"
+
+    def report(self, elapsed, publishes):
+        stats = self.broker.stats
+        print(f"devices={len(self.devices)} duration={elapsed:.0f}s time={'real' if self.args.realtime else 'virtual'}")
+        print(f"publish_rate={publishes / elapsed:.2f}/s per_device={publishes / elapsed / len(self.devices):.3f}/s delivered={stats.publishes_out} bytes_in={stats.bytes_in} bytes_out={stats.bytes_out}")
+        print(f"command_latency {format_latency(self.tracker.latencies['command'])}")
+        print(f"contact_latency {format_latency(self.tracker.latencies['contact'])}")
+        print(f"unanswered={len(self.tracker.pending) + self.tracker.replaced} connects={stats.connects} wills={stats.wills} queued_offline={stats.queued_offline} seq_gaps={self.tracker.seq_gaps}")
+        if (self.args.state_topic):
+            retained = [device for device in self.devices if device.state_topic in self.broker.retained]
+            matching = [device for device in retained if self.is_snapshot_current(device)]
+            print(f"retained_snapshots={len(retained)}/{len(self.devices)} current={len(matching)} state_topic_publishes={self.state_publishes}")
+        print(self.format_boot())
+        for i in range(len(self.convergence)):
+            print(f"reconnect_convergence={self.convergence[i]:.1f}s ({self.args.outage_kind} outage {self.args.outage_duration}s)")
+        if (self.args.outage_at >= 0 and len(self.convergence) == 0):
+            print("reconnect_convergence=not converged")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fleet simulator and load generator against a local broker stand-in")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=300, help="measured run time in seconds (after warmup)")
+    parser.add_argument("--warmup", type=float, default=30)
+    parser.add_argument("--start-jitter", type=float, default=0.5, help="max delay between device power ups in seconds")
+    parser.add_argument("--command-rate", type=float, default=0.5, help="relay commands per second across the fleet")
+    parser.add_argument("--contact-rate", type=float, default=0.2, help="contact switch changes per second across the fleet")
+    parser.add_argument("--outage-at", type=float, default=-1, help="seconds after warmup to start an outage, -1 disable")
+    parser.add_argument("--outage-duration", type=float, default=30)
+    parser.add_argument("--outage-kind", choices=["broker", "wifi"], default="broker")
+    parser.add_argument("--state-topic", action="store_true", help="devices publish a retained snapshot on <topic>/state")
+    parser.add_argument("--wifi-delay", type=float, default=1.5, help="Wi-Fi association time after power up in seconds")
+    parser.add_argument("--ntp-latency", type=float, default=0.2, help="blocking NTP request time in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--realtime", action="store_true", help="run in real time instead of virtual time")
+    parser.add_argument("--verbose", action="store_true", help="show controller output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    fleet = Fleet(args)
+    if (args.realtime):
+        asyncio.run(fleet.run())
+    else:
+        virtual_loop.run_virtual(fleet.run())
+    return fleet
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+
+# Simulated GPIO backend for host simulation
+# Reads and writes the board pin states directly with masks (like the RP2040 SIO registers), and counts bulk operations
+# so scenarios can check that change detection reads all pins at once and multi-relay commands write once.
+
+import utime
+from mqtt_tiny_controller_gpio import PinGpioBackend, gpio_backend_classes
+from host_sim.board import get_board
+
+
+class SimGpioBackend(PinGpioBackend):
+
+    def __init__(self):
+        super().__init__()
+        self.board = get_board()   # Board of the device creating the backend (controller init)
+        self.read_counter = 0    # Number of read_inputs() calls
+        self.apply_counter = 0   # Number of apply() calls that changed at least one pin
+
+    def read(self, pin_id):
+        return self.board.get_level(pin_id)
+
+    def read_inputs(self):
+        self.read_counter += 1
+        levels = 0
+        for pin_id in self.pins:
+            if (self.board.get_level(pin_id)):
+                levels |= 1 << pin_id
+        return levels
+
+    def apply(self, set_mask, clear_mask):
+        set_mask &= self.output_mask
+        clear_mask &= self.output_mask
+        if (set_mask == 0 and clear_mask == 0):
+            return
+        self.apply_counter += 1
+        ticks = utime.ticks_ms()   # All pins of one apply() switch at the same time
+        for pin_id in self.pins:
+            bit = 1 << pin_id
+            if (set_mask & bit or clear_mask & bit):
+                value = 1 if set_mask & bit else 0
+                self.board.get_pin(pin_id).level = value
+                self.board.outputs.append((ticks, pin_id, value))
+
+
+gpio_backend_classes["sim"] = SimGpioBackend
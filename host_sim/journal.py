@@ -0,0 +1,176 @@
+
+# State journal scenario in virtual time against a temp directory: python -m host_sim.journal
+# Runs the real controller worker with journal_enabled, cuts the power (no final flush) and checks that a fresh controller on a
+# and that torn records and a torn compaction are skipped. A relay disabled by the opt-in lockout stays disabled after the restart,
+# and a failed flash write (full or worn flash) keeps the changes pending until a later flush writes them
+# and that torn records and a torn compaction are skipped
+
+import os
+import sys
+import tempfile
+
+import host_sim
+from host_sim import loop as virtual_loop
+from host_sim.board import SimBoard, set_board, reset_board
+
+host_sim.install()
+import uasyncio as asyncio
+from host_sim.client import SimMQTTClient
+import mqtt_tiny_controller_journal
+from mqtt_tiny_controller_journal import StateJournal
+
+
+def get_overrides(path_prefix):
+    return {"journal_enabled": True, "journal_file_prefix": path_prefix, "journal_flush_interval_in_seconds": 30}
+
+
+# Power on, GP16 on, one outage, a 10 minutes toggle flood on GP17, then power is cut while GP18 (momentary) is pressed
+async def run_before_power_cut(controller, result):
+    controller.init()
+    client = SimMQTTClient()
+    worker_task = asyncio.create_task(controller.worker(client))
+    await asyncio.sleep(60)
+    topic = controller.mqtt_config.mqtt_topic
+
+    client.deliver(topic, '{"GP16": 1}')
+    client.go_down()
+    await asyncio.sleep(10)
+    client.go_up()
+    await asyncio.sleep(60)
+
+    writes = controller.mqtt_journal.writes
+    value = 1
+    for i in range(600):
+        client.deliver(topic, '{"GP17": %d}' % value)
+        value = 1 - value
+        await asyncio.sleep(1)
+    client.deliver(topic, '{"GP17": 0}')
+    await asyncio.sleep(120)   # Burnout protection applies the last value, then the journal writes it
+    result["flood_writes"] = controller.mqtt_journal.writes - writes
+
+    client.deliver(topic, '{"GP18": 1}')
+    await asyncio.sleep(0.5)
+    result["gp18_pressed"] = host_sim.get_board().get_level(18) == 0
+    result["outages"] = controller.mqtt_publish_stats.outage_counter
+    result["seq"] = controller.mqtt_publish_stats.state_seq
+    worker_task.cancel()   # Power cut, no final flush
+
+
+def check_torn_records(path_prefix, result):
+    journal = StateJournal(path_prefix)
+    state = journal.load()
+    with open(journal.paths[journal.active], "a") as f:
+        f.write('0badc0de {"GP16": 0, "se')   # Power lost while appending
+    journal = StateJournal(path_prefix)
+    result["torn_record_skipped"] = journal.load() == state and journal.corrupt_records == 1
+
+
+def check_compaction(directory, result):
+    path_prefix = os.path.join(directory, "compaction")
+    journal = StateJournal(path_prefix, 256)
+    for i in range(200):
+        journal.update({"GP16": i % 2, "seq": i})
+        journal.flush(True)
+    result["compactions"] = journal.compactions
+    result["compacted_size_ok"] = journal.size <= 256 + 64
+    result["compacted_files"] = len([x for x in os.listdir(directory) if x.startswith("compaction")])
+    inactive_path = journal.paths[1 - journal.active]
+    with open(inactive_path, "w") as f:
+        f.write('00000000 {"_gen": 999, "GP16"')   # Power lost while compacting into the other file
+    reloaded = StateJournal(path_prefix, 256)
+    result["torn_compaction_skipped"] = reloaded.load() == {"GP16": 1, "seq": 199}
+
+
+# open() of the journal module raising OSError once (flash full or worn)
+def fail_next_open():
+    def failing_open(*args, **kwargs):
+        del mqtt_tiny_controller_journal.open
+        raise OSError(28, "No space left on device")
+    mqtt_tiny_controller_journal.open = failing_open
+
+
+# A failed write (compaction of the first write, then an append) is retried by the next flush, the value is not lost
+def check_failed_write_retried(directory, result):
+    path_prefix = os.path.join(directory, "failed")
+    journal = StateJournal(path_prefix)
+    retried = []
+    for values in ({"a": 1}, {"a": 2}):
+        journal.update(values)
+        fail_next_open()
+        try:
+            journal.flush(True)
+            retried.append(False)
+        except OSError:
+            pass
+        journal.update(values)   # Same value again (e.g. next save_journal_state round)
+        retried.append(journal.is_dirty() and journal.flush(True) and StateJournal(path_prefix).load() == values)
+    result["failed_write_retried"] = retried == [True, True]
+
+
+# Relay disabled by the opt-in lockout before a power blip stays disabled after restart
+def check_lockout_restored(directory, result):
+    path_prefix = os.path.join(directory, "lockout")
+    journal = StateJournal(path_prefix)
+    journal.update({"GP17": 0, "GP17.violations": 5})   # hardware_violation_max=3
+    journal.flush(True)
+    token = set_board(SimBoard("lockout"))
+    try:
+        restored = host_sim.load_controller(fresh=True)
+        restored.init(hardware_lockout_enabled=True, **get_overrides(path_prefix))
+        result["lockout_restored"] = not restored.mqtt_gpio_hardware["GP17"].is_modified_allowed and restored.mqtt_gpio_hardware["GP16"].is_modified_allowed
+    finally:
+        reset_board(token)
+
+
+def main():
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path_prefix = os.path.join(directory, "mqtt_journal")
+
+        token = set_board(SimBoard("before"))
+        try:
+            controller = host_sim.load_controller(fresh=True)
+            controller.config_overrides.update(get_overrides(path_prefix))
+            virtual_loop.run_virtual(run_before_power_cut(controller, result), wall_start_time=1767571200)
+        finally:
+            reset_board(token)
+
+        board = SimBoard("after")   # Power blip: pins are reset
+        token = set_board(board)
+        try:
+            restored = host_sim.load_controller(fresh=True)
+            restored.init(**get_overrides(path_prefix))
+            result["gp16_restored_on"] = board.get_level(16) == 0 and restored.get_current_gpio_value("GP16") == 1
+            result["gp17_restored_off"] = board.get_level(17) == 1
+            result["gp18_momentary_off"] = board.get_level(18) == 1
+            result["outages_restored"] = restored.mqtt_publish_stats.outage_counter
+            result["seq_restored"] = restored.mqtt_publish_stats.state_seq
+        finally:
+            reset_board(token)
+
+        check_torn_records(path_prefix, result)
+        check_compaction(directory, result)
+        check_lockout_restored(directory, result)
+        check_failed_write_retried(directory, result)
+
+    for key in result:
+        print(f"{key}={result[key]}")
+
+    max_flood_writes = 720 // 30 + 1   # One write every journal_flush_interval_in_seconds during flood and drain
+    assert result["gp18_pressed"], "GP18 should be pressed when the power is cut"
+    assert result["gp16_restored_on"], "GP16 should be restored on"
+    assert result["gp17_restored_off"], "GP17 should be restored off"
+    assert result["gp18_momentary_off"], "Momentary relay should start off"
+    assert result["outages_restored"] == result["outages"] == 1, "Outage counter not restored"
+    assert 0 < result["seq_restored"] <= result["seq"], "SEQ not restored"
+    assert 0 < result["flood_writes"] <= max_flood_writes, "Journal writes should be rate limited"
+    assert result["torn_record_skipped"], "Torn record should be skipped"
+    assert result["compactions"] > 1 and result["compacted_size_ok"] and result["compacted_files"] == 1, "Journal should be compacted into one file"
+    assert result["torn_compaction_skipped"], "Torn compaction should be skipped"
+    assert result["lockout_restored"], "Relay disabled by the lockout should stay disabled after restart"
+    assert result["failed_write_retried"], "Failed journal write should be retried"
+    print("Journal OK")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+
+# LAN control endpoint scenario in virtual time over loopback sockets: python -m host_sim.lan
+# Runs the real controller worker with lan_enabled and a SimMQTTClient as broker, then sends JSON lines over TCP and checks that
+# MFA is required, relays switch right away, changes are mirrored to the broker, relays can be switched while the broker is down
+# (published after reconnect), and that extra clients, long lines, lines without newline and idle connections are closed. Checks that a code used
+# on one connection is rejected on another (replay) and that bad codes close the connection and reject LAN codes for lan_mfa_backoff_in_seconds.
+# Round trips are measured in real time.
+
+import json
+import socket
+import sys
+import time
+
+import host_sim
+from host_sim import loop as virtual_loop
+from host_sim.board import SimBoard, set_board, reset_board
+
+host_sim.install()
+import uasyncio as asyncio
+from host_sim.client import SimMQTTClient
+
+lan_key = "ONSWG4TFOQQHI33UOAQGG3DJMVXHIIBR"
+gp17_key = "MNWGSZLOOQQDEIDTMVRXEZLU"   # GP17 has its own key, a LAN code alone is not enough
+
+
+def _silent_print(*args, **kwargs):
+    pass
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LanClient:
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.rtt_ms = []
+
+    # Send one line, returns the response as dict (None if the connection was closed)
+    async def send(self, line):
+        start = time.perf_counter()
+        self.writer.write(line.encode() + b"\n")
+        await self.writer.drain()
+        response = await self.reader.readline()
+        self.rtt_ms.append((time.perf_counter() - start) * 1000)
+        return json.loads(response) if response else None
+
+    async def is_closed(self):
+        try:
+            return await asyncio.wait_for(self.reader.read(1), 1) == b""
+        except (asyncio.TimeoutError, ConnectionError):
+            return False
+
+
+async def connect(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    return LanClient(reader, writer)
+
+
+async def run(controller, port, result):
+    board = host_sim.get_board()
+    controller.init(lan_enabled=True, lan_port=port, lan_totp_secrets=[lan_key], gpio_pins_for_totp_enabled={17: [gp17_key]})
+    client = SimMQTTClient()
+    worker_task = asyncio.create_task(controller.worker(client))
+    await asyncio.sleep(10)   # Boot and relay cooldown after power up
+    topic = controller.mqtt_config.mqtt_topic
+    secret = controller.mqtt_config.lan_totp_secrets[0]
+
+    def get_code():
+        return controller.get_totp(secret, 1)[0]
+
+    def get_published_gpio(name):
+        values = [json.loads(x).get(name) for x in client.get_published(topic) if x.startswith("{")]
+        return [x for x in values if x is not None]
+
+    lan = await connect(port)
+    response = await lan.send('{"GP16": 1}')
+    result["no_mfa_rejected"] = response == {"ERROR": "MFA", "TIME": response.get("TIME")} and board.get_level(16) == 1
+    response = await lan.send('hello')
+    result["not_json_rejected"] = response.get("ERROR") == "JSON"
+
+    response = await lan.send('{"GP16": 1, "MFA": %d}' % get_code())
+    result["gp16_on"] = response.get("GP16") == 1 and board.get_level(16) == 0
+    await asyncio.sleep(6)   # Next worker round publishes the change
+    result["gp16_on_mirrored"] = get_published_gpio("GP16")[-1:] == [1]
+
+    response = await lan.send('{"GP17": 1, "MFA": %d}' % get_code())
+    result["gp17_own_key_required"] = response.get("GP17") == 0 and board.get_level(17) == 1
+
+    client.go_down()   # Internet is down, Wi-Fi is up
+    await asyncio.sleep(1)
+    published = len(client.published)
+    used_code = get_code()
+    response = await lan.send('{"GP16": 0, "MFA": %d}' % used_code)
+    result["gp16_off_while_down"] = response.get("GP16") == 0 and board.get_level(16) == 1
+    await asyncio.sleep(10)
+    result["nothing_published_while_down"] = len(client.published) == published
+    client.go_up()
+    await asyncio.sleep(10)
+    result["gp16_off_mirrored"] = get_published_gpio("GP16")[-1:] == [0]
+
+    second = await connect(port)
+    third = await connect(port)
+    result["third_client_closed"] = await third.is_closed()
+    response = await second.send('{"GP16": 1, "MFA": %d}' % used_code)   # Code sniffed on the LAN
+    result["replay_rejected"] = response.get("ERROR") == "MFA" and board.get_level(16) == 1
+    await asyncio.sleep(30 - controller.utime.time() % 30 + 1)   # Next code
+    response = await second.send('{"CMD": "refresh", "MFA": %d}' % get_code())
+    result["second_client_ok"] = response.get("GP16") == 0
+    second.writer.write(b'{"GP16": 1, "X": "' + b"x" * 300 + b'"}\n')
+    await second.writer.drain()
+    result["long_line_closed"] = await second.is_closed()
+    flood = await connect(port)
+    flood.writer.write(b"x" * 4096)   # No newline
+    await flood.writer.drain()
+    result["no_newline_closed"] = await flood.is_closed()
+
+    brute = await connect(port)
+    responses = [await brute.send('{"GP16": 1, "MFA": %d}' % ((get_code() + 1 + i) % 1000000)) for i in range(controller.mqtt_config.lan_mfa_max_failures)]
+    result["brute_force_closed"] = all([x.get("ERROR") == "MFA" for x in responses]) and await brute.is_closed()
+    backoff = await connect(port)
+    response = await backoff.send('{"GP16": 1, "MFA": %d}' % get_code())
+    result["backoff_rejected"] = response.get("ERROR") == "MFA" and await backoff.is_closed() and board.get_level(16) == 1
+
+    await asyncio.sleep(controller.mqtt_config.lan_idle_timeout_in_seconds + 1)   # Longer than lan_mfa_backoff_in_seconds
+    result["idle_closed"] = await lan.is_closed()
+    after_backoff = await connect(port)
+    response = await after_backoff.send('{"CMD": "refresh", "MFA": %d}' % get_code())
+    result["accepted_after_backoff"] = response.get("GP16") == 0
+    after_backoff.writer.close()
+    await asyncio.sleep(0.1)
+    result["rtt_p50_ms"] = round(sorted(lan.rtt_ms)[len(lan.rtt_ms) // 2], 2)   # Real time, loopback
+    metrics = controller.mqtt_metrics
+    for name in ("lan_connections", "lan_commands", "lan_rejected", "lan_timeouts", "lan_mfa_failed", "lan_mfa_replayed", "lan_mfa_backoffs"):
+        result[name] = metrics.get_counter(name)
+    worker_task.cancel()
+    controller.mqtt_lan.close()
+
+
+def main():
+    result = {}
+    token = set_board(SimBoard("lan"))
+    try:
+        controller = host_sim.load_controller(fresh=True)
+        controller.print = _silent_print
+        virtual_loop.run_virtual(run(controller, get_free_port(), result), wall_start_time=1767571200)
+    finally:
+        reset_board(token)
+
+    for key in result:
+        print(f"{key}={result[key]}")
+
+    for key in ("no_mfa_rejected", "not_json_rejected", "gp16_on", "gp16_on_mirrored", "gp17_own_key_required", "gp16_off_while_down",
+                "nothing_published_while_down", "gp16_off_mirrored", "third_client_closed", "replay_rejected", "second_client_ok", "long_line_closed",
+                "no_newline_closed", "brute_force_closed", "backoff_rejected", "idle_closed", "accepted_after_backoff"):
+        assert result[key], key
+    assert result["lan_timeouts"] == 1 and result["lan_rejected"] == 3, "LAN counters"
+    assert result["lan_mfa_failed"] == 1 + 1 + 5 + 1 and result["lan_mfa_replayed"] == 1 and result["lan_mfa_backoffs"] == 1, "LAN MFA counters"
+    print("LAN OK")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+
+# Virtual time event loop for host simulation
+# asyncio sleeps and utime read the same VirtualClock. When no task is ready, the clock jumps to the next timer instead of waiting,
+# so burnout protection, publish safeguards, scheduled publish and NTP schedules can be exercised over days in seconds.
+#
+# e.g.
+#     clock = host_sim.loop.run_virtual(main())    # main() can await asyncio.sleep(86400) and returns immediately in real time
+
+import asyncio
+import selectors
+from host_sim import clock as _clock
+
+
+# Selector that never waits in real time while timers are pending, it advances the virtual clock instead
+# Real file descriptors (e.g. sockets to a local broker) are still polled, so I/O keeps working in virtual time
+class VirtualSelector(selectors.BaseSelector):
+
+    def __init__(self, virtual_clock):
+        self._selector = selectors.DefaultSelector()
+        self._clock = virtual_clock
+
+    def register(self, fileobj, events, data=None):
+        return self._selector.register(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        return self._selector.unregister(fileobj)
+
+    def modify(self, fileobj, events, data=None):
+        return self._selector.modify(fileobj, events, data)
+
+    def get_key(self, fileobj):
+        return self._selector.get_key(fileobj)
+
+    def get_map(self):
+        return self._selector.get_map()
+
+    def close(self):
+        self._selector.close()
+
+    def select(self, timeout=None):
+        ready = self._selector.select(0)
+        if (ready or timeout == 0):
+            return ready
+        if (timeout is None):   # Nothing scheduled, only real I/O can wake the loop up
+            return self._selector.select(None)
+        self._clock.advance(timeout)
+        return []
+
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self, virtual_clock):
+        self.virtual_clock = virtual_clock
+        super().__init__(VirtualSelector(virtual_clock))
+
+    def time(self):
+        return self.virtual_clock.monotonic()
+
+
+# Create a virtual clock and event loop, and make the clock the time source of all simulated modules
+def new_virtual_loop(wall_start_time=None):
+    virtual_clock = _clock.set_clock(_clock.VirtualClock(wall_start_time))
+    return VirtualEventLoop(virtual_clock)
+
+
+# Run coroutine in virtual time and return the loop (loop.virtual_clock.now is the simulated duration)
+# The clock stays installed after the run, so results can be inspected with utime
+def run_virtual(coro, wall_start_time=None):
+    loop = new_virtual_loop(wall_start_time)
+    try:
+        loop.run_until_complete(coro)
+    finally:
+        _cancel_all_tasks(loop)
+        loop.close()
+    return loop
+
+
+def _cancel_all_tasks(loop):
+    tasks = [task for task in asyncio.all_tasks(loop) if not task.done()]
+    for task in tasks:
+        task.cancel()
+    if (tasks):
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
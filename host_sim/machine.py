@@ -0,0 +1,98 @@
+
+# Simulated "machine" module for host simulation (subset used by mqtt_tiny_controller and mqtt_as)
+
+from host_sim import utime
+from host_sim.board import get_board, MachineReset
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    # e.g. Pin(16, mode=Pin.OUT, value=1) or Pin(0, Pin.IN, Pin.PULL_UP)
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.board = get_board()
+        self.pin_id = pin_id
+        self.state = self.board.get_pin(pin_id)
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if (mode != -1):
+            self.state.mode = mode
+        if (pull != -1):
+            self.state.pull = pull
+        if (value is not None):
+            self.value(value)
+
+    def value(self, value=None):
+        if (value is None):
+            return self.state.read()
+        value = 1 if value else 0
+        self.state.level = value
+        self.board.outputs.append((utime.ticks_ms(), self.pin_id, value))
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def toggle(self):
+        self.value(1 - self.state.level)
+
+    def __repr__(self):
+        return f"Pin({self.pin_id})"
+
+
+# ADC, channel 4 is the internal temperature sensor on RP2040
+class ADC:
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    # Inverse of the RP2040 datasheet formula, temp = 27 - (volt - 0.706) / 0.001721
+    def read_u16(self):
+        if (self.channel == 4):
+            volt = 0.706 - (get_board().temperature_celcius - 27) * 0.001721
+            return max(0, min(65535, int(volt * 65535 / 3.3)))
+        return 0
+
+
+# RTC, datetime tuple is (year, month, day, weekday, hours, minutes, seconds, subseconds)
+class RTC:
+
+    def datetime(self, datetime_tuple=None):
+        rtc = get_board().rtc
+        if (datetime_tuple is None):
+            t = utime.localtime(int(rtc.time()))
+            return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+        y, mo, d, wd, h, mi, s, ss = datetime_tuple
+        rtc.set_time(utime.mktime((y, mo, d, h, mi, s, 0, 0)))
+
+
+# Reset the board. Raises MachineReset unless reset_hook is set on the board and returns normally
+def reset():
+    board = get_board()
+    board.reset_counter += 1
+    if (board.reset_hook is not None):
+        board.reset_hook(board)
+        return
+    raise MachineReset(board.name)
+
+
+def soft_reset():
+    reset()
+
+
+def unique_id():
+    return get_board().unique_id
+
+
+def freq(value=None):
+    return 125000000
@@ -0,0 +1,14 @@
+
+# Simulated "micropython" module for host simulation
+
+
+def const(value):
+    return value
+
+
+def mem_info(*args):
+    pass
+
+
+def opt_level(*args):
+    return 0
@@ -0,0 +1,80 @@
+
+# Simulated "network" module for host simulation (network.WLAN of PicoW CYW43)
+
+from host_sim import clock as _clock
+from host_sim import utime
+from host_sim.board import get_board
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_GOT_IP = 3
+STAT_CONNECT_FAIL = -1
+STAT_NO_AP_FOUND = -2
+STAT_WRONG_PASSWORD = -3
+
+
+# WLAN(STA_IF) returns the Wi-Fi interface of the current board, like PicoW there is only one interface
+class WLAN:
+
+    def __init__(self, interface_id=STA_IF):
+        self._wlan = get_board().wlan
+
+    def active(self, value=None):
+        if (value is None):
+            return self._wlan._active
+        self._wlan._active = bool(value)
+        if (not value):
+            self._wlan._connect_started = None
+
+    def connect(self, ssid=None, key=None):
+        wlan = self._wlan
+        wlan._ssid = ssid
+        wlan.connect_counter += 1
+        board = wlan.board
+        if (board.wifi_ssid is not None and ssid != board.wifi_ssid):
+            wlan._connect_started = None
+            return
+        wlan._connect_started = _clock.get_clock().monotonic()
+
+    def disconnect(self):
+        self._wlan._connect_started = None
+
+    def isconnected(self):
+        return self._wlan._connected()
+
+    def status(self, param=None):
+        wlan = self._wlan
+        if (param == "rssi"):
+            return wlan.board.wifi_rssi
+        if (param is not None):
+            raise ValueError("unknown status param")
+        if (wlan._connected()):
+            return STAT_GOT_IP
+        if (wlan._connect_started is None):
+            return STAT_IDLE
+        if (not wlan.board.wifi_available):
+            return STAT_NO_AP_FOUND
+        return STAT_CONNECTING
+
+    def ifconfig(self):
+        if (self._wlan._connected()):
+            return ("192.168.1.100", "255.255.255.0", "192.168.1.1", "192.168.1.1")
+        return ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+
+    def config(self, *args, **kwargs):
+        if (args):
+            return self._wlan.config_values.get(args[0])
+        self._wlan.config_values.update(kwargs)
+
+    # Blocking scan, returns [(ssid, bssid, channel, rssi, authmode, hidden)]
+    def scan(self):
+        board = self._wlan.board
+        _clock.get_clock().block(board.wifi_scan_in_ms / 1000)
+        if (not board.wifi_available):
+            return []
+        ssid = self._wlan._ssid if board.wifi_ssid is None else board.wifi_ssid
+        ssid = ssid.encode() if isinstance(ssid, str) else (ssid or b"")
+        return [(ssid, b"\x00\x11\x22\x33\x44\x55", 6, board.wifi_rssi, 3, False)]
@@ -0,0 +1,21 @@
+
+# Simulated "ntptime" module for host simulation, settime() sets the board RTC from the host (or virtual) wall clock
+
+from host_sim import clock as _clock
+from host_sim.board import get_board
+
+host = "pool.ntp.org"
+timeout = 1
+
+
+def time():
+    board = get_board()
+    _clock.get_clock().block(board.ntp_latency_in_ms / 1000)
+    if (not board.ntp_available or not board.wlan._connected()):
+        raise OSError(110)   # ETIMEDOUT, same as socket timeout on PicoW
+    return int(_clock.get_clock().wall_time())
+
+
+def settime():
+    seconds = time()
+    get_board().rtc.set_time(seconds)
@@ -0,0 +1,89 @@
+
+# Priority outbox scenario in virtual time: python -m host_sim.outbox
+# Runs the real controller worker with a SimMQTTClient that takes 300 ms per QoS1 PUBACK, queues a burst of log lines (noisy event), then sends
+# {"CMD": "metrics"} and closes contact switch GP0. Checks that the GPIO status and the metrics response are published before the rest of the
+# log backlog (state never waits behind logs), and that logs are published as QoS0 with mqtt_log_qos=0 while the status stays QoS1.
+# A third run sends a longer QoS0 burst 2.77 seconds after the worker round (not aligned with it) and checks that the logs take no publish token
+# of the GPIO status (no deferred publish, state within one worker period).
+
+import sys
+
+import host_sim
+from host_sim import loop as virtual_loop
+from host_sim.board import SimBoard, set_board, reset_board
+
+host_sim.install()
+import uasyncio as asyncio
+from host_sim.client import SimMQTTClient
+
+puback_delay_in_ms = 300
+worker_period_in_ms = 5000
+
+
+def _silent_print(*args, **kwargs):
+    pass
+
+
+async def run(controller, log_qos, burst_len, offset_in_seconds, result):
+    board = host_sim.get_board()
+    controller.init(mqtt_log_qos=log_qos)
+    client = SimMQTTClient(puback_delay_in_ms=puback_delay_in_ms)
+    worker_task = asyncio.create_task(controller.worker(client))
+    await asyncio.sleep(20 + offset_in_seconds)   # Boot, first full publish and its logs (worker rounds every 5 seconds)
+    topic = controller.mqtt_config.mqtt_topic
+    start_index = len(client.published)
+
+    for i in range(burst_len):
+        controller.log(f"Diagnostic {i}")   # e.g. warnings of a noisy event, 12 seconds of PUBACKs at QoS1
+    client.deliver(topic, '{"CMD": "metrics"}')
+    await asyncio.sleep(0.1)
+    change_ticks = controller.utime.ticks_ms()
+    board.set_input(0, 0)   # Close contact switch GP0
+    await asyncio.sleep(30)
+
+    published = client.published[start_index:]
+    messages = [msg for ticks, t, msg, retain, qos in published]
+    log_indexes = [i for i in range(len(messages)) if messages[i].startswith("Diagnostic")]
+    state_indexes = [i for i in range(len(messages)) if messages[i].startswith('{"GP0"')]
+    response_indexes = [i for i in range(len(messages)) if messages[i].startswith('{"METRICS"')]
+    result["logs_published"] = len(log_indexes) == burst_len
+    result["state_before_last_log"] = len(state_indexes) > 0 and state_indexes[0] < log_indexes[-1]
+    result["response_before_last_log"] = len(response_indexes) > 0 and response_indexes[0] < log_indexes[-1]
+    result["state_latency_ms"] = controller.utime.ticks_diff(published[state_indexes[0]][0], change_ticks) if state_indexes else -1
+    result["log_qos"] = set([published[i][4] for i in log_indexes])
+    result["state_qos"] = set([published[i][4] for i in state_indexes])
+    result["state_wait_p90_ms"] = controller.mqtt_metrics.get_histogram("state_wait_ms").percentile(90)
+    result["publishes_deferred"] = controller.mqtt_metrics.get_counter("publishes_deferred")
+    worker_task.cancel()
+
+
+def main():
+    results = []
+    for log_qos, burst_len, offset_in_seconds in ((1, 40, 0), (0, 40, 0), (0, 50, 2.77)):
+        result = {}
+        token = set_board(SimBoard("outbox"))
+        try:
+            controller = host_sim.load_controller(fresh=True)
+            controller.print = _silent_print
+            sys.modules["mqtt_tiny_controller_common"].print = _silent_print
+            virtual_loop.run_virtual(run(controller, log_qos, burst_len, offset_in_seconds, result), wall_start_time=1767571200)
+        finally:
+            reset_board(token)
+        print(f"mqtt_log_qos={log_qos} burst={burst_len} offset={offset_in_seconds}s")
+        for key in result:
+            print(f"  {key}={result[key]}")
+        results.append(result)
+
+    for key in ("state_before_last_log", "response_before_last_log"):
+        assert results[0][key], key
+    for result, log_qos in zip(results, (1, 0, 0)):
+        assert result["logs_published"], "Logs are missing"
+        assert result["log_qos"] == {log_qos} and result["state_qos"] == {1}, "QoS per class"
+        assert 0 <= result["state_latency_ms"] <= worker_period_in_ms + 2 * puback_delay_in_ms, "State waited behind logs"   # One worker round and one log in flight
+    assert results[2]["publishes_deferred"] == 0, "Logs took publish tokens of the GPIO status"
+    assert 0 <= results[2]["state_latency_ms"] < worker_period_in_ms, "State waited behind logs"
+    print("Outbox OK")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
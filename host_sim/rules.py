@@ -0,0 +1,122 @@
+
+# Automation rules scenario in virtual time: python -m host_sim.rules
+# Runs the real controller worker with automation_rules and a SimMQTTClient as broker, changes contact switches on the simulated board
+# and checks that relays switch without any command (also while the broker is down), that rate limits, conditions and delayed rules work
+# (a delayed rule is cancelled when the trigger changed back), and that a flapping contact cannot exceed the burnout protection.
+
+import sys
+
+import host_sim
+from host_sim import loop as virtual_loop
+from host_sim.board import SimBoard, set_board, reset_board
+
+host_sim.install()
+import uasyncio as asyncio
+from host_sim.client import SimMQTTClient
+
+rules = [{"trigger": 0, "when": 1, "action": 18, "min_interval_in_seconds": 60},   # GP0 closes -> press GP18, at most once a minute
+         {"trigger": 1, "when": 0, "action": 16, "value": 1, "delay_in_seconds": 30},   # GP1 open for 30 seconds -> GP16 on
+         {"trigger": 2, "action": 17, "value": 1, "if": {16: 1}},   # GP2 changes -> GP17 on if GP16 is on
+         {"trigger": 3, "when": 1, "action": 19, "value": 1}]       # GP3 closes -> press GP19 (flapping contact)
+
+
+def _silent_print(*args, **kwargs):
+    pass
+
+
+async def run(controller, result):
+    board = host_sim.get_board()
+    board.set_input(1, 0)   # GP1 starts closed
+    controller.init(automation_rules=rules)
+    client = SimMQTTClient()
+    worker_task = asyncio.create_task(controller.worker(client))
+    await asyncio.sleep(10)   # Boot and relay cooldown after power up
+    utime = controller.utime
+
+    # Contact closes, relay is pressed on the next poll without any MQTT message
+    board.set_input(0, 0)
+    start_ticks = utime.ticks_ms()
+    while (board.get_level(18) == 1 and utime.ticks_diff(utime.ticks_ms(), start_ticks) < 1000):
+        await asyncio.sleep_ms(1)
+    result["gp18_pressed_ms"] = utime.ticks_diff(utime.ticks_ms(), start_ticks)
+    await asyncio.sleep(3)
+    result["gp18_released"] = board.get_level(18) == 1
+
+    board.set_input(0, 1)
+    await asyncio.sleep(5)
+    board.set_input(0, 0)   # Closes again within min_interval_in_seconds
+    await asyncio.sleep(1)
+    result["gp18_rate_limited"] = board.get_output_history(18) == [1, 0, 1]   # Setup, one press, one release
+
+    # Broker is down, rules still run
+    client.go_down()
+    board.set_input(0, 1)
+    await asyncio.sleep(60)
+    board.set_input(0, 0)
+    await asyncio.sleep(0.5)
+    result["gp18_pressed_while_down"] = board.get_level(18) == 0
+    client.go_up()
+    await asyncio.sleep(10)
+
+    # Delayed rule is cancelled if GP1 closes again before the delay, runs if it stays open
+    board.set_input(1, 1)
+    await asyncio.sleep(10)
+    board.set_input(1, 0)
+    await asyncio.sleep(30)
+    result["gp16_delay_cancelled"] = board.get_level(16) == 1
+    board.set_input(1, 1)
+    await asyncio.sleep(29)
+    result["gp16_off_before_delay"] = board.get_level(16) == 1
+    await asyncio.sleep(2)
+    result["gp16_on_after_delay"] = board.get_level(16) == 0
+
+    # Condition: GP17 only follows GP2 while GP16 is on
+    board.set_input(2, 0)
+    await asyncio.sleep(1)
+    result["gp17_on_with_condition"] = board.get_level(17) == 0
+
+    # Flapping contact: GP3 closes every second for 2 minutes, presses are limited by burnout protection
+    for i in range(120):
+        board.set_input(3, 0)
+        await asyncio.sleep(0.5)
+        board.set_input(3, 1)
+        await asyncio.sleep(0.5)
+    await asyncio.sleep(10)
+    presses = board.get_output_history(19).count(0)
+    result["gp19_presses"] = presses
+    max_presses = controller.mqtt_config.hardware_modified_max * 3   # Burst, then one per 12 seconds for 2 minutes
+    result["gp19_limited"] = 0 < presses <= max_presses
+
+    # Fired rules are logged (throttled per rule) and published when the broker is reachable
+    published = client.get_published(controller.mqtt_config.mqtt_topic)
+    result["rule_logs_published"] = len([x for x in published if x.startswith("Rule ")])
+    metrics = controller.mqtt_metrics
+    for name in ("rules_fired", "rules_rate_limited", "rules_cancelled", "commands_deferred"):
+        result[name] = metrics.get_counter(name)
+    worker_task.cancel()
+
+
+def main():
+    result = {}
+    token = set_board(SimBoard("rules"))
+    try:
+        controller = host_sim.load_controller(fresh=True)
+        controller.print = _silent_print
+        virtual_loop.run_virtual(run(controller, result), wall_start_time=1767571200)
+    finally:
+        reset_board(token)
+
+    for key in result:
+        print(f"{key}={result[key]}")
+
+    assert result["gp18_pressed_ms"] <= 2 * 50, "Relay should switch on the next poll (automation_poll_period_in_ms)"
+    for key in ("gp18_released", "gp18_rate_limited", "gp18_pressed_while_down", "gp16_delay_cancelled", "gp16_off_before_delay",
+                "gp16_on_after_delay", "gp17_on_with_condition", "gp19_limited"):
+        assert result[key], key
+    assert result["rules_rate_limited"] == 1 and result["rules_cancelled"] == 1, "Rule counters"
+    assert result["rule_logs_published"] > 0, "Rules should be logged"
+    print("Rules OK")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
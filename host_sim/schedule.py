@@ -0,0 +1,128 @@
+
+# Relay schedules scenario in virtual time: python -m host_sim.schedule
+# Runs the real controller worker with relay_schedules (EST) and a SimMQTTClient as broker for a week and checks that relays switch
+# at local time on the right weekdays without any command (also while the broker is down), that {"SCHEDULE": [...]} replaces and saves
+# the schedules (used again after restart), that MFA and invalid schedules (also float days or actions) are rejected, and that the
+# scheduled publish and NTP sync still run.
+
+import json
+import os
+import sys
+import tempfile
+
+import host_sim
+from host_sim import loop as virtual_loop
+from host_sim.board import SimBoard, set_board, reset_board
+
+host_sim.install()
+import uasyncio as asyncio
+from host_sim.client import SimMQTTClient
+
+start_time = 1767571200   # 2026-01-05 00:00 UTC (Monday), 2026-01-04 19:00 EST (Sunday)
+hour = 3600
+schedules = [{"at": "06:30", "days": [0, 1, 2, 3, 4], "action": 16, "value": 1},   # GP16 on at 06:30 on weekdays
+             {"at": "22:00", "action": 16, "value": 0}]                            # GP16 off at 22:00 every day
+saturday_schedules = [{"at": "08:00", "days": [5], "action": 17, "value": 1},
+                      {"at": "08:05", "days": [5], "action": 17, "value": 0}]
+gp19_key = "MNWGSZLOOQQDEIDTMVRXEZLU"
+
+
+def _silent_print(*args, **kwargs):
+    pass
+
+
+# Sleep until local time (EST, no DST in January), day 0 is Sunday 2026-01-04, e.g. method(utime, 1, 6, 29) for Monday 06:29
+async def sleep_until(utime, day, hours, minutes):
+    await asyncio.sleep(start_time - 19 * hour + day * 86400 + hours * hour + minutes * 60 - utime.time())
+
+
+async def run(controller, schedule_file, result):
+    board = host_sim.get_board()
+    controller.init(relay_schedules=schedules, schedule_file=schedule_file, gpio_pins_for_totp_enabled={19: [gp19_key]})
+    client = SimMQTTClient()
+    worker_task = asyncio.create_task(controller.worker(client))
+    await asyncio.sleep(10)   # Boot, the board clock starts in 2021 until NTP synced it
+    utime = controller.utime
+    result["clock_synced"] = not controller.is_clock_out_of_sync()
+    topic = controller.mqtt_config.mqtt_topic
+
+    def send(payload):
+        client.deliver(topic, json.dumps(payload))
+
+    def get_logs(text):
+        return [x for x in client.get_published(topic) if text in x]
+
+    await sleep_until(utime, 1, 6, 29)   # Monday
+    result["gp16_off_before"] = board.get_level(16) == 1
+    await sleep_until(utime, 1, 6, 31)
+    result["gp16_on_monday"] = board.get_level(16) == 0
+
+    await sleep_until(utime, 1, 21, 50)
+    client.go_down()   # Internet is down at 22:00, the relay still switches
+    await sleep_until(utime, 1, 22, 1)
+    result["gp16_off_while_down"] = board.get_level(16) == 1
+    client.go_up()
+    await asyncio.sleep(60)
+
+    send({"SCHEDULE": [{"at": "25:00", "action": 16}]})
+    send({"SCHEDULE": [{"at": "06:30", "days": [1.0], "action": 16}]})   # JSON floats equal the ints but are rejected
+    send({"SCHEDULE": [{"at": "06:30", "action": 16.0}]})
+    await asyncio.sleep(6)
+    result["invalid_rejected"] = len(get_logs("Schedules are not changed")) == 3 and len(controller.mqtt_schedules) == 2
+    send({"SCHEDULE": [{"at": "07:00", "action": 19}]})   # GP19 needs its own TOTP code
+    await asyncio.sleep(1)
+    result["mfa_required"] = len(controller.mqtt_schedules) == 2 and not os.path.exists(schedule_file)
+
+    send({"SCHEDULE": saturday_schedules})   # GP16 schedules are removed
+    await asyncio.sleep(1)
+    with open(schedule_file) as f:
+        result["saved"] = json.load(f) == saturday_schedules
+    send({"SCHEDULE": "get"})
+    await asyncio.sleep(6)   # Logs are published in the next worker round
+    result["get_logged"] = len(get_logs('{"SCHEDULE": [{"at": "08:00"')) == 2   # Replaced and get
+
+    await sleep_until(utime, 5, 8, 1)   # Friday, GP16 is not switched on any more and GP17 only runs on Saturday
+    result["gp16_removed"] = board.get_output_history(16).count(0) == 1 and board.get_level(17) == 1
+    await sleep_until(utime, 6, 8, 1)
+    result["gp17_on_saturday"] = board.get_level(17) == 0
+    await sleep_until(utime, 6, 8, 6)
+    result["gp17_off_saturday"] = board.get_level(17) == 1
+
+    messages = client.get_published(topic)
+    result["full_publishes"] = len([x for x in messages if '"GP0"' in x])
+    result["clock_syncs"] = len([x for x in messages if "Scheduled clock synced" in x])
+    result["schedules_fired"] = controller.mqtt_metrics.get_counter("schedules_fired")
+    result["expected_publishes"] = (utime.time() - start_time) // controller.mqtt_config.scheduled_publish_in_seconds - 1   # One missed during outage
+    worker_task.cancel()
+
+
+def main():
+    result = {}
+    schedule_file = os.path.join(tempfile.mkdtemp(), "mqtt_schedules.json")
+    token = set_board(SimBoard("schedule"))
+    try:
+        controller = host_sim.load_controller(fresh=True)
+        controller.print = _silent_print
+        virtual_loop.run_virtual(run(controller, schedule_file, result), wall_start_time=start_time)
+
+        restarted = host_sim.load_controller(fresh=True)   # Saved schedules replace relay_schedules after restart
+        restarted.print = _silent_print
+        restarted.init(relay_schedules=schedules, schedule_file=schedule_file)
+        result["reloaded"] = [x[3] for x in restarted.mqtt_schedules] == ["GP17", "GP17"]
+    finally:
+        reset_board(token)
+
+    for key in result:
+        print(f"{key}={result[key]}")
+
+    for key in ("clock_synced", "gp16_off_before", "gp16_on_monday", "gp16_off_while_down", "invalid_rejected", "mfa_required", "saved", "get_logged",
+                "gp16_removed", "gp17_on_saturday", "gp17_off_saturday", "reloaded"):
+        assert result[key], key
+    assert result["schedules_fired"] == 5, "Schedules fired"   # Sunday and Monday 22:00, Monday 06:30, Saturday 08:00 and 08:05
+    assert result["full_publishes"] >= result["expected_publishes"], "Missing scheduled publishes"
+    assert result["clock_syncs"] >= 5, "Missing scheduled clock syncs"
+    print("Schedule OK")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
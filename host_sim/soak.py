@@ -0,0 +1,181 @@
+
+# Long horizon soak scenario in virtual time: python -m host_sim.soak [days]
+# Runs the real controller worker against SimMQTTClient and checks burnout protection (token bucket), QoS1 backlog replay after reconnect,
+# momentary command flood, command executor under a stats flood, SEQ resync with {"SINCE": N}, scheduled publish and NTP schedules
+
+import sys
+import host_sim
+from host_sim import loop as virtual_loop
+
+controller = host_sim.load_controller()
+from host_sim.client import SimMQTTClient
+asyncio = controller.asyncio
+utime = controller.utime
+
+
+def count(messages, text):
+    return len([m for m in messages if text in m])
+
+
+async def hammer_relay(client, name, seconds, interval_in_seconds=1):
+    value = 1
+    for i in range(int(seconds / interval_in_seconds)):
+        client.deliver(controller.mqtt_config.mqtt_topic, '{"%s": %d}' % (name, value))
+        value = 1 - value
+        await asyncio.sleep(interval_in_seconds)
+
+
+# Outage followed by the broker replaying a QoS1 backlog of toggles (last value wins), returns messages published during replay
+async def replay_backlog(client, name, toggles, outage_in_seconds=30):
+    client.go_down()
+    await asyncio.sleep(outage_in_seconds)
+    start_index = len(client.published)
+    client.go_up()
+    for i in range(toggles):
+        client.deliver(controller.mqtt_config.mqtt_topic, '{"%s": %d}' % (name, (i + 1) % 2))   # Ends with 0 for even toggles
+        await asyncio.sleep(0.005)
+    await asyncio.sleep(controller.mqtt_config.command_settle_window_in_ms / 1000 + 10)
+    return [msg.decode() if isinstance(msg, bytes) else msg for ticks, topic, msg, retain, qos in client.published[start_index:]]
+
+
+# Flood momentary relays with presses, returns the max number of tasks seen during the flood
+async def flood_momentary(client, names, messages, interval_in_seconds=0.01):
+    max_tasks = 0
+    payload = "{" + ", ".join(['"%s": 1' % name for name in names]) + "}"
+    for i in range(messages):
+        client.deliver(controller.mqtt_config.mqtt_topic, payload)
+        await asyncio.sleep(interval_in_seconds)
+        max_tasks = max(max_tasks, len(asyncio.all_tasks()))
+    return max_tasks
+
+
+# Bursts of {"CMD": "stats"} (e.g. replayed by the broker) with a slow blocking wlan.scan, returns (stats runs, max tasks seen during the flood)
+async def flood_stats(client, bursts, burst_len, scan_in_ms=1500, interval_in_seconds=0.5):
+    board = host_sim.get_board()
+    board.wifi_scan_in_ms = scan_in_ms
+    start_index = len(client.published)
+    max_tasks = 0
+    for i in range(bursts):
+        for j in range(burst_len):
+            client.deliver(controller.mqtt_config.mqtt_topic, '{"CMD": "stats"}')
+        for j in range(int(interval_in_seconds / 0.01)):
+            await asyncio.sleep(0.01)
+            max_tasks = max(max_tasks, len(asyncio.all_tasks()))
+    await asyncio.sleep(30)
+    board.wifi_scan_in_ms = 0
+    stats_runs = sum([str(m).count("Uptime=") for ticks, topic, m, retain, qos in client.published[start_index:]])
+    return stats_runs, max_tasks
+
+
+# Request changes since SEQ N, returns the response (or None) and whether the full list was republished
+async def request_since(client, since_seq):
+    start_index = len(client.published)
+    client.deliver(controller.mqtt_config.mqtt_topic, '{"SINCE": %d}' % since_seq)
+    await asyncio.sleep(10)
+    messages = [msg.decode() if isinstance(msg, bytes) else msg for ticks, topic, msg, retain, qos in client.published[start_index:]]
+    responses = [m for m in messages if '"SINCE"' in m]
+    return (responses[0] if len(responses) > 0 else None), count(messages, '"GP0"') > 0
+
+
+async def run(days):
+    controller.init()
+    client = SimMQTTClient()
+    worker_task = asyncio.create_task(controller.worker(client))   # Boot sequence: Wi-Fi, DNS, connect, NTP
+    await asyncio.sleep(60)
+
+    # Burnout protection: toggle GP16 every second for 10 minutes, changes over the limit are deferred (latest wins)
+    board = host_sim.get_board()
+    start_history = len(board.get_output_history(16))
+    await hammer_relay(client, "GP16", 600)
+    relay_writes = len(board.get_output_history(16)) - start_history
+
+    # QoS1 backlog replay after reconnect: 51 toggles on GP17 (ends with 1) result in one hardware write
+    start_history = len(board.get_output_history(17))
+    replay_messages = await replay_backlog(client, "GP17", 51)
+    replay_writes = len(board.get_output_history(17)) - start_history
+
+    # Momentary flood: presses are released by the timer service, the number of tasks stays the same
+    idle_tasks = len(asyncio.all_tasks())
+    flood_max_tasks = await flood_momentary(client, ["GP18", "GP19"], 500)
+    await asyncio.sleep(60)
+
+    # Stats flood: commands are deduplicated by the command executor, one stats run (one wlan.scan) at a time
+    stats_runs, stats_flood_max_tasks = await flood_stats(client, 10, 10)
+
+    # SEQ resync: recent changes are merged from history, a SEQ older than the history gets a full publish
+    current_seq = controller.mqtt_publish_stats.state_seq
+    since_response, since_recent_full = await request_since(client, current_seq - 2)
+    since_old_response, since_old_full = await request_since(client, 0)
+
+    # Scheduled publish and NTP clock sync over days
+    start_time = utime.time()
+    await asyncio.sleep(days * 86400)
+    elapsed = utime.time() - start_time
+
+    messages = client.get_published(controller.mqtt_config.mqtt_topic)
+    report = {
+        "simulated_days": round(elapsed / 86400, 2),
+        "relay_writes_GP16": relay_writes,
+        "replay_writes_GP17": replay_writes,
+        "replay_warnings": count(replay_messages, "Gpio GP17"),
+        "replay_status_publishes": count(replay_messages, '"GP17": 1, "SEQ"'),
+        "idle_tasks": idle_tasks,
+        "flood_max_tasks": flood_max_tasks,
+        "momentary_released": board.get_level(18) == 1 and board.get_level(19) == 1,
+        "stats_flood_runs": stats_runs,
+        "stats_flood_max_tasks": stats_flood_max_tasks,
+        "commands_deduplicated": controller.mqtt_metrics.get_counter("commands_deduplicated"),
+        "seq": controller.mqtt_publish_stats.state_seq,
+        "since_response": since_response,
+        "since_recent_full": since_recent_full,
+        "since_old_full": since_old_full and since_old_response is None,
+        "deferral_warnings": count(messages, "Deferring Gpio"),
+        "skip_warnings": count(messages, "Skipping Gpio"),
+        "commands_deferred": controller.mqtt_metrics.get_counter("commands_deferred"),
+        "permanently_disabled": not controller.mqtt_gpio_hardware["GP16"].is_modified_allowed,
+        "publish_stopped": controller.mqtt_publish_stats.publish_counter < 0,
+        "scheduled_clock_syncs": count(messages, "Scheduled clock synced"),
+        "auto_clock_syncs": count(messages, "Auto clock synced"),
+        "full_publishes": count(messages, '"GP0"'),
+        "total_publishes": len(messages),
+    }
+    worker_task.cancel()
+    return report
+
+
+def main(days=2):
+    result = {}
+
+    async def scenario():
+        result.update(await run(days))
+
+    loop = virtual_loop.run_virtual(scenario(), wall_start_time=1767571200)   # 2026-01-05 00:00:00 UTC
+    for key in result:
+        print(f"{key}={result[key]}")
+    print(f"virtual_seconds={int(loop.virtual_clock.now)}")
+
+    expected_scheduled_publishes = int(days * 86400 / controller.mqtt_config.scheduled_publish_in_seconds)
+    max_relay_writes = controller.mqtt_config.hardware_modified_max + 600 * controller.mqtt_config.hardware_modified_max // controller.mqtt_config.hardware_modified_threshold_in_seconds + 1
+    assert not result["permanently_disabled"], "GP16 should degrade gracefully (lockout is opt-in)"
+    assert not result["publish_stopped"], "Publishing should degrade gracefully (lockout is opt-in)"
+    assert result["relay_writes_GP16"] <= max_relay_writes, "Too many relay writes"
+    assert result["relay_writes_GP16"] >= max_relay_writes // 2, "Relay should keep following commands at the limited rate"
+    assert result["replay_writes_GP17"] == 1, "Replayed backlog should result in one hardware write"
+    assert result["replay_warnings"] == 0, "Replayed backlog should not log burnout warnings"
+    assert result["replay_status_publishes"] == 1, "Replayed backlog should result in one status publish"
+    assert result["flood_max_tasks"] <= result["idle_tasks"] + 1, "Momentary presses should not create tasks"
+    assert result["momentary_released"], "Momentary relays were not released"
+    assert result["stats_flood_runs"] >= 1, "Stats command was never run"
+    assert result["stats_flood_runs"] <= 10, "Stats flood should be deduplicated"
+    assert result["stats_flood_max_tasks"] <= result["idle_tasks"] + 1, "Stats commands should not create tasks"
+    assert result["since_response"] is not None and '"SINCE": ' in result["since_response"], "Missing SINCE response"
+    assert not result["since_recent_full"], "Recent SEQ should be served from history"
+    assert result["since_old_full"], "Old SEQ should result in a full publish"
+    assert result["full_publishes"] >= expected_scheduled_publishes, "Missing scheduled full publishes"
+    assert result["scheduled_clock_syncs"] >= int(days * 86400 / controller.mqtt_config.scheduled_clock_sync_in_seconds), "Missing scheduled clock syncs"
+    assert result["auto_clock_syncs"] >= 1, "Clock was never synced after power up"
+    print("Soak OK")
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 2)
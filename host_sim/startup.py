@@ -0,0 +1,27 @@
+
+# Startup benchmark on the host: python -m host_sim.startup
+# Runs mqtt_tiny_controller_startup_benchmark (import time, init() time, heap used after init) on the simulated board.
+# Heap is measured with tracemalloc (CPython objects are larger than on PicoW, compare runs with each other, not with the device)
+
+import sys
+import tracemalloc
+
+import host_sim
+
+
+def main():
+    host_sim.install()
+    import host_sim.gpio as sim_gpio   # Registers backend "sim"
+    tracemalloc.start()
+    import mqtt_tiny_controller_startup_benchmark as benchmark
+
+    result = benchmark.run({"gpio_backend_name": "sim"})
+    tracemalloc.stop()
+
+    # Default config has MFA, the journal, core 1 and the LAN endpoint disabled, these subsystems are only imported on first use
+    assert result["optional_modules_loaded"] == [], result["optional_modules_loaded"]
+    print("Startup OK")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+
+# TLS and DNS scenario in real time with a local TLS broker stand-in: python -m host_sim.tls [reconnects]
+# Runs the real controller worker and mqtt_as client over CPython ssl (host_sim.ussl) with a self signed certificate (openssl CLI, temp directory),
+# drops the connection several times and checks that reconnects resume the TLS session of the last connect, that the broker address is looked up
+# again after broker_dns_ttl_in_seconds (only after the reconnect succeeded, DNS blocks on PicoW), and that the device reconnects with the last good
+# address while DNS fails. Reports handshake times.
+# Note: MicroPython ussl has no session resumption, on PicoW every reconnect is a full handshake (tls_resumed stays 0)
+
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+
+import host_sim
+from host_sim.board import SimBoard, set_board, reset_board
+from host_sim.broker import MQTTBroker
+
+host_sim.install()
+import uasyncio as asyncio
+import usocket
+
+host_name = "broker-tls.local"
+topic = "tls/device1"
+client_id = b"tls1"
+
+
+def _silent_print(*args, **kwargs):
+    pass
+
+
+# Server side ssl.SSLContext with a self signed certificate created by the openssl CLI in directory
+def create_server_context(directory):
+    cert_file, key_file = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key_file, "-out", cert_file, "-days", "1",
+                    "-subj", "/CN=" + host_name], check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+def is_connected(broker):
+    session = broker.sessions.get(client_id.decode())
+    return session is not None and session.connection is not None and len(session.subscriptions) > 0
+
+
+async def wait_connected(broker, timeout_in_seconds=30):
+    for i in range(timeout_in_seconds * 10):
+        if (is_connected(broker)):
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+
+# Drop the device connection (broker keeps listening), returns True when the device connected again
+async def drop_connection(broker):
+    session = broker.sessions.get(client_id.decode())
+    session.connection.close()
+    await asyncio.sleep(0.5)
+    return await wait_connected(broker)
+
+
+async def run(broker, reconnects, result):
+    usocket.hosts[host_name] = "127.0.0.1"
+    await broker.start()
+    token = set_board(SimBoard("tls"))   # Tasks created here inherit the board
+    try:
+        controller = host_sim.load_controller(fresh=True)
+        controller.print = _silent_print
+        sys.modules["mqtt_tiny_controller_common"].print = _silent_print
+        controller.init(mqtt_topic=topic, mqtt_client_id=client_id, broker_server=host_name, broker_port=broker.port, broker_dns_ttl_in_seconds=1)
+        controller.init_mqtt_as()
+        client = controller.MQTTClient(controller.config)
+        task = asyncio.create_task(controller.worker(client))
+    finally:
+        reset_board(token)
+
+    metrics = controller.mqtt_metrics
+    result["connected"] = await wait_connected(broker, 60)
+    handshakes = metrics.get_histogram("tls_handshake_ms")
+    result["full_handshake_ms"] = handshakes.total
+    reconnected = 0
+    for i in range(reconnects):
+        reconnected += await drop_connection(broker)
+    result["reconnected"] = reconnected == reconnects
+    result["resumed_handshake_avg_ms"] = round((handshakes.total - result["full_handshake_ms"]) / max(1, handshakes.count - 1), 1)
+    result["tls_resumed"] = metrics.get_counter("tls_resumed")
+    result["dns_lookups"] = metrics.get_histogram("dns_ms").count
+
+    lookups_connected = []   # Broker connection was up when the expired address was looked up again
+    getaddrinfo = usocket.getaddrinfo
+
+    def recording_getaddrinfo(*args):
+        session = broker.sessions.get(client_id.decode())
+        lookups_connected.append(session is not None and session.connection is not None)
+        return getaddrinfo(*args)
+
+    usocket.getaddrinfo = recording_getaddrinfo
+    usocket.hosts[host_name] = None   # DNS fails, the last good address is used
+    await asyncio.sleep(1.5)          # broker_dns_ttl_in_seconds expired
+    result["reconnected_without_dns"] = await drop_connection(broker)
+    for i in range(50):   # The broker sees the connection before the device read CONNACK (persistent session keeps its subscriptions)
+        if (len(lookups_connected) > 0):
+            break
+        await asyncio.sleep(0.1)
+    usocket.getaddrinfo = getaddrinfo
+    result["lookup_after_connect"] = len(lookups_connected) > 0 and all(lookups_connected)
+    result["dns_fallbacks"] = metrics.get_counter("dns_fallbacks")
+    task.cancel()
+    await broker.stop()
+
+
+def main(reconnects=3):
+    if (shutil.which("openssl") is None):
+        print("openssl CLI not found (needed for the self signed certificate)")
+        return 1
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        broker = MQTTBroker(ssl_context=create_server_context(directory))
+        asyncio.run(run(broker, reconnects, result))
+    for key in result:
+        print(f"{key}={result[key]}")
+
+    for key in ("connected", "reconnected", "reconnected_without_dns", "lookup_after_connect"):
+        assert result[key], key
+    assert result["tls_resumed"] == reconnects + 1, "TLS sessions were not resumed"
+    assert result["dns_lookups"] > 1, "Address was not looked up again after broker_dns_ttl_in_seconds"
+    assert result["dns_fallbacks"] >= 1, "Last good address was not used"
+    print("TLS OK")
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 3))
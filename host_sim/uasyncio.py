@@ -0,0 +1,13 @@
+
+# Simulated "uasyncio" module for host simulation, CPython asyncio plus the MicroPython extensions used in this project
+
+import asyncio as _asyncio
+from asyncio import *
+
+
+async def sleep_ms(ms):
+    await _asyncio.sleep(ms / 1000)
+
+
+async def wait_for_ms(aw, timeout):
+    return await _asyncio.wait_for(aw, timeout / 1000)
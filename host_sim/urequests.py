@@ -0,0 +1,39 @@
+
+# Simulated "urequests" module for host simulation, responses are scripted on the board
+# e.g. board.http_responses["https://jsonip.com"] = (200, {"ip": "20.114.152.56"})
+
+import json
+from host_sim import clock as _clock
+from host_sim.board import get_board
+
+
+class Response:
+
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self._data = data
+        self.text = json.dumps(data)
+        self.content = self.text.encode()
+
+    def json(self):
+        return self._data
+
+    def close(self):
+        pass
+
+
+def request(method, url, **kwargs):
+    board = get_board()
+    _clock.get_clock().block(board.http_latency_in_ms / 1000)
+    if (not board.wlan._connected()):
+        raise OSError(-2)   # Host not found
+    status_code, data = board.http_responses.get(url, (200, {"ip": "127.0.0.1"}))
+    return Response(status_code, data)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
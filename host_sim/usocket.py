@@ -0,0 +1,80 @@
+
+# Simulated "usocket" module for host simulation
+# Wraps CPython socket with MicroPython non-blocking semantics: read()/readinto()/write() return None instead of raising when no data
+
+import socket as _socket
+from socket import AF_INET, AF_INET6, SOCK_STREAM, SOCK_DGRAM, IPPROTO_TCP, SOL_SOCKET, SO_REUSEADDR
+
+# Host name overrides for getaddrinfo, e.g. hosts["broker1.local"] = "127.0.0.1", None simulates a DNS failure
+hosts = {}
+
+
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+    host = hosts.get(host, host)
+    if (host is None):
+        raise OSError(-2, "Name or service not known")
+    return _socket.getaddrinfo(host, port, af or AF_INET, type or SOCK_STREAM, proto, flags)
+
+
+class socket:
+
+    def __init__(self, af=AF_INET, type=SOCK_STREAM, proto=0, _sock=None):
+        self._sock = _sock if _sock is not None else _socket.socket(af, type, proto)
+
+    def setblocking(self, flag):
+        self._sock.setblocking(flag)
+
+    def settimeout(self, value):
+        self._sock.settimeout(value)
+
+    def setsockopt(self, level, option, value):
+        self._sock.setsockopt(level, option, value)
+
+    def connect(self, address):
+        self._sock.connect(address)
+
+    def bind(self, address):
+        self._sock.bind(address)
+
+    def listen(self, backlog=5):
+        self._sock.listen(backlog)
+
+    def accept(self):
+        sock, address = self._sock.accept()
+        return socket(_sock=sock), address
+
+    def read(self, n=-1):
+        try:
+            return self._sock.recv(n if n > 0 else 4096)
+        except BlockingIOError:
+            return None
+
+    def readinto(self, buf, n=0):
+        try:
+            return self._sock.recv_into(buf, n)
+        except BlockingIOError:
+            return None
+
+    def recv(self, n):
+        return self._sock.recv(n)
+
+    def write(self, buf):
+        try:
+            return self._sock.send(buf)
+        except BlockingIOError:
+            return None
+
+    def send(self, buf):
+        return self._sock.send(buf)
+
+    def sendto(self, buf, address):
+        return self._sock.sendto(buf, address)
+
+    def recvfrom(self, n):
+        return self._sock.recvfrom(n)
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def close(self):
+        self._sock.close()
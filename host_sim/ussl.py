@@ -0,0 +1,54 @@
+
+# Simulated "ussl" module for host simulation
+# Wraps a usocket socket with CPython ssl (client side, no certificate check like ussl on PicoW without cadata). On a non-blocking socket the
+# handshake runs in the first reads and writes, which return None until it completes. session= and .session / .session_reused are
+# CPython ssl extensions used by mqtt_as to resume TLS sessions on reconnect (MicroPython ussl raises TypeError for session=).
+
+import ssl as _ssl
+from host_sim import usocket as _usocket
+
+_context = None   # One client context, so sessions can be resumed (a session only works with the context that created it)
+
+
+def _get_context():
+    global _context
+    if (_context is None):
+        _context = _ssl.SSLContext(_ssl.PROTOCOL_TLS_CLIENT)
+        _context.check_hostname = False
+        _context.verify_mode = _ssl.CERT_NONE
+        _context.maximum_version = _ssl.TLSVersion.TLSv1_2   # Like mbedTLS on PicoW, the session is resumable right after the handshake
+    return _context
+
+
+class SSLSocket(_usocket.socket):
+
+    def read(self, n=-1):
+        try:
+            return self._sock.recv(n if n > 0 else 4096)
+        except (BlockingIOError, _ssl.SSLWantReadError, _ssl.SSLWantWriteError):
+            return None
+
+    def readinto(self, buf, n=0):
+        try:
+            return self._sock.recv_into(buf, n)
+        except (BlockingIOError, _ssl.SSLWantReadError, _ssl.SSLWantWriteError):
+            return None
+
+    def write(self, buf):
+        try:
+            return self._sock.send(buf)
+        except (BlockingIOError, _ssl.SSLWantReadError, _ssl.SSLWantWriteError):
+            return None
+
+    @property
+    def session(self):
+        return self._sock.session
+
+    @property
+    def session_reused(self):
+        return self._sock.session_reused
+
+
+def wrap_socket(sock, server_side=False, key=None, cert=None, cert_reqs=0, cadata=None, server_hostname=None, do_handshake=True, session=None):
+    ssl_sock = _get_context().wrap_socket(sock._sock, server_hostname=server_hostname, do_handshake_on_connect=False, session=session)
+    return SSLSocket(_sock=ssl_sock)
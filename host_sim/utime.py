@@ -0,0 +1,70 @@
+
+# Simulated "utime" module for host simulation
+# time() reads the RTC of the current board, ticks_*() read the (real or virtual) monotonic clock
+
+import calendar
+import time as _time
+from host_sim import clock as _clock
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = _TICKS_PERIOD // 2
+
+
+def _board():
+    from host_sim.board import get_board
+    return get_board()
+
+
+def time():
+    return int(_board().rtc.time())
+
+
+def time_ns():
+    return int(_board().rtc.time() * 1000000000)
+
+
+def sleep(seconds):
+    _clock.get_clock().block(seconds)
+
+
+def sleep_ms(ms):
+    _clock.get_clock().block(ms / 1000)
+
+
+def sleep_us(us):
+    _clock.get_clock().block(us / 1000000)
+
+
+def ticks_ms():
+    return int(_clock.get_clock().monotonic() * 1000) & _TICKS_MAX
+
+
+def ticks_us():
+    return int(_clock.get_clock().monotonic() * 1000000) & _TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+# (year, month, mday, hour, minute, second, weekday, yearday), weekday 0 = Monday, same as MicroPython
+def gmtime(seconds=None):
+    if (seconds is None):
+        seconds = time()
+    return tuple(_time.gmtime(seconds))[:8]
+
+
+localtime = gmtime   # PicoW RTC has no time zone
+
+
+def mktime(time_tuple):
+    return calendar.timegm(tuple(time_tuple[:6]) + (0, 0, 0))
@@ -1 +1,2 @@
-import mqtt_tiny_controller
\ No newline at end of file
+import mqtt_tiny_controller
+mqtt_tiny_controller.main()
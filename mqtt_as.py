@@ -15,6 +15,7 @@ import uasyncio as asyncio
 
 gc.collect()
 from utime import ticks_ms, ticks_diff
+from array import array
 from uerrno import EINPROGRESS, ETIMEDOUT
 
 gc.collect()
@@ -30,6 +31,7 @@ VERSION = (0, 7, 1)
 # Default short delay for good SynCom throughput (avoid sleep(0) with SynCom).
 _DEFAULT_MS = const(20)
 _SOCKET_POLL_DELAY = const(5)  # 100ms added greatly to publish latency
+_RECENT_PIDS = const(16)  # Inbound QoS1 pids of a connection kept to drop redelivered duplicates (DUP flag) after reconnect
 
 # Legitimate errors while waiting on a socket. See uasyncio __init__.py open_connection().
 ESP32 = platform == "esp32"
@@ -101,6 +103,9 @@ config = {
     "wifi_pw": None,
     "queue_len": 0,
     "gateway" : False,
+    "metrics": None,
+    "brokers": None,
+    "dns_ttl": 0,
 }
 
 
@@ -115,6 +120,11 @@ def pid_gen():
         yield pid
 
 
+# str -> UTF-8 bytes, so packet lengths are byte counts (len() of a str counts characters)
+def to_bytes(s):
+    return s.encode() if isinstance(s, str) else s
+
+
 def qos_check(qos):
     if not (qos == 0 or qos == 1):
         raise ValueError("Only qos 0 and 1 are supported.")
@@ -129,9 +139,9 @@ class MQTT_base:
     def __init__(self, config):
         self._events = config["queue_len"] > 0
         # MQTT config
-        self._client_id = config["client_id"]
-        self._user = config["user"]
-        self._pswd = config["password"]
+        self._client_id = to_bytes(config["client_id"])
+        self._user = to_bytes(config["user"])
+        self._pswd = to_bytes(config["password"])
         self._keepalive = config["keepalive"]
         if self._keepalive >= 65536:
             raise ValueError("invalid keepalive time")
@@ -149,6 +159,8 @@ class MQTT_base:
         self._wifi_pw = config["wifi_pw"]
         self._ssl = config["ssl"]
         self._ssl_params = config["ssl_params"]
+        # Optional registry with .incr(name) and .observe(name, value) e.g. MetricsRegistry
+        self._metrics = config["metrics"]
         # Callbacks and coros
         if self._events:
             self.up = asyncio.Event()
@@ -166,6 +178,20 @@ class MQTT_base:
         if self.server is None:
             raise ValueError("no server specified.")
         self._sock = None
+        self._addr = None  # Broker address, resolved by .resolve()
+        self._dns_ttl = config["dns_ttl"] * 1000  # Resolved addresses are kept for dns_ttl seconds (0: resolved once)
+        self._dns_cache = {}  # (server, port) -> (address, ticks_ms when resolved)
+        self._tls_session = None  # TLS session of the last connect, resumed on reconnect if the ssl module supports it
+        self._recent_pids = array("H", [0] * _RECENT_PIDS)  # Ring of the last inbound QoS1 pids, pid of message n at n % _RECENT_PIDS
+        self._rx_count = 0  # Inbound QoS1 messages PUBACKed since start (n of the next message)
+        self._acked_count = 0  # Messages before n are known to be PUBACKed (broker answered a later PINGREQ or PUBLISH)
+        self._ping_count = 0  # _rx_count when the last PINGREQ was sent
+        self._conn_count = 0  # _rx_count at the last CONNACK
+        self._unacked_pids = array("H", [0] * _RECENT_PIDS)  # Pids received before the connection dropped whose PUBACK may be lost (0 is not a valid pid)
+        # Optional broker pool for failover e.g. BrokerPool, server, port and login are taken from it on every connect
+        self._brokers = config["brokers"]
+        if self._brokers is not None:
+            self._use_broker()
         self._sta_if = network.WLAN(network.STA_IF)
         self._sta_if.active(True)
         if config["gateway"]:  # Called from gateway (hence ESP32).
@@ -186,15 +212,33 @@ class MQTT_base:
         qos_check(qos)
         if not topic:
             raise ValueError("Empty topic.")
-        self._lw_topic = topic
-        self._lw_msg = msg
+        self._lw_topic = to_bytes(topic)
+        self._lw_msg = to_bytes(msg)
         self._lw_qos = qos
         self._lw_retain = retain
 
+    def _use_broker(self):  # Current broker of the pool, its address is resolved again if the pool switched broker
+        server, self.port, user, pswd = self._brokers.get_current()[:4]
+        if server != self.server:
+            self._tls_session = None  # Sessions are only valid for the broker that issued them
+        self.server = server
+        self._user = to_bytes(user)
+        self._pswd = to_bytes(pswd)
+        if "server_hostname" in self._ssl_params:  # TLS SNI and certificate host name
+            self._ssl_params["server_hostname"] = server
+
     def dprint(self, msg, *args):
         if self.DEBUG:
             print(msg % args)
 
+    def _observe(self, name, t):  # Record ms elapsed since t in optional metrics registry
+        if self._metrics is not None:
+            self._metrics.observe(name, ticks_diff(ticks_ms(), t))
+
+    def _incr(self, name):
+        if self._metrics is not None:
+            self._metrics.incr(name)
+
     def _timeout(self, t):
         return ticks_diff(ticks_ms(), t) > self._response_time
 
@@ -277,7 +321,8 @@ class MQTT_base:
         if self._ssl:
             import ussl
 
-            self._sock = ussl.wrap_socket(self._sock, **self._ssl_params)
+            t = ticks_ms()
+            self._sock = self._wrap_socket(ussl)
         premsg = bytearray(b"\x10\0\0\0\0\0")
         msg = bytearray(b"\x04MQTT\x04\0\0\0")  # Protocol 3.1.1
 
@@ -301,6 +346,8 @@ class MQTT_base:
             i += 1
         premsg[i] = sz
         await self._as_write(premsg, i + 2)
+        if self._ssl:  # Handshake completes in wrap_socket or in the first write (non-blocking socket)
+            self._observe("tls_handshake_ms", t)
         await self._as_write(msg)
         await self._send_str(self._client_id)
         if self._lw_topic:
@@ -315,9 +362,24 @@ class MQTT_base:
         self.dprint("Connected to broker.")  # Got CONNACK
         if resp[3] != 0 or resp[0] != 0x20 or resp[1] != 0x02:  # Bad CONNACK e.g. authentication fail.
             raise OSError(-1, f"Connect fail: 0x{(resp[0] << 8) + resp[1]:04x} {resp[3]} (README 7)")
+        self._update_unacked_pids(clean or not resp[2] & 1)
+        if self._ssl:
+            self._tls_session = getattr(self._sock, "session", None)  # None if the ssl module has no sessions (e.g. MicroPython ussl)
+            if getattr(self._sock, "session_reused", False):
+                self._incr("tls_resumed")
+
+    # TLS session of the last connect is resumed (no full handshake) if the ssl module takes session= like CPython ssl
+    def _wrap_socket(self, ussl):
+        if self._tls_session is not None:
+            try:
+                return ussl.wrap_socket(self._sock, session=self._tls_session, **self._ssl_params)
+            except (TypeError, ValueError):  # No session support, or the session cannot be used
+                self._tls_session = None
+        return ussl.wrap_socket(self._sock, **self._ssl_params)
 
     async def _ping(self):
         async with self.lock:
+            self._ping_count = self._rx_count
             await self._as_write(b"\xc0\0")
 
     # Check internet connectivity by sending DNS lookup to Google's 8.8.8.8
@@ -398,10 +460,14 @@ class MQTT_base:
     # qos == 1: coro blocks until wait_msg gets correct PID.
     # If WiFi fails completely subclass re-publishes with new PID.
     async def publish(self, topic, msg, retain, qos):
+        topic = to_bytes(topic)
+        msg = to_bytes(msg)
         pid = next(self.newpid)
         if qos:
             self.rcv_pids.add(pid)
+        t = ticks_ms()
         async with self.lock:
+            rx_count = self._rx_count
             await self._publish(topic, msg, retain, qos, 0, pid)
         if qos == 0:
             return
@@ -409,6 +475,8 @@ class MQTT_base:
         count = 0
         while 1:  # Await PUBACK, republish on timeout
             if await self._await_pid(pid):
+                self._observe("puback_rtt_ms", t)
+                self._acked_count = max(self._acked_count, rx_count)  # Broker read the PUBACKs sent before this PUBLISH
                 return
             # No match
             if count >= self._max_repubs or not self.isconnected():
@@ -417,6 +485,7 @@ class MQTT_base:
                 await self._publish(topic, msg, retain, qos, dup=1, pid=pid)  # Add pid
             count += 1
             self.REPUB_COUNT += 1
+            self._incr("repubs")
 
     async def _publish(self, topic, msg, retain, qos, dup, pid):
         pkt = bytearray(b"\x30\0\0\0")
@@ -441,6 +510,7 @@ class MQTT_base:
 
     # Can raise OSError if WiFi fails. Subclass traps.
     async def subscribe(self, topic, qos):
+        topic = to_bytes(topic)
         pkt = bytearray(b"\x82\0\0\0")
         pid = next(self.newpid)
         self.rcv_pids.add(pid)
@@ -455,6 +525,7 @@ class MQTT_base:
 
     # Can raise OSError if WiFi fails. Subclass traps.
     async def unsubscribe(self, topic):
+        topic = to_bytes(topic)
         pkt = bytearray(b"\xa2\0\0\0")
         pid = next(self.newpid)
         self.rcv_pids.add(pid)
@@ -486,6 +557,7 @@ class MQTT_base:
 
         if res == b"\xd0":  # PINGRESP
             await self._as_read(1)  # Update .last_rx time
+            self._acked_count = max(self._acked_count, self._ping_count)  # Broker read the PUBACKs sent before the PINGREQ
             return
         op = res[0]
 
@@ -531,17 +603,41 @@ class MQTT_base:
             sz -= 2
         msg = await self._as_read(sz)
         retained = op & 0x01
-        if self._events:
+        if op & 6 == 2 and self._take_unacked_pid(pid) and op & 0x08:  # DUP: broker resends a message whose PUBACK it missed
+            self._incr("dup_discarded")  # Already delivered, only PUBACK again
+        elif self._events:
             self.queue.put(topic, msg, bool(retained))
         else:
             self._cb(topic, msg, bool(retained))
         if op & 6 == 2:  # qos 1
+            self._recent_pids[self._rx_count % _RECENT_PIDS] = pid
+            self._rx_count += 1
             pkt = bytearray(b"\x40\x02\0\0")  # Send PUBACK
             struct.pack_into("!H", pkt, 2, pid)
             await self._as_write(pkt)
         elif op & 6 == 4:  # qos 2 not supported
             raise OSError(-1, "QoS 2 not supported")
 
+    # On CONNACK: pids received on the last connection after the last one the broker is known to have read the PUBACK of. Only these
+    # can come back as DUP, brokers reuse a pid after its PUBACK (e.g. the lowest free pid). A new session (clean) redelivers nothing.
+    def _update_unacked_pids(self, is_new_session):
+        for i in range(_RECENT_PIDS):
+            self._unacked_pids[i] = 0
+        if not is_new_session:
+            start = max(self._acked_count, self._conn_count, self._rx_count - _RECENT_PIDS)
+            for n in range(start, self._rx_count):
+                self._unacked_pids[n % _RECENT_PIDS] = self._recent_pids[n % _RECENT_PIDS]
+        self._conn_count = self._rx_count
+        self._acked_count = self._rx_count
+
+    # A redelivered pid is only a duplicate if its PUBACK may have been lost, each pid matches once (a new message may reuse it)
+    def _take_unacked_pid(self, pid):
+        for i in range(_RECENT_PIDS):
+            if self._unacked_pids[i] == pid:
+                self._unacked_pids[i] = 0
+                return True
+        return False
+
 
 # MQTTClient class. Handles issues relating to connectivity.
 
@@ -557,6 +653,7 @@ class MQTTClient(MQTT_base):
             self._ping_interval = p_i
         self._in_connect = False
         self._has_connected = False  # Define 'Clean Session' value to use.
+        self._down_t = ticks_ms()  # Time of last outage, for reconnect duration metric
         self._tasks = []
         if ESP8266:
             import esp
@@ -592,24 +689,25 @@ class MQTTClient(MQTT_base):
                 # https://datasheets.raspberrypi.com/picow/connecting-to-the-internet-with-pico-w.pdf
                 # para 3.6.3
                 s.config(pm=0xA11140)
-            s.connect(self._ssid, self._wifi_pw)
-            for _ in range(60):  # Break out on fail or success. Check once per sec.
-                await asyncio.sleep(1)
-                # Loop while connecting or no IP
-                if s.isconnected():
-                    break
-                if ESP32:
-                    if s.status() != network.STAT_CONNECTING:  # 1001
-                        break
-                elif PYBOARD:  # No symbolic constants in network
-                    if not 1 <= s.status() <= 2:
-                        break
-                elif RP2:  # 1 is STAT_CONNECTING. 2 reported by user (No IP?)
-                    if not 1 <= s.status() <= 2:
+            if not s.isconnected():  # Already associated (e.g. by the boot sequence): keep the link, integrity is still checked
+                s.connect(self._ssid, self._wifi_pw)
+                for _ in range(60):  # Break out on fail or success. Check once per sec.
+                    await asyncio.sleep(1)
+                    # Loop while connecting or no IP
+                    if s.isconnected():
                         break
-            else:  # Timeout: still in connecting state
-                s.disconnect()
-                await asyncio.sleep(1)
+                    if ESP32:
+                        if s.status() != network.STAT_CONNECTING:  # 1001
+                            break
+                    elif PYBOARD:  # No symbolic constants in network
+                        if not 1 <= s.status() <= 2:
+                            break
+                    elif RP2:  # 1 is STAT_CONNECTING. 2 reported by user (No IP?)
+                        if not 1 <= s.status() <= 2:
+                            break
+                else:  # Timeout: still in connecting state
+                    s.disconnect()
+                    await asyncio.sleep(1)
 
         if not s.isconnected():  # Timed out
             raise OSError("Wi-Fi connect timed out")
@@ -622,14 +720,47 @@ class MQTTClient(MQTT_base):
                 await asyncio.sleep(1)
             self.dprint("Got reliable connection")
 
+    # DNS lookup of the broker, the address is kept for dns_ttl seconds (0: resolved once). Note this blocks if DNS lookup occurs,
+    # so reconnects use the cached address and an expired one is refreshed after the connect succeeded (never during an internet
+    # outage). If the lookup fails, the last good address is used for another dns_ttl seconds. Can be called before .connect()
+    # (e.g. to time boot phases)
+    async def resolve(self):
+        t = ticks_ms()
+        if self._brokers is not None:
+            self._use_broker()
+        key = (self.server, self.port)
+        try:
+            self._addr = socket.getaddrinfo(self.server, self.port)[0][-1]
+            self._observe("dns_ms", t)
+        except OSError:
+            if key not in self._dns_cache:
+                raise
+            self._addr = self._dns_cache[key][0]
+            self._incr("dns_fallbacks")
+        self._dns_cache[key] = (self._addr, ticks_ms())
+
+    def get_cached_address(self, server, port):  # Last resolved address of a broker without DNS lookup (e.g. to probe it), None if never resolved
+        entry = self._dns_cache.get((server, port))
+        return None if entry is None else entry[0]
+
+    def _is_dns_expired(self):  # Address of the current broker has to be resolved (not resolved yet or older than dns_ttl)
+        entry = self._dns_cache.get((self.server, self.port))
+        return entry is None or (self._dns_ttl > 0 and ticks_diff(ticks_ms(), entry[1]) >= self._dns_ttl)
+
     async def connect(self, *, quick=False):  # Quick initial connect option for battery apps
         if not self._has_connected:
-            await self.wifi_connect(quick)  # On 1st call, caller handles error
-            # Note this blocks if DNS lookup occurs. Do it once to prevent
-            # blocking during later internet outage:
-            self._addr = socket.getaddrinfo(self.server, self.port)[0][-1]
+            await self.wifi_connect(quick)  # On 1st call, caller handles error. Association is skipped if the boot sequence already associated
+        if self._brokers is not None:
+            self._use_broker()
         self._in_connect = True  # Disable low level ._isconnected check
+        t = ticks_ms()
+        is_dns_stale = False
         try:
+            if (self.server, self.port) not in self._dns_cache:  # First connect or broker pool switched to a new broker
+                await self.resolve()
+            else:
+                self._addr = self._dns_cache[(self.server, self.port)][0]
+                is_dns_stale = self._is_dns_expired()  # dns_ttl expired, refreshed once connected
             if not self._has_connected and self._clean_init and not self._clean:
                 # Power up. Clear previous session data but subsequently save it.
                 # Issue #40
@@ -646,8 +777,17 @@ class MQTTClient(MQTT_base):
         except Exception:
             self._close()
             self._in_connect = False  # Caller may run .isconnected()
+            if self._brokers is not None:
+                self._brokers.on_connect_failed()  # Next connect may use another broker
             raise
+        if self._brokers is not None:
+            self._brokers.on_connected(ticks_diff(ticks_ms(), t))
+        self._observe("broker_connect_ms", t)
         self.rcv_pids.clear()
+        if is_dns_stale:  # Uplink works, the next reconnect uses the new address
+            await self.resolve()
+        if self._has_connected:  # Reconnect: outage duration
+            self._observe("reconnect_ms", self._down_t)
         # If we get here without error broker/LAN must be up.
         self._isconnected = True
         self._in_connect = False  # Low level code can now check connectivity.
@@ -717,9 +857,13 @@ class MQTTClient(MQTT_base):
             self._reconnect()
         return self._isconnected
 
+    def reconnect(self):  # API: drop the connection, _keep_connected connects again (e.g. to another broker of the pool)
+        self._reconnect()
+
     def _reconnect(self):  # Schedule a reconnection if not underway.
         if self._isconnected:
             self._isconnected = False
+            self._down_t = ticks_ms()
             asyncio.create_task(self._kill_tasks(True))  # Shut down tasks and socket
             if self._events:  # Signal an outage
                 self.down.set()
@@ -737,7 +881,9 @@ class MQTTClient(MQTT_base):
         while self._has_connected:
             if self.isconnected():  # Pause for 1 second
                 await asyncio.sleep(1)
+                t = ticks_ms()
                 gc.collect()
+                self._observe("gc_ms", t)
             else:  # Link is down, socket is closed, tasks are killed
                 try:
                     self._sta_if.disconnect()
@@ -757,6 +903,7 @@ class MQTTClient(MQTT_base):
                     self.dprint("Reconnect OK!")
                 except OSError as e:
                     self.dprint("Error in reconnect. %s", e)
+                    self._incr("connect_fail")
                     # Can get ECONNABORTED or -1. The latter signifies no or bad CONNACK received.
                     self._close()  # Disconnect and try again.
                     self._in_connect = False
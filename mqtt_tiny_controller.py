@@ -1,708 +1,1616 @@
-import network,urequests, utime, ubinascii, ntptime
-import json, re, gc, os, machine
-import uasyncio as asyncio
-from machine import Pin
-from collections import OrderedDict
-from mqtt_as import MQTTClient, config
-from mqtt_tiny_controller_config import *
-from mqtt_tiny_controller_common import *
-from mqtt_local import *
-#
-# Description: 
-# MqttTinyController runs on Raspberry Pi PicoW (RP2040) using any free cloud MQTT broker (e.g. HiveHQ or Mosquitto) to control home automation relay switches and contact switches.
-#
-# For installation and examples, please read the project readme on GitHub:
-# Github: https://github.com/DIY-able/MqttTinyController
-
-# mqtt_as.py and mqtt_local.py are written by Peter Hinch. It's an AMAZING library. Forget about umqtt.simple, umqtt.robust!
-# Github: https://github.com/peterhinch/micropython-mqtt 
-
-# Change Log:
-# Mar 17, 2023, v1.0   [DIYable] - Based on umqtt sample, fixed memory errors and implementing automatic reconnection logic for both WiFi and MQTT broker.
-# Jan 30, 2024, v1.1   [DIYable] - Integrated JSON payload support to accommodate the mobile app "IoT MQTT Panel."
-# Feb 01, 2024, v1.2   [DIYable] - Added hardware burnout protection (for relays PIN.OUT only) 
-# Feb 03, 2024, v1.3   [DIYable] - Introduced momentary switch feature for relays (beneficial for garage opener remote control)
-# Feb 04, 2024, v1.4   [DIYable] - Refactored code to use class MqttPublishStats and class MqttGpioHardware
-# Feb 06, 2024, v1.5   [DIYable] - Incorporated an onboard LED for status indication.
-# Feb 08, 2024, v1.6   [DIYable] - Refactored code formatting from camelCase and PascalCase to snake_case following PEP (Python Enhancement Proposal) guidelines.
-# Feb 09, 2024, v1.7   [DIYable] - Resolved a bug related to log publishing errors to the MQTT broker during reconnection scenarios.
-# Feb 12, 2024, v1.8   [DIYable] - Addressed the issue where complete WiFi disconnection would cause hangs on QoS1, though unable to resolve, mitigated by switching to QoS0 in such cases.
-# Feb 13, 2024, v1.9   [DIYable] - Rewrote code using mqtt_as (Thanks to Peter Hinch's amazing work on mqtt_as!) and uasyncio lib to solve problem of QoS1 socket hangs issue when WIFI is down.
-# Feb 17, 2024, v2.0   [DIYable] - Optimized JSON publishing by only transmitting changed GPIO values, except during initial runs or reconnections after QoS1 outages to prevent old values from overriding new ones.
-# Feb 18, 2024, v2.0.1 [DIYable] - Implemented a retry loop before invoking "mqtt_as" code to address situations where weak WiFi signal or power outages lead to premature quitting.
-# Feb 19, 2024, v2.0.2 [DIYable] - Included total uptime statistics, outage count and onboard tempeature in the published data. 
-# Feb 20, 2024, v2.0.3 [DIYable] - Added commands "stats", "refresh", "getip" and Implemented flashing LED for powering up and machine.reset for permanent failure.
-# Feb 21, 2024, v2.0.4 [DIYable] - Added async flashing status for onboard LED before fully connected. Removed blue_led() from code and added toggle_onboard_led, set_onboard_led to mqtt_local
-# Feb 23, 2024, v2.0.5 [DIYable] - Response public IP in JSON format with customized key name, this can be useful for Serverless Azure Function or AWS Lambda to update domain using dynamic DNS service
-# Feb 25, 2024, v2.0.6 [DIYable] - Sync internal clock with NTP server, refactored time to utime. Added notification JSON as part of the log {"NOTIFY": {"GP16": 1, "GP17": 0}}
-# Feb 26, 2024, v2.1.0 [DIYable] - Added Multi-Factor Authentication (MFA) using Time-Based One-Time Passwords (TOTP) with support for multiple keys for each GPIO. 
-# Feb 28, 2024, v2.1.1 [DIYable] - Bug fix on notification and send back changed values to the broker regardless. Refactored the code.
-# Mar 04, 2024, v2.2.0 [DIYable] - Publish last publish time stamp to MQTT as log, each time microcontroller publishes GPIO values
-# Mar 17, 2024, v2.2.1 [DIYable] - Configurable momentary relay wait for x seconds before switching off, support concurrent non-blocking GPIO value change using async call
-# Mar 20, 2024, v2.2.2 [DIYable] - Issue with the asynchronous message callback where it confuses responses with requests in async calls. Refactored the code to distinguish between REQUEST and RESPONSE.
-# Mar 21, 2024, v2.2.3 [DIYable] - Removed request/response in JSON and use "UTC" in JSON message to identify if it's a response during call back. It's because mobile app "IoT MQTT Panel", publish message in a switch has to be in same pattern as JSON subscribe.
-# Apr 06, 2024, v2.2.4 [DIYable] - Minor bug fix and cleaned up and made get_stats become async call, log when wifi/broker disconnect/connect
-# May 06, 2024, v2.2.5 [DIYable] - Fixed bug on JSON ordering when request includes MFA in the payload, the order can be wrong. e.g. {"MFA":644133, "GP26": 1, "GP27": 1}. Before fix, GP27 may run first.
-# Sep 03, 2024, v2.2.6 [DIYable] - Fixed two instances of a bug related to machine.reset when a permanent failure occurred.
-# Sep 03, 2024, v2.2.7 [DIYable] - Added command "ntp" to force sync clock
-# Sep 23, 2024, v2.2.8 [DIYable] - Auto NTP clock sync when out of sync is detected (compare to PicoW default clock 2021-01-01) and added wifi strength in stats
-# Sep 24, 2024, v2.2.9 [DIYable] - Support local time in response and log, renamed key "UTC" to "TIME" (internally time is still in UTC)
-
-# References:
-# https://github.com/micropython/micropython-lib/tree/master/micropython/umqtt.simple (very simple)
-# https://peppe8o.com/mqtt-and-raspberry-pi-pico-w-start-with-mosquitto-micropython/  (machine.reset? really!)
-# https://www.hivemq.com/blog/iot-reading-sensor-data-raspberry-pi-pico-w-micropython-mqtt-node-red/
-# https://www.tomshardware.com/how-to/send-and-receive-data-raspberry-pi-pico-w-mqtt
-# https://mpython.readthedocs.io/en/master/library/mPython/umqtt.simple.html
-# https://github.com/micropython/micropython-lib/issues/103 (Qos1 sock WiFi is degraded)
-# https://github.com/micropython/micropython/issues/2568 (Mqtt Wifi dropped, timeout)
-# https://github.com/peterhinch/micropython-mqtt (Peter Hinch's "mqtt_as", the resilient asynchronous MQTT driver. Recovers from WiFi and broker outages)
-
-#  ----------------------------------------------------------------------------
-
-# Update status (dictionary in memory) from GPIO hardware value
-# e.g. method("GP15")
-def update_gpio_status_from_hardware(name):    
-    value = get_gpio_value_from_hardware(name)
-    if (value != -1):
-        mqtt_gpio_hardware[name].status  = value
-        
-# Get the status from dictionary in memory 
-def get_current_gpio_value(name):
-    try:         
-        return mqtt_gpio_hardware[name].status
-    except KeyError as ke:
-         pass   
-
-# Get GPIO value from hardware
-# e.g. method("GP15") returns 1 or 0 (int)
-def get_gpio_value_from_hardware(name):
-    value = -1
-    if (mqtt_gpio_hardware[name].pin.value() is not None):
-        value = flip_value(mqtt_gpio_hardware[name].pin.value())            
-    return value
-
-# Convert Name(string) to Pin(int)
-# e.g. method("GP15") returns 15
-def get_gp_name_to_pin(name):
-    start = name.find(gpio_prefix)+len(gpio_prefix)
-    end = len(name)
-    return int(name[start:end])
-
-def get_gpio_merged_list():
-    merged_list = gpio_pins_for_relay_switch.copy()
-    merged_list.update(gpio_pins_for_momentary_relay_switch)    
-    merged_list.update(gpio_pins_for_contact_switch)
-    return merged_list
-
-                
-# Flip 0 to 1 and 1 to 0 because of Pin.PULL_UP (for both contacts and relays), disconnected = 1 and connected = 0
-# We need to flip it reverse to connected = 1 and disconnected = 0 (more human readable)
-# e.g method(0) returns 1
-def flip_value(value):
-     if (value == 1):
-        return 0
-     if (value == 0):
-        return 1
-
-# Set GPIO value on hardware
-# e.g. method("GP15", 1) 
-async def set_gpio_value_on_hardware(name, value):
-    
-    # This is more to set GPIO on/off for Relay
-    # value = 0, 0V on output -> the breakout board GPIO(x) LED and relay(x) LED will be off, Relay(x) = ON
-    # value = 1, 3.3V on output -> the breakout board GPIO(x) LED and relay(x) LED will be on, Relay(x) = OFF
-    
-    is_gpio_set = True
-    message = ""
-    global mqtt_publish_stats
-        
-    try:
-        # Business logic to determine if hardware gpio should be set or not
-        if ((utime.time() - mqtt_gpio_hardware[name].last_modified_time) < hardware_modified_cooldown_period_in_seconds):
-            is_gpio_set = False
-            message = f"Warning: Skipping Gpio {name} value change for hardware burnout protection, min interval between value change is {hardware_modified_cooldown_period_in_seconds} seconds"
-            log(message)
-            mqtt_publish_stats.is_republish = True   # Since we are ignoring the changes, client needs to be updated by republish
-            
-        if (((utime.time() - mqtt_gpio_hardware[name].last_modified_time) < hardware_modified_threshold_in_seconds) and mqtt_gpio_hardware[name].modified_counter > hardware_modified_max):
-            is_gpio_set = False
-            mqtt_gpio_hardware[name].violation_counter = mqtt_gpio_hardware[name].violation_counter + 1    # Store total number of violation will lead to permanent fail
-            message = f"Warning: Skipping Gpio {name} value change for hardware burnout protection, number of change exceeded max threshold {hardware_modified_max} in {hardware_modified_threshold_in_seconds} seconds"
-            log(message)
-            mqtt_publish_stats.is_republish = True   # Since we are ignoring the changes, client needs to be updated by republish
-        elif (((utime.time() - mqtt_gpio_hardware[name].last_modified_time) > hardware_modified_threshold_in_seconds) and mqtt_gpio_hardware[name].modified_counter > 0):
-            mqtt_gpio_hardware[name].modified_counter = 0
-            
-        if (mqtt_gpio_hardware[name].violation_counter > hardware_violation_max + 1):
-            message = f"Error: Gpio {name} value change is permanently disabled (until hardware reset) for protection, number of violation exceeded {hardware_violation_max}"
-            log(message)
-            mqtt_publish_stats.is_republish = True   # Since we are ignoring the changes, client needs to be updated by republish
-            mqtt_gpio_hardware[name].is_modified_allowed = False
-            
-        if (len(mqtt_gpio_hardware[name].totp_keys) > 0):
-            print (f"MFA TOTP keys found for {name}")
-           
-            is_mfa_passed = False
-            for secret_key in mqtt_gpio_hardware[name].totp_keys:                
-                try:
-                    totp_number_list = get_totp(secret_key, totp_max_expired_codes)  # Get a list of current code and expired codes
-                    print(f"TOTP List={totp_number_list}")
-
-                    if (mqtt_publish_stats.totp_number in totp_number_list):
-                        print("MFA TOTP matched, hardware value change is allowed")
-                        is_mfa_passed = True   # There are multiple keys (for multiple clients), one matches means passed
-                        break
-                except Exception as e:
-                    print(f"Error in getting or matching TOTP={e}")
-                    pass
-                
-            if (is_mfa_passed == False):
-                is_gpio_set = False
-                message = f"Error: MFA validation failed, GPIO cannot be set."
-                log(message)
-                mqtt_publish_stats.is_republish = True   # Since we are ignoring the changes, client needs to be updated by republish
-
-            
-        if (is_gpio_set):
-            if (mqtt_gpio_hardware[name].is_modified_allowed):
-                time_called = utime.time()
-                if (mqtt_gpio_hardware[name].is_momentary):                    
-                    Pin(get_gp_name_to_pin(name), mode=Pin.OUT, value=0)  # On (0)
-                    await asyncio.sleep(mqtt_gpio_hardware[name].momentary_wait_in_seconds) # Non-blocking sleep for x seconds                   
-                    Pin(get_gp_name_to_pin(name), mode=Pin.OUT, value=1)  # Off (1), Publish this GPIO is needed because PIN returns to the original state                    
-                else:
-                    Pin(get_gp_name_to_pin(name), mode=Pin.OUT, value=flip_value(value)) # Regular relay switch
-                mqtt_gpio_hardware[name].is_changed = True  # Any hardware change needs to echo back to borker making sure client has the same value
-                    
-                mqtt_gpio_hardware[name].last_modified_time = time_called   # Because of momentary wait, we need to use the time when it was called, not after the delay
-                mqtt_gpio_hardware[name].modified_counter = mqtt_gpio_hardware[name].modified_counter + 1
-        
-        # GPIO hardware status update
-        update_gpio_status_from_hardware(name)
-        
-    except KeyError as ke:
-         pass
-    
-               
-# Check if the hardware GPIO value are different from in memory GPIO in dictionary
-def is_gpio_values_changed():    
-    is_changed = False    
-    merged_list = get_gpio_merged_list()
-       
-    # Publish if memory value is different from the hardware GPIO value
-    for x in merged_list:
-        name = gpio_prefix+str(x)
-        if (get_current_gpio_value(name) != get_gpio_value_from_hardware(name)):   # This is for PIN.IN such as contact switches          
-            update_gpio_status_from_hardware(name)
-            mqtt_gpio_hardware[name].is_changed = True
-            is_changed = True
-            print ("GPIO hardware value has changed")
-        elif (mqtt_gpio_hardware[name].is_changed):   # THis is for PIN.OUT such as relay (the is_changed flag already set)
-            is_changed = True
-            print ("GPIO value was changed (momentary switch)")
-            
-    return is_changed
-  
-# Check if GPIO status should be published to MQTT broker   
-def is_publish_gpio_status(is_goip_changed):
-
-    is_publish = False
-    is_full = False
-   
-    # Business logic safeguard to disable publishing in case of error
-    if (((utime.time() - mqtt_publish_stats.last_published_time) < publish_threshold_in_seconds) and (mqtt_publish_stats.publish_counter > publish_counter_max)):
-        # To test this case, set is_changed = True in is_gpio_values_changed() to flood the broker
-        mqtt_publish_stats.publish_counter = -1
-        log("Error: Abnormal number of publish detected in a short interval, publishing is stopped until hardware restart")                   
-    elif  (((utime.time() - mqtt_publish_stats.last_published_time) > publish_threshold_in_seconds) and mqtt_publish_stats.publish_counter >=0):
-        mqtt_publish_stats.publish_counter = 0  
-           
-    # Publish full list status to Mqtt broker first time running or republish (command is called "refresh"), otherwise only send the changed values
-    if (mqtt_publish_stats.is_first_time_run):   
-        mqtt_publish_stats.is_first_time_run = False
-        log(f"Subscribed for ClientID: {mqtt_client_id.decode('utf-8')}")
-        print("Publish (First time), send full list")
-        is_publish = True
-        is_full = True
-    elif (mqtt_publish_stats.is_republish):                
-        mqtt_publish_stats.is_republish = False
-        print("Publish (Republish), send full list")
-        is_publish = True
-        is_full = True
-    elif (((utime.time() - mqtt_publish_stats.last_scheduled_published_time) > scheduled_publish_in_seconds) and scheduled_publish_in_seconds > 0):
-        mqtt_publish_stats.last_scheduled_published_time = utime.time()    # If last_scheduled_published_time exceeded defined time, then publish
-        print("Publish (Scheduled), send full list")
-        is_publish = True        
-        is_full = True
-    elif (is_goip_changed and mqtt_publish_stats.publish_counter >= 0): # If publish_counter == -1 (error), it will skip publishing forever until hardware reset
-        print("Publish (Changed), only send changed values")
-        is_publish = True
-        is_full = False  # Only publish changed values
-        
-    return is_publish, is_full
-
-
-# Get all GPIO status from the master dictionary for JSON publish
-def get_gpio_status(full=False):    
-
-    gpio_status = OrderedDict()
-    
-    # Get the list in sorted order because of leading 0 integer won't work in string sorted (i.e. GP1, GP16, GP2) 
-    merged_list = get_gpio_merged_list()
-
-    # Get the list of integer (ToDo: refactor needed - maybe there is a better way to do this in Python)
-    temp_list = []
-    for a in merged_list:
-        temp_list.append(a)
-
-    # Sort the integer and then combined into OrderedDict, regular dictionary won't sort properly with JSON.dumps()
-    for x in sorted(temp_list):        
-        name = gpio_prefix+str(x)
-        if (full == False):
-            if (mqtt_gpio_hardware[name].is_changed):
-                gpio_status[name] = mqtt_gpio_hardware[name].status                            
-        else:
-            gpio_status[name] = mqtt_gpio_hardware[name].status
-        
-    return gpio_status
-
-
-# Reset all changed GPIO status
-def reset_gpio_changed_status():
-    
-    merged_list = get_gpio_merged_list()
-       
-    for x in merged_list:
-        name = gpio_prefix+str(x)
-        if (mqtt_gpio_hardware[name].is_changed):
-            mqtt_gpio_hardware[name].is_changed = False 
-            
-# Send notification if it meets the conditions            
-def send_notification(is_gpio_changed):
-    
-    if (is_gpio_changed):
-        
-        # Note: In an ideal world, sending a separate message would not be needed, as it would be the responsibility of the client to detect value changes
-        #       if the client application supports notifications. However, client applications may reset values to their defaults, potentially resulting in false positive notifications.
-        #       In such cases, reliance on the microcontroller's value as the single source is not a bad idea.
-
-        print(f"Notification is called, GPIO has changed. Only configured GPIO will receive notification.")
-        changed_gpio_status = get_gpio_status(False) # True = full list, False = only changed values
-        
-        # Send notification response for changed values
-        is_notify = False
-        temp_gpio = OrderedDict()
-
-        # Only send notificaiton for the pins configured to be sent
-        for gpio_name in changed_gpio_status:
-            pin_id = get_gp_name_to_pin(gpio_name)  # Get the name to pin id (e.g. from "GP2" to 2)
-            if (pin_id in gpio_pins_for_notification):  # Check the list in config (only send if it matches in config list)
-                is_notify = True
-                temp_gpio[gpio_name] = changed_gpio_status[gpio_name] # copy the value 
-                
-        if (is_notify):
-            notification_dict = dict()
-            notification_dict[notification_keyname]=temp_gpio   
-            log(json.dumps(notification_dict))  # format it and converted to JSON: e.g. {"NOTIFY": {"GP16": 1}} or {"NOTIFY": {"GP16": 1, "GP17": 0}}
-          
- 
-          
-# Log message printing it and also send to MQTT broker           
-def log(message):
-    print(message)
-    global mqtt_publish_stats
-    mqtt_publish_stats.log_messages.append(message)  # Save the message until next iteration in the loop to publish. If we call mqtt client here, race condition error
-        
-
-#  ----------------------------------------------------------------------------          
-    
-# Get the stats such as uptime and outages
-async def get_stats():    
-    error_message = None
-    global wlan    
-    try:
-        total_uptime = (utime.time() - mqtt_publish_stats.startup_time)
-        uptime_days, uptime_hours, uptime_minutes, uptime_seconds = calculate_time(total_uptime)
-        log(f"Uptime={uptime_days} days {uptime_hours} hrs, Outages={mqtt_publish_stats.outage_counter}, Wifi={get_formatted_wifi_strength(wlan, wifi_ssid.encode('utf-8'))}, Mem={get_formatted_memory_usage()}, Temp={get_formatted_temperature()}, Time={get_formatted_time_now(time_zone_name)}")
-    except Exception as e:
-        error_message = f"Exception to get stats: {e}"
-
-    if (error_message != None):
-        log(error_message)
-        
-# Get public ip. Note: this is an async call so it won't block
-async def get_public_ip():
-    public_ip = None
-    error_message = None
-    try:
-        temp_ip = get_public_ip_from_provider(json_ip_provider)
-        public_ip = json.dumps({ip_keyname:temp_ip}) # Customized key name for JSON result  
-    except Exception as e:
-        error_message = f"Exception to get IP: {e}"
-        
-    if (error_message != None):
-        log(error_message)
-        
-    if (public_ip != None):        
-        log(public_ip)
-    
-    
-# This scheduled_sync_clock is non-blocking, it is used for scheduled sync.     
-async def scheduled_sync_clock():
-    global mqtt_publish_stats
-    try:
-        ntptime.settime()
-        mqtt_publish_stats.last_clock_synced_time = utime.time()
-        log(f"Scheduled clock synced, timestamp={utime.time()}" )
-    except Exception as e:
-        log(f"Error synchronizing clock: {e}")
-    finally:
-        log(f"Time={get_formatted_time_now(time_zone_name)}")
-    
-# This auto_sync_clock is non-blocking, it is called when serious out of sync detected
-async def auto_sync_clock():
-    global mqtt_publish_stats
-    try:
-        ntptime.settime()
-        mqtt_publish_stats.startup_time = utime.time()    # We need to reset startup time
-        mqtt_publish_stats.last_clock_synced_time = utime.time()
-        log(f"Auto clock synced, timestamp={utime.time()}" )
-    except Exception as e:
-        log(f"Error synchronizing clock: {e}")
-    finally:
-        log(f"Time={get_formatted_time_now(time_zone_name)}")
-        
-
-#  ----------------------------------------------------------------------------
-
-# Publish Stats class to store all the global stats in mqtt_publish_stats
-class PublishStats:    
-    last_published_time = 0
-    last_scheduled_published_time = 0
-    publish_counter = 0
-    is_republish = False
-    is_first_time_run = False
-    startup_time = 0
-    log_messages = []
-    outage_counter = 0
-    is_online = False
-    last_clock_synced_time = 0
-    totp_number = 0  # This stores the global 6 digit totp number (sent by the client app)
-    
-# Define the property to used in the master dictonary mqtt_gpio_hardware    
-class GpioProperty:
-    status = 0   # status for all GPIO in 0 or 1  (Note: This is the INVERSE of real pins for human readable purpose, e.g. 0 = Off, 1 = On)
-    pin = None   # Instance of real hardware pin object (Note: Low Voltage 0 = On,  High Voltage 1 = Off)
-    last_modified_time = 0  # Last modified time for GPIO (only for relays to use only, hardware burnout protection)
-    modified_counter = 0   # Modified counter for GPIO (only for relays to use only, hardware burnout protection)
-    violation_counter = 0  # Violation counter for GPIO (only for relays to use only, hardware burnout protection)
-    is_modified_allowed = False # Is hardware PIN is allowed to set (only for relays, hardware burnout protection)
-    is_momentary = False       # Is hardware PIN is defined as momentary (only for relays, e.g. switch it on, it will turn off automatically)
-    is_changed = False         # For both contacts and relays to publish only changed GPIO value (no need to publish full list)
-    totp_keys = []  # Each GPIO can have multiple keys allowed to access (e.g. Azure function Mqtt vs Mqtt mobile app)
-    momentary_wait_in_seconds = 0  # For momentary switch (customized wait in x seconds before switching it off)
-
-#  ----------------------------------------------------------------------------                 
-
-async def pulse(): 
-    await asyncio.sleep(1)
-
-# Handling incoming message using event instances and asynchronous iterator, similar to message call back
-# To support Android "IoT MQTT Panel", all payload is in JSON
-async def messages(client):
-    async for topic, msg, retained in client.queue:
-        #print(f'Callback Topic: "{topic.decode()}" Message: "{msg.decode()}" Retained: {retained}')        
-        message = msg.decode()
-        if ((not message.startswith('Subscribed:')) and (not message.startswith('Warning:')) and (not message.startswith('Error:'))):
-            print(f"Callback message: {message}")
-
-        is_message_json = False
-     
-        try:
-           json_object = json.loads(message)
-           ordered_json_data = {}   # Ordered json by key
-           for key in sorted(json_object.keys()):
-               ordered_json_data[key] = json_object[key]           
-           is_message_json = True
-        except ValueError as ve:
-           is_message_json = False
-           
-        if (is_message_json):
-            try:
-                is_message_response = False   # Is Message a Request (sent from client) or a Response (sent from microcontroller), using UTC as identifier
-                
-                 # Because of call back, we need to ignore {"IP":"111.222.333.444"} or {"NOTIFY": {"GP16": 1, "GP17": 0}} or {"GP21":1, "UTC":"2024-01-01"}
-                for key in ordered_json_data:
-                    if ((key == ip_keyname) or (key == notification_keyname) or (key == time_keyname)):
-                        is_message_response = True
-                        print("JSON is a response, ignore in callback")
-                        break
-                
-                if(is_message_response == False):                    
-                    # Json objects are not in order, need seperated loop to set MFA if it's part of GPIO message, e.g. {"GP16":1, "MFA":123456}
-                    for key in ordered_json_data:
-                        if (key == totp_keyname):
-                            mqtt_publish_stats.totp_number = int(ordered_json_data[key])  # 6 digit integer (not string)
-                            break
-                    
-                    for key in ordered_json_data:    
-                        if (key == command_keyname):   
-                            # Command in Json received, e.g {"CMD":"getip"}
-                            # Note: key in a dict is unique, e.g. Multiple commands like this {"CMD": "getip", "CMD": "stats", "CMD": "refresh"} will only execute "refresh" (last item)            
-                            cmd_value = ordered_json_data[key] # Use dict as enum without hardcoding                        
-                            if (commands[cmd_value] == 501): 
-                                asyncio.create_task(get_stats())   # CMD "stats" async call to get stats
-                            elif (commands[cmd_value] == 502):
-                                mqtt_publish_stats.is_republish = True    # CMD "refresh", set republish next round
-                            elif (commands[cmd_value] == 503):
-                                asyncio.create_task(get_public_ip())  # CMD "getip" async call to get Ip address
-                            elif (commands[cmd_value] == 504):
-                                if (((utime.time() - mqtt_publish_stats.last_clock_synced_time) > forced_clock_sync_wait_in_seconds) and forced_clock_sync_wait_in_seconds > 0):                                                                
-                                    asyncio.create_task(scheduled_sync_clock()) # CMD "ntp" to force clock sync
-                        elif ((key != totp_keyname) and key.startswith(gpio_prefix)):
-                            value = ordered_json_data[key] # e.g. {"GP16":1, "GP17":0}
-                            if (get_current_gpio_value(key) != value):
-                                print(f"Async set value on hardware key={key}, value={value}")
-                                asyncio.create_task(set_gpio_value_on_hardware(key, value))  # Async call to set multiple hardware (e.g. multiple relays) at the same time
-            except:
-                pass
-                        
-        asyncio.create_task(pulse())
-    
-
-async def down(client):
-    global mqtt_publish_stats
-    while True:
-        await client.down.wait()  # Pause until connectivity changes
-        client.down.clear()
-        mqtt_publish_stats.is_online = False    
-        mqtt_publish_stats.outage_counter += 1
-        log(f"WiFi or broker is down, Time={get_formatted_time_now(time_zone_name)}")
-        print("WiFi or broker is down.")
-
-async def up(client):
-    while True:
-        await client.up.wait()
-        client.up.clear()
-        mqtt_publish_stats.is_online = True
-        log(f"Connected: {mqtt_client_id.decode('utf-8')}, Time={get_formatted_time_now(time_zone_name)}")
-        print(f"Connected: {mqtt_client_id.decode('utf-8')}")
-        await client.subscribe(mqtt_topic, mqtt_qos)
-        
-async def onboard_led_online_status():
-    while True:
-        if (mqtt_publish_stats.is_online):
-            set_onboard_led(True)
-        else:
-            toggle_onboard_led()
-        await asyncio.sleep(1)
-    
-#  ----------------------------------------------------------------------------      
-# init mqtt_as using config[] as per original library
-
-def init_mqtt_as():
-    
-    global config
-
-     # Load configuration for mqtt_as
-    config['ssid'] = wifi_ssid
-    config['wifi_pw'] = wifi_pass
-    config['will'] = (mqtt_topic, f"Disconnected for ClientID={mqtt_client_id.decode('utf-8')}", False, 0) # Last will send as QoS0
-    config['keepalive'] = 120
-    config["queue_len"] = 1  # Use event interface with default queue
-    config['user'] = broker_user
-    config['password'] = broker_pass
-    config['server'] = broker_server
-    config['ssl'] = True   # mqtt_as uses port 8883 if ssl is true or use config['port']
-    config['ssl_params'] = {"server_hostname": broker_server}
-    config["client_id"] = mqtt_client_id
-    config["clean"] = mqtt_clean   # Set this to False (clear session) for reconnection to work Qos1 message recovery during outage
-    config["clean_init"] = True   # clean_init should normally be True. If False the system will attempt to restore a prior session on the first connection. This may result in a large backlog of qos==1 messages being received    
-    
-    
-# init in-memory dict and stats    
-def init():
-    
-    global mqtt_publish_stats
-    global mqtt_gpio_hardware    
-    
-    mqtt_gpio_hardware = {}
-    
-    # Combine 2 different relays into one single list
-    relay_only_list = gpio_pins_for_relay_switch.copy()
-    relay_only_list.update(gpio_pins_for_momentary_relay_switch)   
-    
-    # Set all Gpio status to 0 and init hardware
-    for x in relay_only_list:
-        name = gpio_prefix+str(x)        
-        mqtt_gpio_hardware[name] = GpioProperty()
-        mqtt_gpio_hardware[name].status = 0   # status is using 0 and 1, same as real PIN value
-        mqtt_gpio_hardware[name].pin = Pin(x, mode=Pin.OUT, value=1)  # Value=1, high voltage
-        mqtt_gpio_hardware[name].last_modified_time = utime.time() # only for relay
-        mqtt_gpio_hardware[name].modified_counter = 0 # only for relay
-        mqtt_gpio_hardware[name].violation_counter = 0 # only for relay
-        mqtt_gpio_hardware[name].is_modified_allowed = True # only for relay
-        
-        if (x in gpio_pins_for_momentary_relay_switch):
-            mqtt_gpio_hardware[name].is_momentary = True
-            mqtt_gpio_hardware[name].momentary_wait_in_seconds = momentary_switch_default_wait_in_seconds   # Default is set to 2 secs
-            try:
-                if (gpio_pins_for_momentary_relay_switch[x] is not None):
-                    mqtt_gpio_hardware[name].momentary_wait_in_seconds = gpio_pins_for_momentary_relay_switch[x]  # Set customized wait (in seconds) for momentary relay
-            except:
-                pass            
-        else:
-            mqtt_gpio_hardware[name].is_momentary = False
-            
-        update_gpio_status_from_hardware(name)   # Good practice to sync based on hardware value
-        
-    # Contact switch
-    for y in gpio_pins_for_contact_switch:
-        name = gpio_prefix+str(y)
-        mqtt_gpio_hardware[name] = GpioProperty()
-        mqtt_gpio_hardware[name].status = 0 # status is using 0 and 1, same as real PIN value
-        mqtt_gpio_hardware[name].pin = Pin(y, Pin.IN, Pin.PULL_UP)  # Create an input pin, with a pull up resistor
-            
-        update_gpio_status_from_hardware(name)
-
-    # TOTP
-    for z in gpio_pins_for_totp_enabled:
-        name = gpio_prefix+str(z)
-        mqtt_gpio_hardware[name].totp_keys = gpio_pins_for_totp_enabled[z]
-                
-        
-    # init stats
-    mqtt_publish_stats = PublishStats()    
-    mqtt_publish_stats.last_published_time = utime.time()
-    mqtt_publish_stats.last_scheduled_published_time = utime.time()
-    mqtt_publish_stats.publish_counter = 0    # If it's -1, it errors out and stops publishing forever
-    mqtt_publish_stats.is_republish = False
-    mqtt_publish_stats.is_first_time_run = True    # First time init to true
-    mqtt_publish_stats.startup_time = utime.time()
-    mqtt_publish_stats.is_online = False   # For onboard LED to use
-    mqtt_publish_stats.last_clock_synced_time = utime.time()  # NOTE: becuase we ran the startup_clock_sync(), without error we assume at this point we have the clock synced successfully
-    mqtt_publish_stats.totp_number = 0    # This stores the global 6 digit totp number (sent by the client app)
-
-#  ----------------------------------------------------------------------------      
-# Worker for infinite while loop
-
-# Technical notes on wifi/broker test:
-#
-# Case 1: Auto re-connect when network fails:  
-#    Use firewall rules on your router to block traffic to broker after connection is established 
-# Case 2: Auto re-connect when Wifi fails (SSID is still available)    
-#    Disconnect your PicoW using router admin
-# Case 3: Auto re-connect when Wifi totally gone (SSID is NOT available)
-#    Power off the router or change the SSID name of WiFi
-
-async def worker(client):
-
-    global mqtt_publish_stats
-    
-    # Create a task to show online status on LED
-    asyncio.create_task(onboard_led_online_status())   # Async task for online status
-    
-    try:        
-        await client.connect()
-    except OSError:
-        print('Connection failed.')
-        return
-    
-    for task in (up, down, messages):
-        asyncio.create_task(task(client))
-
-
-    while True:
-        await asyncio.sleep(5)
-
-        # Uncomment this to Delete all RETAIN messages from the MQTT broker (e.g. if you accidentially set the retain flag in "Iot MQTT Panel" app)
-        # client.publish(mqtt_topic, '', True)
-        
-        # Non-blocking NTP clock sync (daily sync)
-        if (((utime.time() - mqtt_publish_stats.last_clock_synced_time) > scheduled_clock_sync_in_seconds) and scheduled_clock_sync_in_seconds > 0):
-            asyncio.create_task(scheduled_sync_clock())       
-        
-        # Non-blocking NTP clock sync (force sync if first time run or it's out of sync is detected when first time ntp sync fails)
-        # PicoW default clock is 2021-01-01 0:0:0 + 31533803 seconds is 2021-12-31 23:23:23
-        if ((mqtt_publish_stats.is_first_time_run) or (utime.time() < (default_clock_year_in_unix_timestamp + 31533803)) and (((utime.time() - mqtt_publish_stats.last_clock_synced_time) > forced_clock_sync_wait_in_seconds) and forced_clock_sync_wait_in_seconds > 0)):
-            asyncio.create_task(auto_sync_clock())
-        
-        
-        # Publishing of LOG and GOIP values are in two different steps
-        # Because we are not updating publish_counter or last_published_time for log
-        # Also, log can be seperated into a different MQTT topic if needed in the future
-                
-        # Publishing of LOG:
-        # Notes: If client.publish is called in callback, it will error out in mqtt broker reconnect scenario. Do it here.
-        if (mqtt_publish_stats.log_messages is not None):
-            for x in mqtt_publish_stats.log_messages:                
-                await client.publish(mqtt_topic, x, mqtt_retain, mqtt_qos)  #QoS=1, Retain flag=false
-                mqtt_publish_stats.log_messages = []                    
-
-        # Publishing of GPIO and Notification:
-        # Check if any GPIO hardware value(s) has changed compare to master copy in dictionary
-        is_gpio_changed = is_gpio_values_changed()           
-        send_notification(is_gpio_changed)      # Notification if necessary
-        is_publish, is_full = is_publish_gpio_status(is_gpio_changed)  # Full list or partial list to Mqtt broker based on business logic 
-              
-        if (is_publish):
-            json_gpio_status = None  # this json contains either full list of GPIO status values or partial list of changed values  
-                        
-            if (is_full):
-                all_gpio = get_gpio_status(True) # Get the full list in JSON
-                all_gpio[time_keyname] = get_formatted_time_now(time_zone_name)
-                json_gpio_status = json.dumps(all_gpio)                
-            else:
-                all_gpio = get_gpio_status(False) # Get the list of changed values in JSON
-                all_gpio[time_keyname] = get_formatted_time_now(time_zone_name)                
-                json_gpio_status = json.dumps(all_gpio)
-                reset_gpio_changed_status()  # Reset is_changed to False            
-
-            mqtt_publish_stats.publish_counter = mqtt_publish_stats.publish_counter + 1 
-            mqtt_publish_stats.last_published_time = utime.time()            
-            
-            await client.publish(mqtt_topic, json_gpio_status, mqtt_retain, mqtt_qos)  #QoS=1, Retain flag=false
-            
-            
-            
-
-#  ----------------------------------------------------------------------------
-# Program main 
-
-mqtt_publish_stats = None
-mqtt_gpio_hardware = None
-
-# Note: The "mqtt_as" library operates under the assumption of a stable connection during startup. However, it faces
-#       the risk of permanent termination if the WiFi signal is weak during the initial startup or after a reboot following
-#       a power outage where the WiFi is not yet available.
-# Workaround: To mitigate this issue, a retry loop has been implemented before invoking the "mqtt_as" code.
-
-global wlan
-wlan = connect_wifi(toggle_onboard_led)   # pass "toggle_onboard_led" as delegate
-if wlan.isconnected():             
-
-    # Use NTP server to sync the internal clock
-    init()         # If there is any error in clock sync, we use the default RTC start time: Jan 1, 2021 (TOTP will fail though)
-
-    # Init config[] for mqtt_as
-    init_mqtt_as()
-
-    # Set up client. Enable optional debug statements.
-    MQTTClient.DEBUG = True
-    client = MQTTClient(config)
-
-    try:
-        print(f"Memory usage: {get_formatted_memory_usage()}")
-        asyncio.run(worker(client))
-    finally:  # Prevent LmacRxBlk:1 errors.
-        print("Shutting down....")
-        print(f"Memory usage: {get_formatted_memory_usage()}")
-        set_onboard_led(False)    # PicoW has only one LED 
-        client.close()
-        asyncio.new_event_loop()
-        print('Wifi connected but broker permanently Failed, machine will reboot...')
-        utime.sleep(wifi_reset_delay_in_seconds)        
-        machine.reset()
-
-
+import utime
+import json, gc, machine
+import uasyncio as asyncio
+from collections import OrderedDict
+from mqtt_as import MQTTClient, config
+import mqtt_tiny_controller_config
+from mqtt_tiny_controller_common import *
+from mqtt_tiny_controller_compiled_config import compile_config
+from mqtt_tiny_controller_metrics import MetricsRegistry, loop_lag_monitor
+from mqtt_tiny_controller_gpio import create_gpio_backend
+from mqtt_tiny_controller_timer import TimerService
+from mqtt_tiny_controller_limiter import TokenBucket
+from mqtt_tiny_controller_executor import CommandExecutor
+from mqtt_tiny_controller_outbox import Outbox, PRIORITY_STATE, PRIORITY_RESPONSE, PRIORITY_LOG
+from mqtt_tiny_controller_codec import encode_state, decode_command, get_masks
+from mqtt_local import *
+#
+# Description: 
+# MqttTinyController runs on Raspberry Pi PicoW (RP2040) using any free cloud MQTT broker (e.g. HiveHQ or Mosquitto) to control home automation relay switches and contact switches.
+#
+# For installation and examples, please read the project readme on GitHub:
+# Github: https://github.com/DIY-able/MqttTinyController
+
+# mqtt_as.py and mqtt_local.py are written by Peter Hinch. It's an AMAZING library. Forget about umqtt.simple, umqtt.robust!
+# Github: https://github.com/peterhinch/micropython-mqtt 
+
+# Change Log:
+# Mar 17, 2023, v1.0   [DIYable] - Based on umqtt sample, fixed memory errors and implementing automatic reconnection logic for both WiFi and MQTT broker.
+# Jan 30, 2024, v1.1   [DIYable] - Integrated JSON payload support to accommodate the mobile app "IoT MQTT Panel."
+# Feb 01, 2024, v1.2   [DIYable] - Added hardware burnout protection (for relays PIN.OUT only) 
+# Feb 03, 2024, v1.3   [DIYable] - Introduced momentary switch feature for relays (beneficial for garage opener remote control)
+# Feb 04, 2024, v1.4   [DIYable] - Refactored code to use class MqttPublishStats and class MqttGpioHardware
+# Feb 06, 2024, v1.5   [DIYable] - Incorporated an onboard LED for status indication.
+# Feb 08, 2024, v1.6   [DIYable] - Refactored code formatting from camelCase and PascalCase to snake_case following PEP (Python Enhancement Proposal) guidelines.
+# Feb 09, 2024, v1.7   [DIYable] - Resolved a bug related to log publishing errors to the MQTT broker during reconnection scenarios.
+# Feb 12, 2024, v1.8   [DIYable] - Addressed the issue where complete WiFi disconnection would cause hangs on QoS1, though unable to resolve, mitigated by switching to QoS0 in such cases.
+# Feb 13, 2024, v1.9   [DIYable] - Rewrote code using mqtt_as (Thanks to Peter Hinch's amazing work on mqtt_as!) and uasyncio lib to solve problem of QoS1 socket hangs issue when WIFI is down.
+# Feb 17, 2024, v2.0   [DIYable] - Optimized JSON publishing by only transmitting changed GPIO values, except during initial runs or reconnections after QoS1 outages to prevent old values from overriding new ones.
+# Feb 18, 2024, v2.0.1 [DIYable] - Implemented a retry loop before invoking "mqtt_as" code to address situations where weak WiFi signal or power outages lead to premature quitting.
+# Feb 19, 2024, v2.0.2 [DIYable] - Included total uptime statistics, outage count and onboard tempeature in the published data. 
+# Feb 20, 2024, v2.0.3 [DIYable] - Added commands "stats", "refresh", "getip" and Implemented flashing LED for powering up and machine.reset for permanent failure.
+# Feb 21, 2024, v2.0.4 [DIYable] - Added async flashing status for onboard LED before fully connected. Removed blue_led() from code and added toggle_onboard_led, set_onboard_led to mqtt_local
+# Feb 23, 2024, v2.0.5 [DIYable] - Response public IP in JSON format with customized key name, this can be useful for Serverless Azure Function or AWS Lambda to update domain using dynamic DNS service
+# Feb 25, 2024, v2.0.6 [DIYable] - Sync internal clock with NTP server, refactored time to utime. Added notification JSON as part of the log {"NOTIFY": {"GP16": 1, "GP17": 0}}
+# Feb 26, 2024, v2.1.0 [DIYable] - Added Multi-Factor Authentication (MFA) using Time-Based One-Time Passwords (TOTP) with support for multiple keys for each GPIO. 
+# Feb 28, 2024, v2.1.1 [DIYable] - Bug fix on notification and send back changed values to the broker regardless. Refactored the code.
+# Mar 04, 2024, v2.2.0 [DIYable] - Publish last publish time stamp to MQTT as log, each time microcontroller publishes GPIO values
+# Mar 17, 2024, v2.2.1 [DIYable] - Configurable momentary relay wait for x seconds before switching off, support concurrent non-blocking GPIO value change using async call
+# Mar 20, 2024, v2.2.2 [DIYable] - Issue with the asynchronous message callback where it confuses responses with requests in async calls. Refactored the code to distinguish between REQUEST and RESPONSE.
+# Mar 21, 2024, v2.2.3 [DIYable] - Removed request/response in JSON and use "UTC" in JSON message to identify if it's a response during call back. It's because mobile app "IoT MQTT Panel", publish message in a switch has to be in same pattern as JSON subscribe.
+# Apr 06, 2024, v2.2.4 [DIYable] - Minor bug fix and cleaned up and made get_stats become async call, log when wifi/broker disconnect/connect
+# May 06, 2024, v2.2.5 [DIYable] - Fixed bug on JSON ordering when request includes MFA in the payload, the order can be wrong. e.g. {"MFA":644133, "GP26": 1, "GP27": 1}. Before fix, GP27 may run first.
+# Sep 03, 2024, v2.2.6 [DIYable] - Fixed two instances of a bug related to machine.reset when a permanent failure occurred.
+# Sep 03, 2024, v2.2.7 [DIYable] - Added command "ntp" to force sync clock
+# Sep 23, 2024, v2.2.8 [DIYable] - Auto NTP clock sync when out of sync is detected (compare to PicoW default clock 2021-01-01) and added wifi strength in stats
+# Sep 24, 2024, v2.2.9 [DIYable] - Support local time in response and log, renamed key "UTC" to "TIME" (internally time is still in UTC)
+# Oct 18, 2026, v2.3.0 [DIYable] - Added metrics registry (counters, gauges, latency histograms) for PUBACK RTT, publish wait, parse time, command-to-relay latency, reconnect and gc, command "metrics"
+# Oct 18, 2026, v2.3.1 [DIYable] - Added event loop lag monitor and opt-in per-task timing (cumulative run time, max single step) reported in stats and metrics
+# Oct 18, 2026, v2.3.2 [DIYable] - Moved program main into main() (called by main.py) so the controller can be imported without side effects, added host_sim package to run it on CPython
+# Oct 18, 2026, v2.3.3 [DIYable] - Added GPIO backend (SIO registers on RP2040, Pin objects as fallback), change detection reads all pins at once and multi-relay commands switch with one set/clear mask
+# Oct 18, 2026, v2.3.4 [DIYable] - Added timer service (one task with a min-heap) for momentary relay release instead of one sleeping task per press, GPIO keys no longer spawn a task per key
+# Oct 18, 2026, v2.3.5 [DIYable] - Latest-wins pending command per GPIO and settle window after reconnect, QoS1 backlog replay results in one hardware write instead of a cooldown warning storm
+# Oct 18, 2026, v2.3.6 [DIYable] - Token bucket rate limiting per relay and for publishes, excess relay changes are deferred and publishes are held for next round, permanent lockout is opt-in (hardware_lockout_enabled, publish_lockout_enabled)
+# Oct 18, 2026, v2.3.7 [DIYable] - Commands (stats, getip, ntp, metrics) run on a fixed size command executor with bounded queue and one pending command per type, instead of a task per message
+# Oct 18, 2026, v2.3.8 [DIYable] - Optional binary payloads on mqtt_binary_topic (14 bytes pin mask state, opcode commands) without JSON parsing, JSON stays the default for "IoT MQTT Panel"
+# Oct 18, 2026, v2.3.9 [DIYable] - Sequence number "SEQ" on every full and changed values publish and {"SINCE": N} command to resync from a history of recent changes (full publish if N is too old)
+# Oct 18, 2026, v2.3.10 [DIYable] - Optional retained full GPIO snapshot on mqtt_state_topic (published only when values change), cleared by the last will on disconnect and republished on reconnect
+# Oct 18, 2026, v2.3.11 [DIYable] - Config is compiled once in init() into a read-only mqtt_config (validated pin roles, types and topics, precomputed pin tables, encoded topics, decoded TOTP secrets)
+# Oct 18, 2026, v2.3.12 [DIYable] - Lazy imports: TOTP (pico_2fa_totp), HTTP (urequests) and NTP (ntptime) load on first use, unused re, os, ubinascii imports removed, added startup benchmark
+# Oct 18, 2026, v2.3.13 [DIYable] - Async boot sequence: relays are initialized first, then Wi-Fi, DNS, broker connect and NTP run as tasks (NTP runs while the broker connects),
+#                                    boot phase durations and boot-to-first-publish time as metrics gauges, mqtt_as skips its Wi-Fi check when already associated
+# Oct 18, 2026, v2.3.14 [DIYable] - Opt-in persistent state journal (journal_enabled): relay states and counters are restored in init() after a power blip,
+#                                    CRC protected records on flash with A/B compaction and rate limited writes
+# Oct 18, 2026, v2.3.15 [DIYable] - Opt-in core 1 service (core1_enabled): contact switch sampling with debounce and TOTP codes on the second core,
+#                                    exchanged with the event loop through lock protected ring buffers
+# Oct 18, 2026, v2.3.16 [DIYable] - Opt-in LAN control endpoint (lan_enabled): same JSON commands over TCP from the local network with TOTP required,
+#                                    relays are controlled without the cloud broker (also when the internet is down), changes are still published to the broker
+# Oct 18, 2026, v2.3.17 [DIYable] - On-device automation rules (automation_rules): contact switch changes switch relays without a cloud round trip,
+#                                    rules are indexed by trigger GPIO at init(), with conditions, delay and rate limit, actions go through burnout protection
+# Oct 18, 2026, v2.3.18 [DIYable] - On-device relay schedules (relay_schedules, command {"SCHEDULE": [...]} saved to schedule_file) on the timer service in local time,
+#                                    scheduled publish, NTP clock sync and scheduled metrics moved from the 5 seconds worker loop to the timer service
+# Oct 19, 2026, v2.3.19 [DIYable] - Broker failover (broker_failover_servers): brokers by priority with connect time and failures per broker,
+#                                    failover after broker_failover_after_failures failed connects, fail-back when a TCP probe of the preferred broker succeeds
+# Oct 19, 2026, v2.3.20 [DIYable] - Broker address cached for broker_dns_ttl_in_seconds with the last good address used when DNS fails,
+#                                    TLS session resumed on reconnect where the ssl module supports it, handshake duration in "tls_handshake_ms"
+# Oct 19, 2026, v2.3.21 [DIYable] - mqtt_as drops QoS1 messages redelivered with the DUP flag when their pid was received before the link dropped
+#                                    (still acknowledged, counted in "dup_discarded"), a lost PUBACK no longer repeats a relay command or momentary pulse
+# Oct 19, 2026, v2.3.22 [DIYable] - Priority outbox with a publisher task: GPIO status and notifications before command responses before logs,
+#                                    QoS per class (mqtt_response_qos, mqtt_log_qos, logs can be demoted to QoS0), state never waits behind the log backlog
+
+# References:
+# https://github.com/micropython/micropython-lib/tree/master/micropython/umqtt.simple (very simple)
+# https://peppe8o.com/mqtt-and-raspberry-pi-pico-w-start-with-mosquitto-micropython/  (machine.reset? really!)
+# https://www.hivemq.com/blog/iot-reading-sensor-data-raspberry-pi-pico-w-micropython-mqtt-node-red/
+# https://www.tomshardware.com/how-to/send-and-receive-data-raspberry-pi-pico-w-mqtt
+# https://mpython.readthedocs.io/en/master/library/mPython/umqtt.simple.html
+# https://github.com/micropython/micropython-lib/issues/103 (Qos1 sock WiFi is degraded)
+# https://github.com/micropython/micropython/issues/2568 (Mqtt Wifi dropped, timeout)
+# https://github.com/peterhinch/micropython-mqtt (Peter Hinch's "mqtt_as", the resilient asynchronous MQTT driver. Recovers from WiFi and broker outages)
+
+#  ----------------------------------------------------------------------------
+
+# Update status (dictionary in memory) from GPIO hardware value
+# e.g. method("GP15")
+def update_gpio_status_from_hardware(name):    
+    value = get_gpio_value_from_hardware(name)
+    if (value != -1):
+        mqtt_gpio_hardware[name].status  = value
+        
+# Get the status from dictionary in memory 
+def get_current_gpio_value(name):
+    try:         
+        return mqtt_gpio_hardware[name].status
+    except KeyError as ke:
+         pass   
+
+# Get GPIO value from hardware
+# e.g. method("GP15") returns 1 or 0 (int)
+def get_gpio_value_from_hardware(name):
+    value = flip_value(gpio_backend.read(mqtt_gpio_hardware[name].pin_id))
+    if (value is None):
+        value = -1
+    return value
+
+# Convert Name(string) to Pin(int)
+# e.g. method("GP15") returns 15
+def get_gp_name_to_pin(name):
+    return mqtt_config.gpio_pins[name]
+
+                
+# Flip 0 to 1 and 1 to 0 because of Pin.PULL_UP (for both contacts and relays), disconnected = 1 and connected = 0
+# We need to flip it reverse to connected = 1 and disconnected = 0 (more human readable)
+# e.g method(0) returns 1
+def flip_value(value):
+     if (value == 1):
+        return 0
+     if (value == 0):
+        return 1
+
+# Hardware burnout protection: min interval between value changes (cooldown) and token bucket per GPIO (hardware_modified_max changes per hardware_modified_threshold_in_seconds)
+# Returns 0 if value change is allowed now, ms to wait if the change has to be deferred, or -1 if value change is not allowed (contact switch or lockout)
+# e.g. method("GP16") returns 8000 if the bucket of GP16 is empty and the next token is in 8 seconds
+def get_gpio_set_wait_in_ms(name):
+    if (not mqtt_gpio_hardware[name].is_modified_allowed):
+        return -1
+    return max(mqtt_gpio_hardware[name].cooldown_bucket.get_wait_in_ms(), mqtt_gpio_hardware[name].modified_bucket.get_wait_in_ms())
+
+# Business logic (hardware burnout protection) to determine if hardware gpio should be set now or not, MFA is checked when the command is received
+# e.g. method("GP15") returns True if value change is allowed
+def is_gpio_set_allowed(name):
+    wait_in_ms = get_gpio_set_wait_in_ms(name)
+    if (wait_in_ms == 0):
+        return True
+    if (wait_in_ms > 0):
+        log(f"Warning: Skipping Gpio {name} value change for hardware burnout protection, next change is allowed in {wait_in_ms} ms")
+        mqtt_publish_stats.is_republish = True   # Since we are ignoring the changes, client needs to be updated by republish
+    return False
+
+# Take the tokens for a hardware value change
+def consume_gpio_tokens(name):
+    mqtt_gpio_hardware[name].cooldown_bucket.consume()
+    mqtt_gpio_hardware[name].modified_bucket.consume()
+
+# Value change of a GPIO is deferred (the latest command stays pending until a token is available), logged at most once per hardware_modified_threshold_in_seconds
+# Opt-in lockout (hardware_lockout_enabled) counts each logged deferral with empty bucket as violation and permanently disables the GPIO after hardware_violation_max
+def defer_gpio_command(name, wait_in_ms):
+    mqtt_metrics.incr("commands_deferred")
+    if ((utime.time() - mqtt_gpio_hardware[name].last_deferral_logged_time) < mqtt_config.hardware_modified_threshold_in_seconds):
+        return
+    mqtt_gpio_hardware[name].last_deferral_logged_time = utime.time()
+    log(f"Warning: Deferring Gpio {name} value change by {wait_in_ms} ms for hardware burnout protection, max {mqtt_config.hardware_modified_max} changes in {mqtt_config.hardware_modified_threshold_in_seconds} seconds")
+    
+    if (mqtt_config.hardware_lockout_enabled and mqtt_gpio_hardware[name].modified_bucket.get_wait_in_ms() > 0):
+        mqtt_gpio_hardware[name].violation_counter = mqtt_gpio_hardware[name].violation_counter + 1    # Store total number of violation will lead to permanent fail
+        if (mqtt_gpio_hardware[name].violation_counter > mqtt_config.hardware_violation_max + 1):
+            log(f"Error: Gpio {name} value change is permanently disabled (until hardware reset) for protection, number of violation exceeded {mqtt_config.hardware_violation_max}")
+            mqtt_publish_stats.is_republish = True   # Since we are ignoring the changes, client needs to be updated by republish
+            mqtt_gpio_hardware[name].is_modified_allowed = False
+
+
+# MFA check for GPIO with TOTP keys, using the 6 digit TOTP number sent with the command
+# e.g. method("GP16") returns True if MFA is not enabled for GP16 or the TOTP number matches
+def is_gpio_mfa_passed(name):
+
+    if (len(mqtt_gpio_hardware[name].totp_keys) == 0):
+        return True
+        
+    print (f"MFA TOTP keys found for {name}")
+   
+    is_mfa_passed = False
+    for secret_key in mqtt_gpio_hardware[name].totp_keys:                
+        try:
+            totp_number_list = get_gpio_totp_codes(secret_key)  # Get a list of current code and expired codes
+            print(f"TOTP List={totp_number_list}")
+
+            if (mqtt_publish_stats.totp_number in totp_number_list):
+                print("MFA TOTP matched, hardware value change is allowed")
+                is_mfa_passed = True   # There are multiple keys (for multiple clients), one matches means passed
+                break
+        except Exception as e:
+            print(f"Error in getting or matching TOTP={e}")
+            pass
+        
+    if (is_mfa_passed == False):
+        message = f"Error: MFA validation failed, GPIO cannot be set."
+        log(message, PRIORITY_RESPONSE)
+        mqtt_publish_stats.is_republish = True   # Since we are ignoring the changes, client needs to be updated by republish
+
+    return is_mfa_passed
+
+
+# Current and expired TOTP codes for secret key, precomputed on core 1 if enabled (computed here if core 1 is not ready yet)
+def get_gpio_totp_codes(secret_key):
+    if (mqtt_core1 is not None):
+        totp_number_list = mqtt_core1.get_totp_codes(secret_key)
+        if (totp_number_list is not None):
+            return totp_number_list
+        mqtt_metrics.incr("totp_core1_misses")
+    return get_totp(secret_key, mqtt_config.totp_max_expired_codes)
+
+
+# Update last modified time and changed flag after hardware value change
+def mark_gpio_modified(name, time_called):
+    mqtt_gpio_hardware[name].is_changed = True  # Any hardware change needs to echo back to borker making sure client has the same value
+    mqtt_gpio_hardware[name].last_modified_time = time_called   # Because of momentary wait, we need to use the time when it was called, not after the delay
+
+
+# Set GPIO value on hardware, momentary relay is released later by the timer service (no task is waiting for it)
+# e.g. method("GP15", 1) 
+# received_time is ticks_ms() when the command was received, for command-to-relay latency metric
+def set_gpio_value_on_hardware(name, value, received_time=None):
+    
+    # This is more to set GPIO on/off for Relay
+    # value = 0, 0V on output -> the breakout board GPIO(x) LED and relay(x) LED will be off, Relay(x) = ON
+    # value = 1, 3.3V on output -> the breakout board GPIO(x) LED and relay(x) LED will be on, Relay(x) = OFF
+        
+    try:
+        if (not mqtt_gpio_hardware[name].is_momentary):
+            set_gpio_values_on_hardware({name: value}, received_time)   # Regular relay switch
+            return
+        
+        if (is_gpio_set_allowed(name)):
+            time_called = utime.time()
+            gpio_backend.write(mqtt_gpio_hardware[name].pin_id, 0)  # On (0)
+            consume_gpio_tokens(name)
+            if (received_time is not None):
+                mqtt_metrics.observe("cmd_to_relay_ms", utime.ticks_diff(utime.ticks_ms(), received_time))
+            mqtt_timer.call_later(mqtt_gpio_hardware[name].momentary_wait_in_seconds * 1000, release_momentary_relay, (name, time_called))   # Off after x seconds
+            return
+        
+        # GPIO hardware status update
+        update_gpio_status_from_hardware(name)
+        
+    except KeyError as ke:
+         pass
+
+
+# Timer callback to switch off momentary relay, arg is (name, time called)
+# e.g. method(("GP18", 1709164800))
+def release_momentary_relay(arg):
+    name, time_called = arg
+    gpio_backend.write(mqtt_gpio_hardware[name].pin_id, 1)  # Off (1), Publish this GPIO is needed because PIN returns to the original state
+    mark_gpio_modified(name, time_called)
+    update_gpio_status_from_hardware(name)
+
+
+# Set multiple regular relays at the same time with one set/clear mask write (relay On is low voltage, i.e. clear mask)
+# e.g. method({"GP16": 1, "GP17": 0})
+def set_gpio_values_on_hardware(values, received_time=None):
+    
+    set_mask = 0
+    clear_mask = 0
+    modified_list = []
+    
+    for name in values:
+        try:
+            level = flip_value(values[name])
+            if ((level is not None) and is_gpio_set_allowed(name)):
+                if (level == 1):
+                    set_mask |= 1 << mqtt_gpio_hardware[name].pin_id
+                else:
+                    clear_mask |= 1 << mqtt_gpio_hardware[name].pin_id
+                modified_list.append(name)
+        except KeyError as ke:
+            pass
+            
+    if (len(modified_list) > 0):
+        time_called = utime.time()
+        gpio_backend.apply(set_mask, clear_mask)
+        if (received_time is not None):
+            mqtt_metrics.observe("cmd_to_relay_ms", utime.ticks_diff(utime.ticks_ms(), received_time))
+        for name in modified_list:
+            consume_gpio_tokens(name)
+            mark_gpio_modified(name, time_called)
+    
+    # GPIO hardware status update
+    for name in values:
+        if (name in mqtt_gpio_hardware):
+            update_gpio_status_from_hardware(name)
+    
+               
+# Put GPIO command in the pending slot of the GPIO, the latest command wins (e.g. {"GP16":1} then {"GP16":0} only sets 0)
+# The slot is applied by the timer service right after the current batch of messages, or at the end of the settle window after reconnect
+# e.g. method("GP16", 1, utime.ticks_ms())
+# is_local=True (LAN command) only fills the slot, handle_lan_message() applies it right away
+def submit_gpio_command(name, value, received_time=None, is_local=False):
+    if (name in mqtt_pending_commands):
+        mqtt_metrics.incr("commands_coalesced")
+    mqtt_pending_commands[name] = (value, received_time)
+    if (not is_local):
+        schedule_pending_commands()
+
+# Schedule timer to apply pending commands, nothing is scheduled during settle window (end of window applies them)
+def schedule_pending_commands():
+    if ((not mqtt_publish_stats.is_command_settling) and (not mqtt_publish_stats.is_command_scheduled)):
+        mqtt_publish_stats.is_command_scheduled = True
+        mqtt_timer.call_later(0, apply_pending_commands)
+
+# Timer callback to apply the latest pending command of each GPIO, regular relays are set together with one mask write
+# GPIO without token (burnout protection) keeps its pending command and is retried when the next token is available (arg is "retry")
+# arg as tuple applies only these GPIO, e.g. method(("GP16",)) for a LAN command (commands held in the settle window stay pending)
+def apply_pending_commands(arg=None):
+    global mqtt_pending_commands
+    
+    if (arg is None):
+        mqtt_publish_stats.is_command_scheduled = False
+    if (isinstance(arg, tuple)):
+        pending_commands = {}
+        for name in arg:
+            if (name in mqtt_pending_commands):
+                pending_commands[name] = mqtt_pending_commands.pop(name)
+    else:
+        pending_commands = mqtt_pending_commands
+        mqtt_pending_commands = {}
+    relay_values = {}
+    relay_received_time = None
+    retry_in_ms = 0
+    
+    for name in pending_commands:
+        value, received_time = pending_commands[name]
+        if (get_current_gpio_value(name) == value):
+            continue   # e.g. backlog toggled GP16 on and off, the relay is already off
+        
+        wait_in_ms = get_gpio_set_wait_in_ms(name)
+        if (wait_in_ms < 0):
+            continue   # Contact switch or relay disabled by opt-in lockout
+        if (wait_in_ms > 0):
+            mqtt_pending_commands[name] = pending_commands[name]   # Keep it pending, newer commands still replace it
+            defer_gpio_command(name, wait_in_ms)
+            if ((retry_in_ms == 0) or (wait_in_ms < retry_in_ms)):
+                retry_in_ms = wait_in_ms
+            continue
+            
+        print(f"Set value on hardware key={name}, value={value}")
+        if (mqtt_gpio_hardware[name].is_momentary):
+            set_gpio_value_on_hardware(name, value, received_time)
+        else:
+            relay_values[name] = value
+            if ((relay_received_time is None) or (received_time is not None and utime.ticks_diff(received_time, relay_received_time) < 0)):
+                relay_received_time = received_time   # Latency is measured from the oldest command
+            
+    if (len(relay_values) > 0):
+        set_gpio_values_on_hardware(relay_values, relay_received_time)   # e.g. {"GP16":1, "GP17":1} switches both relays with one write
+        
+    if (retry_in_ms > 0):
+        mqtt_timer.cancel(mqtt_publish_stats.command_retry_timer_id)
+        mqtt_publish_stats.command_retry_timer_id = mqtt_timer.call_later(retry_in_ms, apply_pending_commands, "retry")
+
+# Timer callback at the end of settle window after reconnect, applies the latest value of the replayed QoS1 backlog
+def end_command_settle_window(arg=None):
+    mqtt_publish_stats.is_command_settling = False
+    if (len(mqtt_pending_commands) > 0):
+        print(f"Settle window ended, apply latest pending commands: {mqtt_pending_commands}")
+        schedule_pending_commands()
+
+
+# Start checking the trigger contact switches of automation rules (timer service, every automation_poll_period_in_ms), called by worker()
+def start_automation_rules():
+    if (len(mqtt_config.automation_rules) == 0):
+        return
+    mqtt_publish_stats.automation_levels = read_gpio_levels()   # Only changes after start run rules
+    mqtt_timer.call_later(mqtt_config.automation_poll_period_in_ms, poll_automation_rules)
+
+# Timer callback to run the rules of each trigger contact switch that changed since the last check
+def poll_automation_rules(arg=None):
+    levels = read_gpio_levels()
+    changed_levels = levels ^ mqtt_publish_stats.automation_levels
+    mqtt_publish_stats.automation_levels = levels
+    if (changed_levels != 0):
+        for pin in mqtt_config.automation_rules:
+            if ((changed_levels >> pin) & 1):
+                run_automation_rules(pin, levels)
+    mqtt_timer.call_later(mqtt_config.automation_poll_period_in_ms, poll_automation_rules)
+
+# Run the rules of a trigger contact switch after it changed, e.g. method(0, levels) for GP0
+def run_automation_rules(pin, levels):
+    for rule in mqtt_config.automation_rules[pin]:
+        number, action, value, delay_in_ms = rule[0], rule[2], rule[3], rule[4]
+        if (not is_automation_rule_matched(pin, rule, levels)):
+            continue
+        if ((number in mqtt_rule_buckets) and (not mqtt_rule_buckets[number].consume())):
+            mqtt_metrics.incr("rules_rate_limited")
+            continue
+        mqtt_metrics.incr("rules_fired")
+        if ((utime.time() - mqtt_rule_logged_times.get(number, 0)) >= mqtt_config.hardware_modified_threshold_in_seconds):
+            mqtt_rule_logged_times[number] = utime.time()   # Logged at most once per hardware_modified_threshold_in_seconds (e.g. flapping contact)
+            log(f"Rule {number}: {mqtt_config.gpio_names[pin]}={flip_value((levels >> pin) & 1)}, set {action}={value}" + (f" in {delay_in_ms} ms" if delay_in_ms > 0 else ""))
+        if (delay_in_ms > 0):
+            mqtt_timer.call_later(delay_in_ms, run_automation_action, (pin, rule))
+        else:
+            submit_local_gpio_command(action, value)
+
+# Rule matches if the trigger has the "when" value and all "if" conditions are met (values are human readable, e.g. 1 = contact closed or relay on)
+def is_automation_rule_matched(pin, rule, levels):
+    when, conditions = rule[1], rule[6]
+    if ((when is not None) and flip_value((levels >> pin) & 1) != when):
+        return False
+    for name, value in conditions:
+        if (flip_value((levels >> mqtt_config.gpio_pins[name]) & 1) != value):
+            return False
+    return True
+
+# Timer callback for a delayed rule, the action runs only if the rule still matches (e.g. door is still open after 30 seconds)
+# e.g. method((0, rule))
+def run_automation_action(arg):
+    pin, rule = arg
+    if (is_automation_rule_matched(pin, rule, read_gpio_levels())):
+        submit_local_gpio_command(rule[2], rule[3])
+    else:
+        mqtt_metrics.incr("rules_cancelled")
+
+# Apply a command from the device itself (automation rule) right away through burnout protection, also during outages (no settle window)
+# e.g. method("GP18", 1)
+def submit_local_gpio_command(name, value):
+    submit_gpio_command(name, value, utime.ticks_ms(), True)
+    apply_pending_commands((name,))
+
+               
+# Check if the hardware GPIO value are different from in memory GPIO in dictionary
+def is_gpio_values_changed():    
+    is_changed = False    
+    levels = read_gpio_levels()   # Read all pins at once (bit x = level of GPx)
+       
+    # Publish if memory value is different from the hardware GPIO value
+    for x in mqtt_config.all_pins:
+        name = mqtt_config.gpio_names[x]
+        value = flip_value((levels >> x) & 1)
+        if (get_current_gpio_value(name) != value):   # This is for PIN.IN such as contact switches          
+            mqtt_gpio_hardware[name].status = value
+            mqtt_gpio_hardware[name].is_changed = True
+            is_changed = True
+            print ("GPIO hardware value has changed")
+        elif (mqtt_gpio_hardware[name].is_changed):   # THis is for PIN.OUT such as relay (the is_changed flag already set)
+            is_changed = True
+            print ("GPIO value was changed (momentary switch)")
+            
+    return is_changed
+  
+# Levels of all pins as bitmask, contact switches are debounced by the core 1 service if enabled (relays are always read from hardware)
+def read_gpio_levels():
+    if (mqtt_core1 is None):
+        return gpio_backend.read_inputs()
+    input_levels = mqtt_core1.get_input_levels(observe_gpio_event_age)
+    return input_levels | (gpio_backend.read_inputs() & gpio_backend.output_mask)
+
+def observe_gpio_event_age(age_in_ms):
+    mqtt_metrics.observe("gpio_event_age_ms", age_in_ms)   # Time from the debounced change on core 1 until core 0 used it
+  
+# Check if GPIO status should be published to MQTT broker   
+def is_publish_gpio_status(is_goip_changed):
+
+    is_publish = False
+    is_full = False
+    
+    # Business logic safeguard to limit publishing rate, changes are kept (is_changed, is_republish) and published together when a token is available
+    if ((not mqtt_config.publish_lockout_enabled) and mqtt_publish_bucket.get_wait_in_ms() > 0):
+        mqtt_metrics.incr("publishes_deferred")
+        print("Publish deferred, publish rate limit reached")
+        return is_publish, is_full
+   
+    # Business logic safeguard (opt-in) to disable publishing in case of error
+    if (mqtt_config.publish_lockout_enabled and ((utime.time() - mqtt_publish_stats.last_published_time) < mqtt_config.publish_threshold_in_seconds) and (mqtt_publish_stats.publish_counter > mqtt_config.publish_counter_max)):
+        # To test this case, set is_changed = True in is_gpio_values_changed() to flood the broker
+        mqtt_publish_stats.publish_counter = -1
+        log("Error: Abnormal number of publish detected in a short interval, publishing is stopped until hardware restart")                   
+    elif  (mqtt_config.publish_lockout_enabled and ((utime.time() - mqtt_publish_stats.last_published_time) > mqtt_config.publish_threshold_in_seconds) and mqtt_publish_stats.publish_counter >=0):
+        mqtt_publish_stats.publish_counter = 0  
+           
+    # Publish full list status to Mqtt broker first time running or republish (command is called "refresh"), otherwise only send the changed values
+    if (mqtt_publish_stats.is_first_time_run):   
+        mqtt_publish_stats.is_first_time_run = False
+        log(f"Subscribed for ClientID: {mqtt_config.mqtt_client_id_text}")
+        print("Publish (First time), send full list")
+        is_publish = True
+        is_full = True
+    elif (mqtt_publish_stats.is_republish):                
+        mqtt_publish_stats.is_republish = False
+        print("Publish (Republish), send full list")
+        is_publish = True
+        is_full = True
+    elif (mqtt_publish_stats.is_scheduled_publish):
+        mqtt_publish_stats.is_scheduled_publish = False   # Set by the timer service every scheduled_publish_in_seconds
+        mqtt_publish_stats.last_scheduled_published_time = utime.time()
+        print("Publish (Scheduled), send full list")
+        is_publish = True        
+        is_full = True
+    elif (is_goip_changed and mqtt_publish_stats.publish_counter >= 0): # If publish_counter == -1 (error), it will skip publishing forever until hardware reset
+        print("Publish (Changed), only send changed values")
+        is_publish = True
+        is_full = False  # Only publish changed values
+        
+    return is_publish, is_full
+
+
+# Get all GPIO status from the master dictionary for JSON publish
+def get_gpio_status(full=False):    
+
+    gpio_status = OrderedDict()
+    
+    # all_pins is sorted by GPIO number in compiled config because of leading 0 integer won't work in string sorted (i.e. GP1, GP16, GP2)
+    # Combined into OrderedDict, regular dictionary won't sort properly with JSON.dumps()
+    for x in mqtt_config.all_pins:        
+        name = mqtt_config.gpio_names[x]
+        if (full == False):
+            if (mqtt_gpio_hardware[name].is_changed):
+                gpio_status[name] = mqtt_gpio_hardware[name].status                            
+        else:
+            gpio_status[name] = mqtt_gpio_hardware[name].status
+        
+    return gpio_status
+
+
+# Keep published GPIO values with their sequence number, so a client that missed a publish can resync with {"SINCE": N}
+# e.g. method(7, {"GP16": 1})
+def add_state_history(seq, gpio_status):
+    history = mqtt_publish_stats.state_history
+    history.append((seq, gpio_status))
+    if (len(history) > mqtt_config.state_history_len):
+        history.pop(0)
+
+# Merged GPIO values published after sequence number since_seq, None if they are no longer in history (e.g. client missed too many or device restarted)
+# e.g. method(5) returns {"GP16": 1, "GP17": 0} for changes in SEQ 6 and 7, {} if nothing was published after SEQ 5
+def get_state_since(since_seq):
+    history = mqtt_publish_stats.state_history
+    if (since_seq < 0 or since_seq > mqtt_publish_stats.state_seq):
+        return None
+    if (since_seq == mqtt_publish_stats.state_seq):
+        return {}
+    if (len(history) == 0 or history[0][0] > since_seq + 1):
+        return None
+    merged = {}
+    for seq, gpio_status in history:
+        if (seq > since_seq):
+            merged.update(gpio_status)   # Later values replace older ones
+    return merged
+
+# Respond to {"SINCE": N} with the changes after SEQ N, e.g. {"GP16": 1, "SEQ": 7, "SINCE": 5, "TIME": "..."}
+# If SEQ N is no longer in history, the full list is republished with a new SEQ
+def handle_state_since(since_seq):
+    merged = get_state_since(since_seq)
+    if (merged is None):
+        print(f"SEQ {since_seq} is not in history, republish full list")
+        mqtt_publish_stats.is_republish = True
+        return
+    response = OrderedDict()
+    for x in sorted([get_gp_name_to_pin(name) for name in merged]):
+        name = mqtt_config.gpio_names[x]
+        response[name] = merged[name]
+    response[mqtt_config.seq_keyname] = mqtt_publish_stats.state_seq
+    response[mqtt_config.since_keyname] = since_seq
+    response[mqtt_config.time_keyname] = get_formatted_time_now(mqtt_config.time_zone_name)
+    log(json.dumps(response), PRIORITY_RESPONSE)
+
+# Load relay states and counters from the state journal (journal_enabled), returns {} if the journal is disabled or empty
+# e.g. method() returns {"GP16": 1, "GP16.violations": 0, "outages": 3, "seq": 42, "clock_synced": 1767571200}
+def load_journal_state():
+    global mqtt_journal
+    if (not mqtt_config.journal_enabled):
+        return {}
+    from mqtt_tiny_controller_journal import StateJournal   # Lazy import, only loaded when the journal is enabled
+    mqtt_journal = StateJournal(mqtt_config.journal_file_prefix, mqtt_config.journal_max_bytes, mqtt_config.journal_flush_interval_in_seconds * 1000)
+    try:
+        journal_state = mqtt_journal.load()
+    except Exception as e:
+        print(f"Warning: State journal cannot be loaded: {e}")   # Not logged, log messages are created later in init()
+        journal_state = {}
+    mqtt_metrics.set("journal_corrupt_records", mqtt_journal.corrupt_records)
+    return journal_state
+
+# Values kept in the state journal: regular relay states (momentary relays always start off) and counters
+def get_journal_state():
+    journal_state = {}
+    for x in mqtt_config.relay_pins:
+        name = mqtt_config.gpio_names[x]
+        if (not mqtt_gpio_hardware[name].is_momentary):
+            journal_state[name] = mqtt_gpio_hardware[name].status
+        journal_state[name + ".violations"] = mqtt_gpio_hardware[name].violation_counter
+    journal_state["outages"] = mqtt_publish_stats.outage_counter
+    journal_state["seq"] = mqtt_publish_stats.state_seq
+    journal_state["clock_synced"] = mqtt_publish_stats.last_clock_synced_time
+    return journal_state
+
+# Save changed values to the state journal, written to flash at most once every journal_flush_interval_in_seconds (force=True writes now)
+def save_journal_state(force=False):
+    if (mqtt_journal is None):
+        return
+    mqtt_journal.update(get_journal_state())
+    try:
+        if (mqtt_journal.flush(force)):
+            mqtt_metrics.incr("journal_writes")
+    except OSError as e:
+        log(f"Warning: State journal cannot be written: {e}")
+
+# Publish retained full GPIO snapshot on mqtt_state_topic if values changed since the last snapshot, or after reconnect (last will cleared it)
+# New clients get the state from the broker right away without sending "refresh" to the device
+def publish_state_snapshot():
+    snapshot = get_gpio_status(True)
+    snapshot_masks = get_masks(snapshot, mqtt_config.gpio_prefix)   # (values, pins) to compare without keeping the JSON
+    if ((not mqtt_publish_stats.is_snapshot_stale) and snapshot_masks == mqtt_publish_stats.last_snapshot_masks):
+        return
+    if (not mqtt_publish_bucket.consume()):
+        return   # Publish rate limit reached, snapshot is still different next round
+    mqtt_publish_stats.is_snapshot_stale = False
+    mqtt_publish_stats.last_snapshot_masks = snapshot_masks
+    snapshot[mqtt_config.seq_keyname] = mqtt_publish_stats.state_seq
+    snapshot[mqtt_config.time_keyname] = get_formatted_time_now(mqtt_config.time_zone_name)
+    print("Publish retained state snapshot")
+    mqtt_outbox.put(PRIORITY_STATE, mqtt_config.mqtt_state_topic, json.dumps(snapshot), True, utime.ticks_ms())   # Retain flag=true, only on the state topic
+
+# Reset all changed GPIO status
+def reset_gpio_changed_status():
+    
+    for x in mqtt_config.all_pins:
+        name = mqtt_config.gpio_names[x]
+        if (mqtt_gpio_hardware[name].is_changed):
+            mqtt_gpio_hardware[name].is_changed = False 
+            
+# Send notification if it meets the conditions            
+def send_notification(is_gpio_changed):
+    
+    if (is_gpio_changed):
+        
+        # Note: In an ideal world, sending a separate message would not be needed, as it would be the responsibility of the client to detect value changes
+        #       if the client application supports notifications. However, client applications may reset values to their defaults, potentially resulting in false positive notifications.
+        #       In such cases, reliance on the microcontroller's value as the single source is not a bad idea.
+
+        print(f"Notification is called, GPIO has changed. Only configured GPIO will receive notification.")
+        changed_gpio_status = get_gpio_status(False) # True = full list, False = only changed values
+        
+        # Send notification response for changed values
+        is_notify = False
+        temp_gpio = OrderedDict()
+
+        # Only send notificaiton for the pins configured to be sent
+        for gpio_name in changed_gpio_status:
+            pin_id = get_gp_name_to_pin(gpio_name)  # Get the name to pin id (e.g. from "GP2" to 2)
+            if (pin_id in mqtt_config.notification_pins):  # Check the list in config (only send if it matches in config list)
+                is_notify = True
+                temp_gpio[gpio_name] = changed_gpio_status[gpio_name] # copy the value 
+                
+        if (is_notify):
+            notification_dict = dict()
+            notification_dict[mqtt_config.notification_keyname]=temp_gpio   
+            log(json.dumps(notification_dict), PRIORITY_STATE)  # format it and converted to JSON: e.g. {"NOTIFY": {"GP16": 1}} or {"NOTIFY": {"GP16": 1, "GP17": 0}}
+          
+ 
+          
+# Log message printing it and also send to MQTT broker           
+# Queue a message on mqtt_topic for the publisher task (if we call mqtt client here, race condition error), logs and diagnostics by default
+# e.g. method("Warning: ...") or method(json.dumps(response), PRIORITY_RESPONSE) for the reply to a command
+def log(message, priority=PRIORITY_LOG):
+    print(message)
+    mqtt_outbox.put(priority, mqtt_config.mqtt_topic, message, mqtt_config.mqtt_retain, utime.ticks_ms())   # The oldest is dropped when log_messages_max are waiting
+        
+
+#  ----------------------------------------------------------------------------          
+    
+# Get the stats such as uptime and outages
+async def get_stats():    
+    error_message = None
+    global wlan    
+    try:
+        total_uptime = (utime.time() - mqtt_publish_stats.startup_time)
+        uptime_days, uptime_hours, uptime_minutes, uptime_seconds = calculate_time(total_uptime)
+        log(f"Uptime={uptime_days} days {uptime_hours} hrs, Outages={mqtt_publish_stats.outage_counter}, Wifi={get_formatted_wifi_strength(wlan, mqtt_config.wifi_ssid_bytes)}, Mem={get_formatted_memory_usage()}, Temp={get_formatted_temperature()}, Time={get_formatted_time_now(mqtt_config.time_zone_name)}{get_formatted_loop_lag()}", PRIORITY_RESPONSE)
+    except Exception as e:
+        error_message = f"Exception to get stats: {e}"
+
+    if (error_message != None):
+        log(error_message, PRIORITY_RESPONSE)
+        
+# Get event loop lag and slowest tasks (if profiling is enabled) for stats
+# e.g. method() returns ", Lag=15/250ms, Slowest=get_stats:812ms messages:95ms" (p90/max lag)
+def get_formatted_loop_lag():
+    result = ""
+    lag = mqtt_metrics.get_histogram("loop_lag_ms")
+    if (lag is not None):
+        result = f", Lag={lag.percentile(90)}/{lag.max}ms"
+    slowest_tasks = mqtt_metrics.get_slowest_tasks(3)
+    if (len(slowest_tasks) > 0):
+        result = result + ", Slowest=" + " ".join([f"{name}:{stats.max_us // 1000}ms" for name, stats in slowest_tasks])
+    return result
+        
+# Get public ip. Note: this is an async call so it won't block
+async def get_public_ip():
+    public_ip = None
+    error_message = None
+    try:
+        temp_ip = get_public_ip_from_provider(mqtt_config.json_ip_provider)
+        public_ip = json.dumps({mqtt_config.ip_keyname:temp_ip}) # Customized key name for JSON result  
+    except Exception as e:
+        error_message = f"Exception to get IP: {e}"
+        
+    if (error_message != None):
+        log(error_message, PRIORITY_RESPONSE)
+        
+    if (public_ip != None):        
+        log(public_ip, PRIORITY_RESPONSE)
+
+# Get the metrics (counters, gauges and histograms) in JSON, e.g. {"METRICS": {"C": {...}, "G": {...}, "H": {...}}}
+async def get_metrics(client):
+    try:
+        mqtt_publish_stats.last_metrics_published_time = utime.time()
+        mqtt_metrics.set("queue_discards", client.queue.discards)
+        mqtt_metrics.set("repub_count", client.REPUB_COUNT)
+        mqtt_metrics.set("outages", mqtt_publish_stats.outage_counter)
+        mqtt_metrics.set("publish_counter", mqtt_publish_stats.publish_counter)
+        mqtt_metrics.set("mem_alloc", gc.mem_alloc())
+        mqtt_metrics.set("timers_pending", mqtt_timer.get_pending_count())
+        if (mqtt_journal is not None):
+            mqtt_metrics.set("journal_bytes", mqtt_journal.size)
+            mqtt_metrics.set("journal_compactions", mqtt_journal.compactions)
+        if (mqtt_core1 is not None):
+            mqtt_metrics.set("core1_samples", mqtt_core1.samples)
+            mqtt_metrics.set("core1_ring_drops", mqtt_core1.gpio_events.drops + mqtt_core1.totp_results.drops)
+            mqtt_metrics.set("core1_lock_contentions", mqtt_core1.gpio_events.contentions + mqtt_core1.totp_results.contentions)
+        if (mqtt_lan is not None):
+            mqtt_metrics.set("lan_clients", mqtt_lan.clients)
+        log(json.dumps({mqtt_config.metrics_keyname: mqtt_metrics.snapshot()}), PRIORITY_RESPONSE)
+    except Exception as e:
+        log(f"Exception to get metrics: {e}", PRIORITY_RESPONSE)
+    
+    
+# This scheduled_sync_clock is non-blocking, it is used for scheduled sync.     
+async def scheduled_sync_clock():
+    global mqtt_publish_stats
+    try:
+        set_time_from_ntp()
+        mqtt_publish_stats.last_clock_synced_time = utime.time()
+        log(f"Scheduled clock synced, timestamp={utime.time()}" )
+        reschedule_after_clock_sync()
+    except Exception as e:
+        log(f"Error synchronizing clock: {e}")
+        if (mqtt_config.scheduled_clock_sync_in_seconds > 0):
+            schedule_clock_sync(get_clock_sync_retry_in_seconds())
+    finally:
+        log(f"Time={get_formatted_time_now(mqtt_config.time_zone_name)}")
+    
+# This auto_sync_clock is non-blocking, it is called at boot and retried while the clock is out of sync
+async def auto_sync_clock():
+    global mqtt_publish_stats
+    try:
+        set_time_from_ntp()
+        mqtt_publish_stats.startup_time = utime.time()    # We need to reset startup time
+        mqtt_publish_stats.last_clock_synced_time = utime.time()
+        log(f"Auto clock synced, timestamp={utime.time()}" )
+        reschedule_after_clock_sync()
+    except Exception as e:
+        log(f"Error synchronizing clock: {e}")
+        if (is_clock_out_of_sync() and mqtt_config.forced_clock_sync_wait_in_seconds > 0):
+            schedule_clock_sync(mqtt_config.forced_clock_sync_wait_in_seconds, auto_sync_clock)   # Retry while the clock is out of sync
+        else:
+            schedule_clock_sync()
+    finally:
+        log(f"Time={get_formatted_time_now(mqtt_config.time_zone_name)}")
+
+# PicoW default clock is 2021-01-01 0:0:0 + 31533803 seconds is 2021-12-31 23:23:23, an earlier time means NTP sync failed since power up
+def is_clock_out_of_sync():
+    return utime.time() < (mqtt_config.default_clock_year_in_unix_timestamp + 31533803)
+
+# Schedule the next NTP sync on the timer service (one pending sync at a time), by default scheduled_clock_sync_in_seconds after the last sync
+# e.g. method() after a sync, method(180) to retry a failed sync in 180 seconds, method(180, auto_sync_clock) while the clock is out of sync
+def schedule_clock_sync(delay_in_seconds=None, func=None):
+    if (delay_in_seconds is None):
+        if (mqtt_config.scheduled_clock_sync_in_seconds <= 0):
+            return
+        delay_in_seconds = max(0, mqtt_config.scheduled_clock_sync_in_seconds - (utime.time() - mqtt_publish_stats.last_clock_synced_time))
+    mqtt_timer.cancel(mqtt_publish_stats.clock_sync_timer_id)
+    mqtt_publish_stats.clock_sync_timer_id = mqtt_timer.call_later(delay_in_seconds * 1000, submit_clock_sync, func or scheduled_sync_clock)
+
+# Timer callback to run the clock sync on the command executor, e.g. method(scheduled_sync_clock)
+def submit_clock_sync(func):
+    if (not mqtt_executor.submit("ntp", func)):
+        schedule_clock_sync(get_clock_sync_retry_in_seconds(), func)   # Another sync is running (it schedules the next one) or the queue is full
+
+def get_clock_sync_retry_in_seconds():
+    if (mqtt_config.forced_clock_sync_wait_in_seconds > 0):
+        return mqtt_config.forced_clock_sync_wait_in_seconds
+    return mqtt_config.scheduled_clock_sync_in_seconds
+
+# Clock was set from NTP, the next daily sync and the relay schedules are calculated from the new time
+def reschedule_after_clock_sync():
+    schedule_clock_sync()
+    start_relay_schedules()
+
+# Timer callback for the scheduled full publish (every scheduled_publish_in_seconds), the worker publishes it in its next round
+def request_scheduled_publish(arg=None):
+    mqtt_publish_stats.is_scheduled_publish = True
+    mqtt_timer.call_later(mqtt_config.scheduled_publish_in_seconds * 1000, request_scheduled_publish)
+
+# Timer callback for the scheduled metrics publish (every scheduled_metrics_publish_in_seconds), e.g. method(client)
+def request_scheduled_metrics(client):
+    mqtt_executor.submit("metrics", get_metrics, client)
+    mqtt_timer.call_later(mqtt_config.scheduled_metrics_publish_in_seconds * 1000, request_scheduled_metrics, client)
+
+# Start the scheduled publish, NTP clock sync and metrics publish on the timer service (after boot, the first NTP sync runs in boot())
+def start_scheduled_tasks(client):
+    if (mqtt_config.scheduled_publish_in_seconds > 0):
+        mqtt_timer.call_later(mqtt_config.scheduled_publish_in_seconds * 1000, request_scheduled_publish)
+    if (mqtt_config.scheduled_metrics_publish_in_seconds > 0):
+        mqtt_timer.call_later(mqtt_config.scheduled_metrics_publish_in_seconds * 1000, request_scheduled_metrics, client)
+    schedule_clock_sync()
+    if (mqtt_broker_pool is not None and mqtt_config.broker_failback_probe_in_seconds > 0):
+        mqtt_timer.call_later(mqtt_config.broker_failback_probe_in_seconds * 1000, request_broker_probe, client)
+
+# Timer callback (every broker_failback_probe_in_seconds) to probe the preferred broker on the command executor while a backup broker is used
+def request_broker_probe(client):
+    if (not mqtt_broker_pool.is_preferred()):
+        mqtt_executor.submit("broker", probe_preferred_broker, client)
+    mqtt_timer.call_later(mqtt_config.broker_failback_probe_in_seconds * 1000, request_broker_probe, client)
+
+# Fail back to the preferred broker when it answers the probe, the connection to the backup broker is dropped and mqtt_as reconnects
+# The probe uses the address cached by mqtt_as, it's skipped if the preferred broker was never resolved (DNS lookup blocks the event loop)
+async def probe_preferred_broker(client):
+    index = mqtt_broker_pool.preferred
+    if (mqtt_broker_pool.is_preferred()):
+        return
+    addr = client.get_cached_address(mqtt_broker_pool.brokers[index][0], mqtt_broker_pool.brokers[index][1])
+    if (addr is None):
+        mqtt_metrics.incr("broker_probes_skipped")
+        return
+    if (not await mqtt_broker_pool.probe(index, addr, mqtt_config.broker_probe_timeout_in_ms)):
+        return
+    log(f"Broker fail-back to {mqtt_broker_pool.brokers[index][0]}, probe={mqtt_broker_pool.health[index].probe_ms}ms")
+    mqtt_metrics.incr("broker_failbacks")
+    mqtt_broker_pool.select(index)
+    client.reconnect()
+
+#  ----------------------------------------------------------------------------
+
+# Relay schedules from config, or from the last {"SCHEDULE": [...]} command saved in schedule_file
+def load_relay_schedules():
+    global mqtt_schedules
+    global mqtt_schedule_entries
+    mqtt_schedules = mqtt_config.compiled_relay_schedules
+    mqtt_schedule_entries = list(mqtt_config.relay_schedules)
+    if (not mqtt_config.schedule_file):
+        return
+    try:
+        with open(mqtt_config.schedule_file, "r") as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return   # No schedule command received yet (or the file cannot be read), config schedules are used
+    from mqtt_tiny_controller_schedule import compile_schedules   # Lazy import, only loaded when schedules are used
+    schedules, errors = compile_schedules(entries, mqtt_config.relay_pins, mqtt_config.gpio_prefix, mqtt_config.schedules_max)
+    if (len(errors) > 0):
+        print(f"Warning: Saved schedules are ignored: {'; '.join(errors)}")   # Not logged, log messages are created later in init()
+        return
+    mqtt_schedules = schedules
+    mqtt_schedule_entries = entries
+
+# Put the next fire time of each relay schedule on the timer service (schedules fired before are cancelled)
+# Schedules only run when the clock is synced, they are started again by reschedule_after_clock_sync()
+def start_relay_schedules():
+    global mqtt_schedule_timer_ids
+    for number in mqtt_schedule_timer_ids:
+        mqtt_timer.cancel(mqtt_schedule_timer_ids[number])
+    mqtt_schedule_timer_ids = {}
+    if (len(mqtt_schedules) == 0 or is_clock_out_of_sync()):
+        return
+    for schedule in mqtt_schedules:
+        schedule_relay_schedule(schedule)
+
+# Next fire time of a schedule on the timer service, e.g. method((0, 390, 31, "GP16", 1)) for GP16 on at 06:30 on weekdays
+def schedule_relay_schedule(schedule):
+    from mqtt_tiny_controller_schedule import get_next_fire_time
+    fire_time = get_next_fire_time(utime.time(), schedule, mqtt_config.time_zone_name)
+    mqtt_schedule_timer_ids[schedule[0]] = mqtt_timer.call_later((fire_time - utime.time()) * 1000, run_relay_schedule, (schedule, fire_time))
+
+# Timer callback of a schedule, the command is applied right away through burnout protection (also during outages), then the next fire time is scheduled
+def run_relay_schedule(arg):
+    schedule, fire_time = arg
+    if (utime.time() < fire_time):   # Timer (ticks_ms) ran ahead of the RTC
+        mqtt_schedule_timer_ids[schedule[0]] = mqtt_timer.call_later((fire_time - utime.time()) * 1000, run_relay_schedule, arg)
+        return
+    mqtt_metrics.incr("schedules_fired")
+    log(f"Schedule {schedule[0]}: set {schedule[3]}={schedule[4]}")
+    submit_local_gpio_command(schedule[3], schedule[4])
+    schedule_relay_schedule(schedule)
+
+# {"SCHEDULE": [...]} replaces all relay schedules and saves them to schedule_file (MFA is checked for relays with TOTP keys), {"SCHEDULE": []} removes them
+# Any other value (e.g. {"SCHEDULE": "get"}) only logs the active schedules, e.g. {"SCHEDULE": [{"at": "06:30", "action": 16, "value": 1}], "TIME": "..."}
+def handle_schedule_command(entries):
+    global mqtt_schedules
+    global mqtt_schedule_entries
+    if (isinstance(entries, list)):
+        from mqtt_tiny_controller_schedule import compile_schedules, save_schedules   # Lazy import, only loaded when schedules are used
+        schedules, errors = compile_schedules(entries, mqtt_config.relay_pins, mqtt_config.gpio_prefix, mqtt_config.schedules_max)
+        if (len(errors) > 0):
+            log(f"Error: Schedules are not changed: {'; '.join(errors)}", PRIORITY_RESPONSE)
+            return
+        for name in set([x[3] for x in schedules] + [x[3] for x in mqtt_schedules]):   # Added and removed schedules
+            if (not is_gpio_mfa_passed(name)):
+                return
+        mqtt_schedules = schedules
+        mqtt_schedule_entries = entries
+        start_relay_schedules()
+        if (mqtt_config.schedule_file):
+            try:
+                save_schedules(mqtt_config.schedule_file, entries)
+            except OSError as e:
+                log(f"Warning: Schedules cannot be saved: {e}")
+    response = OrderedDict()
+    response[mqtt_config.schedule_keyname] = mqtt_schedule_entries
+    response[mqtt_config.time_keyname] = get_formatted_time_now(mqtt_config.time_zone_name)
+    log(json.dumps(response), PRIORITY_RESPONSE)
+
+
+# Run a boot phase and record its duration in gauge "boot_<name>_ms", e.g. await method("dns", client.resolve)
+async def run_boot_phase(name, func, *args):
+    start_time = utime.ticks_ms()
+    try:
+        return await func(*args)
+    finally:
+        mqtt_metrics.set(f"boot_{name}_ms", utime.ticks_diff(utime.ticks_ms(), start_time))
+
+# Record time since init() started in gauge, e.g. method("boot_online_ms")
+def set_boot_elapsed(name):
+    mqtt_metrics.set(name, utime.ticks_diff(utime.ticks_ms(), mqtt_publish_stats.boot_ticks))
+
+# Start the LAN control endpoint (lan_enabled), a port that cannot be used is logged and the device keeps running with MQTT only
+async def start_lan_server(client):
+    if (mqtt_lan is None):
+        return
+    try:
+        await mqtt_lan.start(lambda line, connection: handle_lan_message(line, connection, client))
+        print(f"LAN control endpoint on port {mqtt_config.lan_port}")
+    except OSError as e:
+        log(f"Warning: LAN control endpoint cannot be started: {e}")
+
+# First broker connect, with broker failover every broker is tried broker_failover_after_failures times before the boot fails (OSError)
+async def connect_broker(client):
+    attempts = 1
+    if (mqtt_broker_pool is not None):
+        attempts = len(mqtt_config.brokers) * mqtt_config.broker_failover_after_failures
+    for i in range(attempts - 1):
+        try:
+            return await client.connect()
+        except OSError as e:
+            print(f"Broker connect failed: {e}")
+    await client.connect()
+
+# Boot sequence after init() (relays are already initialized): Wi-Fi association, then DNS and broker connect.
+# NTP only needs Wi-Fi, it runs on the command executor while the broker connects (the TLS handshake waits on the network)
+# Returns False if Wi-Fi failed permanently, broker errors raise OSError
+async def boot(client):
+    global wlan
+    wlan = start_wifi(mqtt_config)   # Non-blocking, association runs in the background
+    if (not await run_boot_phase("wifi", wait_for_wifi, wlan, toggle_onboard_led, mqtt_config.wifi_max_retries)):
+        return False
+    await start_lan_server(client)   # Relays can be controlled on LAN while the broker connects (or if the internet is down)
+    mqtt_executor.submit("ntp", run_boot_phase, "ntp", auto_sync_clock)
+    if (mqtt_broker_pool is None):
+        await run_boot_phase("dns", client.resolve)
+    await run_boot_phase("broker", connect_broker, client)   # TLS and MQTT connect (with failover: DNS of each broker when it's tried)
+    set_boot_elapsed("boot_connected_ms")
+    return True
+
+
+#  ----------------------------------------------------------------------------
+
+# Publish Stats class to store all the global stats in mqtt_publish_stats
+class PublishStats:    
+    last_published_time = 0
+    last_scheduled_published_time = 0
+    publish_counter = 0
+    is_republish = False
+    is_first_time_run = False
+    startup_time = 0
+    outage_counter = 0
+    is_online = False
+    last_clock_synced_time = 0
+    last_metrics_published_time = 0
+    totp_number = 0  # This stores the global 6 digit totp number (sent by the client app)
+    boot_ticks = 0   # ticks_ms when init() started, boot gauges are measured from here
+    is_boot_published = False   # First GPIO status after boot is published (gauge "boot_first_publish_ms")
+    is_boot_online = False      # First connect after boot is done (gauge "boot_online_ms")
+    state_seq = 0    # Sequence number of the last GPIO status publish (full or changed values), starts from 1 after power up
+    state_history = None   # Recent GPIO status publishes [(seq, {"GP16": 1})], for {"SINCE": N}, created by init()
+    last_snapshot_masks = None   # (values, pins) of the last retained snapshot on mqtt_state_topic
+    is_snapshot_stale = True     # Retained snapshot has to be published (first time and after reconnect)
+    is_command_settling = False   # GPIO commands are held in pending slots during settle window after reconnect
+    is_command_scheduled = False  # Timer to apply pending commands is scheduled
+    automation_levels = 0   # GPIO levels (bitmask) at the last automation rule check, changed trigger pins run their rules
+    is_scheduled_publish = False   # Full publish requested by the timer service (scheduled_publish_in_seconds)
+    clock_sync_timer_id = 0        # Timer of the next NTP clock sync
+    command_retry_timer_id = 0    # Timer to retry deferred commands (burnout protection)
+    settle_timer_id = 0
+    
+# Define the property to used in the master dictonary mqtt_gpio_hardware    
+class GpioProperty:
+    status = 0   # status for all GPIO in 0 or 1  (Note: This is the INVERSE of real pins for human readable purpose, e.g. 0 = Off, 1 = On)
+    pin_id = 0   # GPIO number of the hardware pin, e.g. 16 for "GP16", read and set via gpio_backend (Note: Low Voltage 0 = On,  High Voltage 1 = Off)
+    last_modified_time = 0  # Last modified time for GPIO (only for relays to use only, hardware burnout protection)
+    cooldown_bucket = None   # Token bucket for min interval between value change (only for relays, hardware burnout protection)
+    modified_bucket = None   # Token bucket for max number of value change in a period (only for relays, hardware burnout protection)
+    last_deferral_logged_time = 0   # Last time a deferred value change was logged (only for relays, hardware burnout protection)
+    violation_counter = 0  # Violation counter for GPIO (only for relays with hardware_lockout_enabled, hardware burnout protection)
+    is_modified_allowed = False # Is hardware PIN is allowed to set (only for relays, hardware burnout protection)
+    is_momentary = False       # Is hardware PIN is defined as momentary (only for relays, e.g. switch it on, it will turn off automatically)
+    is_changed = False         # For both contacts and relays to publish only changed GPIO value (no need to publish full list)
+    totp_keys = []  # Each GPIO can have multiple keys allowed to access (e.g. Azure function Mqtt vs Mqtt mobile app)
+    momentary_wait_in_seconds = 0  # For momentary switch (customized wait in x seconds before switching it off)
+
+#  ----------------------------------------------------------------------------                 
+
+# Create async task, wrapped with timing hooks (run time and max single step) if task profiling is enabled in config
+# e.g. method(get_stats(), "get_stats")
+def create_profiled_task(coro, name):
+    if (mqtt_config.task_profiling_enabled):
+        coro = mqtt_metrics.profile(coro, name)
+    return asyncio.create_task(coro)
+
+# Run command by number, e.g. method(501, client) for {"CMD":"stats"}
+def handle_command(command, client):
+    if (command == 501): 
+        mqtt_executor.submit("stats", get_stats)   # CMD "stats" async call to get stats
+    elif (command == 502):
+        mqtt_publish_stats.is_republish = True    # CMD "refresh", set republish next round
+    elif (command == 503):
+        mqtt_executor.submit("getip", get_public_ip)  # CMD "getip" async call to get Ip address
+    elif (command == 504):
+        if (((utime.time() - mqtt_publish_stats.last_clock_synced_time) > mqtt_config.forced_clock_sync_wait_in_seconds) and mqtt_config.forced_clock_sync_wait_in_seconds > 0):                                                                
+            mqtt_executor.submit("ntp", scheduled_sync_clock) # CMD "ntp" to force clock sync
+    elif (command == 505):
+        mqtt_executor.submit("metrics", get_metrics, client)  # CMD "metrics" async call to get metrics
+
+# Handle GPIO value in a command, e.g. method("GP16", 1, ticks_ms) for {"GP16":1}
+def handle_gpio_command(name, value, received_time, is_local=False):
+    if ((get_current_gpio_value(name) != value) or (name in mqtt_pending_commands)):   # Pending command may be replaced by the current value
+        if (is_gpio_mfa_passed(name)):
+            submit_gpio_command(name, value, received_time, is_local)  # Latest command per GPIO is applied by the timer service (or by the LAN handler)
+
+# Handle binary command from mqtt_binary_topic (see mqtt_tiny_controller_codec), no JSON parsing
+# State messages echoed back by the broker are not commands and are ignored
+def handle_binary_message(msg, received_time, client):
+    parse_start_time = utime.ticks_us()
+    command = decode_command(msg, mqtt_config.gpio_prefix)
+    if (command is None):
+        return
+    mqtt_metrics.observe("parse_us", utime.ticks_diff(utime.ticks_us(), parse_start_time))
+    opcode, gpio_values, totp_number, command_number = command
+    print(f"Callback binary command: {command}")
+    if (totp_number is not None):
+        mqtt_publish_stats.totp_number = totp_number
+    if (gpio_values is not None):
+        for name in gpio_values:   # Sorted by GPIO number
+            if (name in mqtt_gpio_hardware):
+                handle_gpio_command(name, gpio_values[name], received_time)
+    else:
+        handle_command(command_number, client)
+
+# Parse JSON message, keys in order (e.g. MFA before GPIO keys), returns None if it's not a JSON object
+# e.g. method('{"GP17":0, "GP16":1}') returns {"GP16":1, "GP17":0}
+def parse_json_message(message):
+    parse_start_time = utime.ticks_us()
+    try:
+       json_object = json.loads(message)
+    except ValueError as ve:
+       return None
+    if (not isinstance(json_object, dict)):
+        return None   # e.g. "123456" or "[1, 2]" is valid JSON but not a command
+    ordered_json_data = {}   # Ordered json by key
+    for key in sorted(json_object.keys()):
+        ordered_json_data[key] = json_object[key]           
+    mqtt_metrics.observe("parse_us", utime.ticks_diff(utime.ticks_us(), parse_start_time))
+    return ordered_json_data
+
+# Handle JSON command from mqtt_topic or the LAN endpoint, e.g. method({"GP16":1, "MFA":123456}, ticks_ms, client)
+# is_local=True (LAN) keeps GPIO commands pending for the caller to apply right away instead of scheduling them
+def handle_json_command(ordered_json_data, received_time, client, is_local=False):
+    try:
+        is_message_response = False   # Is Message a Request (sent from client) or a Response (sent from microcontroller), using UTC as identifier
+        
+         # Because of call back, we need to ignore {"IP":"111.222.333.444"} or {"NOTIFY": {"GP16": 1, "GP17": 0}} or {"GP21":1, "UTC":"2024-01-01"}
+        for key in ordered_json_data:
+            if (key in mqtt_config.response_keys):
+                is_message_response = True
+                print("JSON is a response, ignore in callback")
+                break
+        
+        if(is_message_response == False):                    
+            # Json objects are not in order, need seperated loop to set MFA if it's part of GPIO message, e.g. {"GP16":1, "MFA":123456}
+            for key in ordered_json_data:
+                if (key == mqtt_config.totp_keyname):
+                    mqtt_publish_stats.totp_number = int(ordered_json_data[key])  # 6 digit integer (not string)
+                    break
+            
+            for key in ordered_json_data:    
+                if (key == mqtt_config.command_keyname):   
+                    # Command in Json received, e.g {"CMD":"getip"}
+                    # Note: key in a dict is unique, e.g. Multiple commands like this {"CMD": "getip", "CMD": "stats", "CMD": "refresh"} will only execute "refresh" (last item)            
+                    cmd_value = ordered_json_data[key] # Use dict as enum without hardcoding                        
+                    handle_command(mqtt_config.commands[cmd_value], client)
+                elif (key == mqtt_config.since_keyname):
+                    handle_state_since(int(ordered_json_data[key]))   # e.g. {"SINCE": 5}
+                elif (key == mqtt_config.schedule_keyname):
+                    handle_schedule_command(ordered_json_data[key])   # e.g. {"SCHEDULE": [{"at": "06:30", "action": 16, "value": 1}]}
+                elif ((key != mqtt_config.totp_keyname) and key.startswith(mqtt_config.gpio_prefix) and (key in mqtt_gpio_hardware)):
+                    handle_gpio_command(key, ordered_json_data[key], received_time, is_local)   # e.g. {"GP16":1, "GP17":0}
+    except:
+        pass
+
+# Handling incoming message using event instances and asynchronous iterator, similar to message call back
+# To support Android "IoT MQTT Panel", all payload is in JSON (binary payload only on mqtt_binary_topic)
+async def messages(client):
+    binary_topic = mqtt_config.mqtt_binary_topic_bytes   # None if binary payloads are disabled
+    async for topic, msg, retained in client.queue:
+        #print(f'Callback Topic: "{topic.decode()}" Message: "{msg.decode()}" Retained: {retained}')        
+        if (binary_topic is not None and topic == binary_topic):
+            try:
+                handle_binary_message(msg, utime.ticks_ms(), client)
+            except Exception as e:
+                print(f"Error in binary message={e}")
+            continue
+        message = msg.decode()
+        if ((not message.startswith('Subscribed:')) and (not message.startswith('Warning:')) and (not message.startswith('Error:'))):
+            print(f"Callback message: {message}")
+
+        received_time = utime.ticks_ms()
+        ordered_json_data = parse_json_message(message)
+        if (ordered_json_data is not None):
+            handle_json_command(ordered_json_data, received_time, client)
+
+# Handle one line from the LAN endpoint (lan_enabled), same JSON commands as on mqtt_topic but a TOTP code of lan_totp_secrets is required
+# GPIO commands are applied right away (no settle window, e.g. while the broker is down), the changes are published to the broker when it's reachable
+# e.g. method(b'{"GP16": 1, "MFA": 123456}', connection, client) returns '{"GP0": 0, ..., "GP16": 1, ..., "TIME": "..."}' or '{"ERROR": "MFA", "TIME": "..."}'
+def handle_lan_message(line, connection, client):
+    received_time = utime.ticks_ms()
+    try:
+        ordered_json_data = parse_json_message(line.decode())
+    except UnicodeError:
+        ordered_json_data = None
+    if (ordered_json_data is None):
+        return get_lan_response("JSON")
+    if (not is_lan_mfa_passed(ordered_json_data.get(mqtt_config.totp_keyname), connection)):
+        return get_lan_response("MFA")
+    handle_json_command(ordered_json_data, received_time, client, True)
+    apply_pending_commands(tuple([key for key in ordered_json_data if key in mqtt_pending_commands]))
+    return get_lan_response()
+
+# LAN MFA check, every line needs a code of lan_totp_secrets (relays with their own TOTP keys are checked again by is_gpio_mfa_passed)
+# Lines are plaintext, a code is only accepted on the connection that used it first until it expires (replay of a sniffed code)
+# After lan_mfa_max_failures bad codes the connection is closed and all LAN codes are rejected for lan_mfa_backoff_in_seconds (brute force)
+# e.g. method(123456, connection) returns True if it matches a current or expired code
+def is_lan_mfa_passed(totp_number, connection):
+    global mqtt_lan_backoff_until
+    now = utime.time()
+    for code in [x for x in mqtt_lan_used_codes if now - mqtt_lan_used_codes[x][1] > (mqtt_config.totp_max_expired_codes + 1) * 30]:
+        del mqtt_lan_used_codes[code]   # Expired, no longer in the list of current and expired codes
+    
+    if (now < mqtt_lan_backoff_until):
+        mqtt_metrics.incr("lan_mfa_failed")
+        connection.is_closing = True
+        return False
+    try:
+        totp_number = int(totp_number)
+        used = mqtt_lan_used_codes.get(totp_number)
+        if (used is not None and used[0] != connection.number):
+            mqtt_metrics.incr("lan_mfa_replayed")   # Counted as failure as well
+        else:
+            for secret_key in mqtt_config.lan_totp_secrets:
+                if (totp_number in get_gpio_totp_codes(secret_key)):
+                    if (used is None):
+                        mqtt_lan_used_codes[totp_number] = (connection.number, now)
+                    return True
+    except Exception as e:
+        print(f"Error in LAN MFA={e}")
+    mqtt_metrics.incr("lan_mfa_failed")
+    log("Error: LAN MFA validation failed, command is ignored")
+    connection.mfa_failures += 1
+    if (connection.mfa_failures >= mqtt_config.lan_mfa_max_failures):
+        mqtt_lan_backoff_until = now + mqtt_config.lan_mfa_backoff_in_seconds
+        mqtt_metrics.incr("lan_mfa_backoffs")
+        log(f"Warning: {connection.mfa_failures} bad LAN TOTP codes, connection is closed and LAN commands are rejected for {mqtt_config.lan_mfa_backoff_in_seconds} seconds")
+        connection.is_closing = True
+    return False
+
+# Response line for the LAN client: full GPIO status after the command, or the error, e.g. method("MFA") returns '{"ERROR": "MFA", "TIME": "..."}'
+def get_lan_response(error=None):
+    if (error is None):
+        response = get_gpio_status(True)
+    else:
+        response = OrderedDict()
+        response[mqtt_config.lan_error_keyname] = error
+    response[mqtt_config.time_keyname] = get_formatted_time_now(mqtt_config.time_zone_name)
+    return json.dumps(response)
+                        
+    
+
+async def down(client):
+    global mqtt_publish_stats
+    while True:
+        await client.down.wait()  # Pause until connectivity changes
+        client.down.clear()
+        mqtt_publish_stats.is_online = False    
+        mqtt_publish_stats.outage_counter += 1
+        mqtt_publish_stats.is_command_settling = mqtt_config.command_settle_window_in_ms > 0   # Hold QoS1 backlog replayed right after reconnect
+        log(f"WiFi or broker is down, Time={get_formatted_time_now(mqtt_config.time_zone_name)}")
+        print("WiFi or broker is down.")
+
+async def up(client):
+    while True:
+        await client.up.wait()
+        client.up.clear()
+        mqtt_publish_stats.is_online = True
+        mqtt_publish_stats.is_snapshot_stale = True   # Last will may have cleared the retained snapshot
+        if (mqtt_config.command_settle_window_in_ms > 0):
+            mqtt_publish_stats.is_command_settling = True
+            mqtt_timer.cancel(mqtt_publish_stats.settle_timer_id)
+            mqtt_publish_stats.settle_timer_id = mqtt_timer.call_later(mqtt_config.command_settle_window_in_ms, end_command_settle_window)
+        if (mqtt_broker_pool is not None):
+            log(f"Connected: {mqtt_config.mqtt_client_id_text}, Broker={client.server}, Time={get_formatted_time_now(mqtt_config.time_zone_name)}")
+        else:
+            log(f"Connected: {mqtt_config.mqtt_client_id_text}, Time={get_formatted_time_now(mqtt_config.time_zone_name)}")
+        print(f"Connected: {mqtt_config.mqtt_client_id_text}")
+        await client.subscribe(mqtt_config.mqtt_topic, mqtt_config.mqtt_qos)
+        if (mqtt_config.mqtt_binary_topic):
+            await client.subscribe(mqtt_config.mqtt_binary_topic, mqtt_config.mqtt_qos)
+        if (not mqtt_publish_stats.is_boot_online):
+            mqtt_publish_stats.is_boot_online = True
+            set_boot_elapsed("boot_online_ms")   # Relays can be controlled by MQTT (after command_settle_window_in_ms)
+        
+async def onboard_led_online_status():
+    while True:
+        if (mqtt_publish_stats.is_online):
+            set_onboard_led(True)
+        else:
+            toggle_onboard_led()
+        await asyncio.sleep(1)
+    
+#  ----------------------------------------------------------------------------      
+# init mqtt_as using config[] as per original library
+
+def init_mqtt_as():
+    
+    global config
+
+     # Load configuration for mqtt_as
+    config['ssid'] = mqtt_config.wifi_ssid
+    config['wifi_pw'] = mqtt_config.wifi_pass
+    config['will'] = (mqtt_config.mqtt_topic, f"Disconnected for ClientID={mqtt_config.mqtt_client_id_text}", False, 0) # Last will send as QoS0
+    if (mqtt_config.mqtt_state_topic):
+        config['will'] = (mqtt_config.mqtt_state_topic, "", True, mqtt_config.mqtt_qos)   # Empty retained message clears the snapshot, clients know the device is offline
+    config['keepalive'] = 120
+    config["queue_len"] = mqtt_config.mqtt_queue_len  # Use event interface, pending commands per GPIO coalesce the backlog so older messages are not lost in a burst
+    config['user'] = mqtt_config.broker_user
+    config['password'] = mqtt_config.broker_pass
+    config['server'] = mqtt_config.broker_server
+    config['port'] = mqtt_config.broker_port
+    config['brokers'] = mqtt_broker_pool   # None without broker_failover_servers
+    config['dns_ttl'] = mqtt_config.broker_dns_ttl_in_seconds   # TLS sessions are resumed on reconnect where the ssl module supports it
+    config['ssl'] = True   # mqtt_as uses port 8883 if ssl is true or use config['port']
+    config['ssl_params'] = {"server_hostname": mqtt_config.broker_server}
+    config["client_id"] = mqtt_config.mqtt_client_id
+    config["clean"] = mqtt_config.mqtt_clean   # Set this to False (clear session) for reconnection to work Qos1 message recovery during outage
+    config["metrics"] = mqtt_metrics   # Registry for PUBACK RTT, reconnect duration and gc pause metrics
+    config["clean_init"] = True   # clean_init should normally be True. If False the system will attempt to restore a prior session on the first connection. This may result in a large backlog of qos==1 messages being received    
+    
+    
+# init compiled config, in-memory dict and stats
+# overrides replace config values, e.g. method(mqtt_topic="fleet/device1") for a simulated device
+def init(**overrides):
+    
+    global mqtt_config
+    global mqtt_publish_stats
+    global mqtt_gpio_hardware    
+    global mqtt_metrics
+    global gpio_backend
+    global mqtt_timer
+    global mqtt_pending_commands
+    global mqtt_publish_bucket
+    global mqtt_diagnostic_bucket
+    global mqtt_executor
+    global mqtt_outbox
+    global mqtt_journal
+    global mqtt_core1
+    global mqtt_lan
+    global mqtt_lan_used_codes
+    global mqtt_lan_backoff_until
+    global mqtt_broker_pool
+    global mqtt_rule_buckets
+    global mqtt_rule_logged_times
+    global mqtt_schedule_timer_ids
+    
+    boot_ticks = utime.ticks_ms()
+    
+    # Compile config first, config errors (e.g. GPIO is both relay and contact switch) stop the startup with ValueError
+    merged_overrides = config_overrides.copy()
+    merged_overrides.update(overrides)
+    mqtt_config = compile_config(mqtt_tiny_controller_config, **merged_overrides)
+    
+    mqtt_gpio_hardware = {}
+    mqtt_publish_bucket = TokenBucket(mqtt_config.publish_counter_max, mqtt_config.publish_threshold_in_seconds * 1000 // mqtt_config.publish_counter_max)   # GPIO status and snapshot only
+    mqtt_diagnostic_bucket = TokenBucket(mqtt_config.publish_diagnostic_counter_max, mqtt_config.publish_threshold_in_seconds * 1000 // mqtt_config.publish_diagnostic_counter_max)   # Responses and logs
+    mqtt_pending_commands = {}   # Latest pending command per GPIO, e.g. {"GP16": (1, received_ticks_ms)}
+    mqtt_metrics = MetricsRegistry()
+    mqtt_timer = TimerService()
+    mqtt_executor = CommandExecutor(mqtt_config.command_workers, mqtt_config.command_queue_len, mqtt_metrics)
+    mqtt_outbox = Outbox((mqtt_config.mqtt_qos, mqtt_config.mqtt_response_qos, mqtt_config.mqtt_log_qos), mqtt_config.log_messages_max, mqtt_metrics)
+    gpio_backend = create_gpio_backend(mqtt_config.gpio_backend_name)
+    mqtt_journal = None
+    journal_state = load_journal_state()   # Relay states and counters before the power blip, {} if the journal is disabled
+    
+    # Set all Gpio status to 0 (or the state from the journal) and init hardware (relay_pins has both relays and momentary relays)
+    for x in mqtt_config.relay_pins:
+        name = mqtt_config.gpio_names[x]
+        mqtt_gpio_hardware[name] = GpioProperty()
+        mqtt_gpio_hardware[name].status = 0   # status is using 0 and 1, same as real PIN value
+        mqtt_gpio_hardware[name].pin_id = x
+        mqtt_gpio_hardware[name].last_modified_time = utime.time() # only for relay
+        mqtt_gpio_hardware[name].cooldown_bucket = TokenBucket(1, mqtt_config.hardware_modified_cooldown_period_in_seconds * 1000, 0) # only for relay, starts empty (cooldown after power up)
+        mqtt_gpio_hardware[name].modified_bucket = TokenBucket(mqtt_config.hardware_modified_max, mqtt_config.hardware_modified_threshold_in_seconds * 1000 // mqtt_config.hardware_modified_max) # only for relay
+        mqtt_gpio_hardware[name].violation_counter = journal_state.get(name + ".violations", 0) # only for relay
+        mqtt_gpio_hardware[name].is_modified_allowed = True # only for relay
+        if (mqtt_config.hardware_lockout_enabled and mqtt_gpio_hardware[name].violation_counter > mqtt_config.hardware_violation_max + 1):
+            print(f"Error: Gpio {name} value change is permanently disabled (until hardware reset) for protection, number of violation exceeded {mqtt_config.hardware_violation_max} before restart")   # Not logged, log messages are created later in init()
+            mqtt_gpio_hardware[name].is_modified_allowed = False   # A power blip is not a hardware reset
+        
+        if (x in mqtt_config.momentary_relay_waits):
+            mqtt_gpio_hardware[name].is_momentary = True
+            mqtt_gpio_hardware[name].momentary_wait_in_seconds = mqtt_config.momentary_relay_waits[x]  # Customized wait (in seconds) for momentary relay, or the default 2 secs
+            gpio_backend.setup_output(x, 1)  # Value=1, high voltage (Off)
+        else:
+            mqtt_gpio_hardware[name].is_momentary = False
+            gpio_backend.setup_output(x, 0 if journal_state.get(name) == 1 else 1)  # Restore On (0) from the journal, otherwise Off (1)
+            
+        update_gpio_status_from_hardware(name)   # Good practice to sync based on hardware value
+        
+    # Contact switch
+    for y in mqtt_config.contact_pins:
+        name = mqtt_config.gpio_names[y]
+        mqtt_gpio_hardware[name] = GpioProperty()
+        mqtt_gpio_hardware[name].status = 0 # status is using 0 and 1, same as real PIN value
+        mqtt_gpio_hardware[name].pin_id = y
+        gpio_backend.setup_input(y)  # Create an input pin, with a pull up resistor
+            
+        update_gpio_status_from_hardware(name)
+
+    # TOTP (secret keys are decoded from Base32 in compiled config)
+    totp_keys = []
+    for name in mqtt_config.totp_secrets:
+        mqtt_gpio_hardware[name].totp_keys = mqtt_config.totp_secrets[name]
+        totp_keys.extend([x for x in mqtt_config.totp_secrets[name] if x not in totp_keys])
+    totp_keys.extend([x for x in mqtt_config.lan_totp_secrets if x not in totp_keys])
+        
+    # Core 1 service (started by worker), contact switch sampling and TOTP codes on the second core
+    if (mqtt_core1 is not None):
+        mqtt_core1.stop()   # init() called again, e.g. host simulation
+    mqtt_core1 = None
+    if (mqtt_config.core1_enabled):
+        from mqtt_tiny_controller_core1 import Core1Service   # Lazy import, only loaded when core 1 is enabled
+        input_mask = 0
+        for x in mqtt_config.contact_pins:
+            input_mask |= 1 << x
+        mqtt_core1 = Core1Service(gpio_backend, input_mask, mqtt_config.core1_sample_period_in_ms, mqtt_config.gpio_debounce_in_ms,
+                                  mqtt_config.core1_ring_len, totp_keys, mqtt_config.totp_max_expired_codes)
+        
+    # Relay schedules (started by worker() on the timer service)
+    load_relay_schedules()
+        
+    # Rate limit per automation rule with min_interval_in_seconds (rules are compiled into an index by trigger GPIO)
+    mqtt_rule_buckets = {}
+    mqtt_rule_logged_times = {}
+    mqtt_schedule_timer_ids = {}
+    for pin in mqtt_config.automation_rules:
+        for rule in mqtt_config.automation_rules[pin]:
+            if (rule[5] > 0):
+                mqtt_rule_buckets[rule[0]] = TokenBucket(1, rule[5])
+        
+    # LAN control endpoint (started by boot() when Wi-Fi is connected)
+    if (mqtt_lan is not None):
+        mqtt_lan.close()   # init() called again, e.g. host simulation
+    mqtt_lan = None
+    mqtt_lan_used_codes = {}
+    mqtt_lan_backoff_until = 0
+    if (mqtt_config.lan_enabled):
+        from mqtt_tiny_controller_lan import LanServer   # Lazy import, only loaded when the LAN endpoint is enabled
+        mqtt_lan = LanServer(mqtt_config.lan_port, mqtt_config.lan_max_clients, mqtt_config.lan_idle_timeout_in_seconds * 1000,
+                             mqtt_config.lan_max_line_bytes, mqtt_metrics)
+    
+    # Broker failover, mqtt_as takes the broker from the pool on every connect (see init_mqtt_as)
+    mqtt_broker_pool = None
+    if (len(mqtt_config.broker_failover_servers) > 0):
+        from mqtt_tiny_controller_broker import BrokerPool   # Lazy import, only loaded when backup brokers are configured
+        mqtt_broker_pool = BrokerPool(list(mqtt_config.brokers), mqtt_config.broker_failover_after_failures, mqtt_metrics)
+                
+        
+    # init stats
+    mqtt_publish_stats = PublishStats()    
+    mqtt_publish_stats.last_published_time = utime.time()
+    mqtt_publish_stats.last_scheduled_published_time = utime.time()
+    mqtt_publish_stats.publish_counter = 0    # If it's -1 (only with publish_lockout_enabled), it errors out and stops publishing forever
+    mqtt_publish_stats.is_republish = False
+    mqtt_publish_stats.is_first_time_run = True    # First time init to true
+    mqtt_publish_stats.startup_time = utime.time()
+    mqtt_publish_stats.is_online = False   # For onboard LED to use
+    mqtt_publish_stats.last_metrics_published_time = utime.time()
+    mqtt_publish_stats.last_clock_synced_time = utime.time()  # NOTE: becuase we ran the startup_clock_sync(), without error we assume at this point we have the clock synced successfully
+    mqtt_publish_stats.totp_number = 0    # This stores the global 6 digit totp number (sent by the client app)
+    mqtt_publish_stats.state_seq = 0
+    mqtt_publish_stats.state_history = []
+    mqtt_publish_stats.last_snapshot_masks = None
+    mqtt_publish_stats.is_snapshot_stale = True
+    mqtt_publish_stats.boot_ticks = boot_ticks
+    mqtt_publish_stats.is_boot_published = False
+    mqtt_publish_stats.is_boot_online = False
+    
+    # Restore counters from the state journal (SEQ continues, last clock sync only if the RTC is already past it)
+    mqtt_publish_stats.outage_counter = journal_state.get("outages", 0)
+    mqtt_publish_stats.state_seq = journal_state.get("seq", 0)
+    if (0 < journal_state.get("clock_synced", 0) <= utime.time()):
+        mqtt_publish_stats.last_clock_synced_time = journal_state["clock_synced"]
+    set_boot_elapsed("boot_hardware_ms")   # Config, relays and contact switches are ready
+
+#  ----------------------------------------------------------------------------      
+# Worker for infinite while loop
+
+# Technical notes on wifi/broker test:
+#
+# Case 1: Auto re-connect when network fails:  
+#    Use firewall rules on your router to block traffic to broker after connection is established 
+# Case 2: Auto re-connect when Wifi fails (SSID is still available)    
+#    Disconnect your PicoW using router admin
+# Case 3: Auto re-connect when Wifi totally gone (SSID is NOT available)
+#    Power off the router or change the SSID name of WiFi
+
+async def worker(client):
+
+    global mqtt_publish_stats
+    
+    # Create a task to show online status on LED
+    create_profiled_task(onboard_led_online_status(), "onboard_led_online_status")   # Async task for online status
+    
+    # Create a task to run delayed actions (e.g. momentary relay release)
+    create_profiled_task(mqtt_timer.run(), "timer_service")
+    
+    # Start the core 1 service (contact switch sampling, TOTP codes), it runs without the event loop
+    if (mqtt_core1 is not None):
+        mqtt_core1.start()
+    
+    # Check trigger contact switches of automation rules on the timer service (after core 1 started, it debounces them)
+    start_automation_rules()
+    
+    # Relay schedules on the timer service (only if the clock is already synced, otherwise after the first NTP sync)
+    start_relay_schedules()
+    
+    # Create the command executor tasks (stats, getip, ntp, metrics)
+    mqtt_executor.start(create_profiled_task)
+    
+    # Create a task to measure event loop lag (blocking calls delay every other task)
+    if (mqtt_config.loop_lag_monitor_period_in_ms > 0):
+        asyncio.create_task(loop_lag_monitor(mqtt_metrics, mqtt_config.loop_lag_monitor_period_in_ms))
+    
+    try:        
+        if (not await boot(client)):   # Wi-Fi, DNS, broker connect and NTP
+            return
+    except OSError:
+        print('Connection failed.')
+        return
+    
+    for task in (up, down, messages, publisher):
+        create_profiled_task(task(client), task.__name__)
+
+    # Scheduled publish, daily NTP clock sync and scheduled metrics publish run on the timer service
+    start_scheduled_tasks(client)
+
+
+    while True:
+        # Uncomment this to Delete all RETAIN messages from the MQTT broker (e.g. if you accidentially set the retain flag in "Iot MQTT Panel" app)
+        # client.publish(mqtt_topic, '', True)
+        
+        # GPIO status and notifications are queued in the outbox as state, the publisher task sends them before command responses and logs
+        # Because we are not updating publish_counter or last_published_time for log, logs are queued by log() and never wait for this loop
+                
+        # Publishing of GPIO and Notification (the previous state is still queued, e.g. broker is down: changes are combined into the next status):
+        # Check if any GPIO hardware value(s) has changed compare to master copy in dictionary
+        is_publish = False
+        if (mqtt_outbox.get_count(PRIORITY_STATE) == 0):
+            is_gpio_changed = is_gpio_values_changed()           
+            is_publish, is_full = is_publish_gpio_status(is_gpio_changed)  # Full list or partial list to Mqtt broker based on business logic 
+            send_notification(is_gpio_changed and is_publish)      # Notification if necessary, deferred changes are notified when they are published
+              
+        if (is_publish):
+            json_gpio_status = None  # this json contains either full list of GPIO status values or partial list of changed values  
+            all_gpio = get_gpio_status(is_full)   # Full list or the list of changed values
+            mqtt_publish_stats.state_seq += 1
+            add_state_history(mqtt_publish_stats.state_seq, dict(all_gpio))
+            binary_gpio_status = encode_state(all_gpio, utime.time(), is_full, mqtt_publish_stats.state_seq, mqtt_config.gpio_prefix) if mqtt_config.mqtt_binary_topic else None   # e.g. 18 bytes
+            if (mqtt_config.mqtt_json_status_enabled or not mqtt_config.mqtt_binary_topic):
+                all_gpio[mqtt_config.seq_keyname] = mqtt_publish_stats.state_seq
+                all_gpio[mqtt_config.time_keyname] = get_formatted_time_now(mqtt_config.time_zone_name)
+                json_gpio_status = json.dumps(all_gpio)
+            if (not is_full):
+                reset_gpio_changed_status()  # Reset is_changed to False            
+
+            mqtt_publish_bucket.consume()
+            mqtt_publish_stats.publish_counter = mqtt_publish_stats.publish_counter + 1 
+            mqtt_publish_stats.last_published_time = utime.time()            
+            
+            if (json_gpio_status is not None):
+                mqtt_outbox.put(PRIORITY_STATE, mqtt_config.mqtt_topic, json_gpio_status, mqtt_config.mqtt_retain, utime.ticks_ms())  #QoS=1, Retain flag=false
+            if (binary_gpio_status is not None):
+                mqtt_outbox.put(PRIORITY_STATE, mqtt_config.mqtt_binary_topic, binary_gpio_status, mqtt_config.mqtt_retain, utime.ticks_ms())
+
+        # Publishing of retained state snapshot (only when GPIO values changed)
+        if (mqtt_config.mqtt_state_topic and mqtt_publish_stats.is_online):
+            publish_state_snapshot()
+
+        # Save relay states and counters to flash (rate limited, only if the journal is enabled)
+        save_journal_state()
+
+        await asyncio.sleep(5)   # First round runs right after boot, so the status is published without waiting
+            
+            
+            
+
+# Publisher task: publishes the outbox one message at a time, state and notifications first, then command responses, then logs
+# A state change queued while a log line is in flight goes out next. Notes: If client.publish is called in callback, it will error out in mqtt broker reconnect scenario
+async def publisher(client):
+    wait_metric_names = ("state_wait_ms", "response_wait_ms", "publish_wait_ms")
+    while True:
+        priority = mqtt_outbox.get_next_priority()
+        if (priority < 0):
+            await mqtt_outbox.wait()
+            continue
+        if (priority != PRIORITY_STATE and not mqtt_diagnostic_bucket.consume()):   # GPIO status took its token of mqtt_publish_bucket in worker()
+            await mqtt_outbox.wait(mqtt_diagnostic_bucket.get_wait_in_ms())   # Rate limit of responses and logs reached, a state change still goes out first
+            continue
+        topic, msg, retain, queued_time = mqtt_outbox.pop(priority)
+        mqtt_metrics.observe(wait_metric_names[priority], utime.ticks_diff(utime.ticks_ms(), queued_time))
+        await client.publish(topic, msg, retain, mqtt_outbox.qos[priority])
+        if (priority == PRIORITY_STATE and not mqtt_publish_stats.is_boot_published):
+            mqtt_publish_stats.is_boot_published = True
+            set_boot_elapsed("boot_first_publish_ms")
+
+
+#  ----------------------------------------------------------------------------
+# Program main 
+
+mqtt_config = None   # Compiled config (read-only), created by init()
+config_overrides = {}   # Config values replaced in init(), e.g. {"gpio_backend_name": "sim"} for host simulation
+mqtt_publish_stats = None
+mqtt_gpio_hardware = None
+mqtt_metrics = None
+mqtt_outbox = None    # Outbox of messages to publish by priority (state, responses, logs), created by init()
+mqtt_journal = None   # StateJournal if journal_enabled, created by init()
+mqtt_core1 = None     # Core1Service if core1_enabled, created by init() and started by worker()
+mqtt_lan = None       # LanServer if lan_enabled, created by init() and started by boot()
+mqtt_lan_used_codes = {}   # LAN TOTP code -> (connection number, time first used), a code is only accepted again on the same connection
+mqtt_lan_backoff_until = 0   # LAN codes are rejected until this time after lan_mfa_max_failures bad codes on a connection
+mqtt_broker_pool = None   # BrokerPool if broker_failover_servers are configured, created by init()
+mqtt_rule_buckets = {}   # Rule number -> TokenBucket for automation rules with min_interval_in_seconds
+mqtt_rule_logged_times = {}   # Rule number -> time the rule was last logged
+mqtt_schedules = ()   # Compiled relay schedules (see mqtt_tiny_controller_schedule), from config or the last {"SCHEDULE": [...]} command
+mqtt_schedule_entries = []   # Relay schedules as configured or received, e.g. [{"at": "06:30", "action": 16, "value": 1}]
+mqtt_schedule_timer_ids = {}   # Schedule number -> timer id of its next fire time
+
+# Note: The "mqtt_as" library operates under the assumption of a stable connection during startup. However, it faces
+#       the risk of permanent termination if the WiFi signal is weak during the initial startup or after a reboot following
+#       a power outage where the WiFi is not yet available.
+# Workaround: To mitigate this issue, boot() waits for Wi-Fi with a retry loop (wifi_max_retries) before invoking the "mqtt_as" connect.
+#             The wait is async, relays are already initialized and the onboard LED keeps blinking while Wi-Fi associates.
+
+wlan = None
+
+# Program main, called by main.py on PicoW (importing this module has no side effects, e.g. for host simulation)
+def main():
+
+    # Compile config and init in-memory dict, relays and stats, config errors are found before connecting
+    init()         # If there is any error in clock sync, we use the default RTC start time: Jan 1, 2021 (TOTP will fail though)
+    
+    # Init config[] for mqtt_as
+    init_mqtt_as()
+
+    # Set up client. Enable optional debug statements.
+    MQTTClient.DEBUG = True
+    client = MQTTClient(config)
+
+    try:
+        print(f"Memory usage: {get_formatted_memory_usage()}")
+        asyncio.run(mqtt_metrics.profile(worker(client), "worker") if mqtt_config.task_profiling_enabled else worker(client))   # worker() runs boot()
+    finally:  # Prevent LmacRxBlk:1 errors.
+        print("Shutting down....")
+        print(f"Memory usage: {get_formatted_memory_usage()}")
+        set_onboard_led(False)    # PicoW has only one LED 
+        client.close()
+        asyncio.new_event_loop()
+        save_journal_state(True)   # Keep the latest relay states and counters for the next start (journal_enabled)
+        print('Wifi or broker permanently Failed, machine will reboot...')
+        utime.sleep(mqtt_config.wifi_reset_delay_in_seconds)        
+        machine.reset()
+
+
+if __name__ == "__main__":    # Run directly in Thonny
+    main()
@@ -0,0 +1,96 @@
+
+# Broker failover library for mqtt_tiny_controller
+# Brokers by priority (0 = preferred, e.g. HiveMQ cloud, then a self hosted Mosquitto), with connects, failures and connect time per broker.
+# mqtt_as takes the broker from the pool on every connect and reports the result. After failover_after failed connects in a row the pool moves
+# to the next broker (brokers with the same priority are ranked by their last connect time). Addresses are resolved and cached by mqtt_as (dns_ttl).
+# While a backup broker is used, probe() checks the preferred broker with a TCP connect (no TLS or MQTT login), the caller fails back when it answers.
+# The probe takes the address cached by mqtt_as, a DNS lookup (blocking on MicroPython) would stall the event loop while the preferred broker is down.
+#
+# e.g.
+#     pool = BrokerPool([("xxx.hivemq.cloud", 8883, "user", "pass", 0), ("192.168.1.10", 8883, "user2", "pass2", 1)], 3, metrics)
+#     config["brokers"] = pool     # mqtt_as uses pool.get_current() and reports pool.on_connected(ms) / pool.on_connect_failed()
+#     addr = client.get_cached_address("xxx.hivemq.cloud", 8883)
+#     if (not pool.is_preferred() and addr is not None and await pool.probe(pool.preferred, addr, 2000)):
+#         pool.select(pool.preferred)
+
+import utime
+import uasyncio as asyncio
+
+
+# Health of one broker
+class BrokerHealth:
+    connects = 0         # Successful connects
+    failures = 0         # Failed connects (DNS, TCP, TLS or CONNACK)
+    failures_in_row = 0  # Failed connects since the last successful one, failover at failover_after
+    connect_ms = 0       # Duration of the last successful connect (DNS, TCP, TLS and CONNACK), 0 if it never connected
+    probe_ms = 0         # Duration of the last successful probe (TCP connect)
+
+
+class BrokerPool:
+
+    # brokers is a list of (server, port, user, password, priority), e.g. from broker_server and broker_failover_servers
+    def __init__(self, brokers, failover_after=3, metrics=None):
+        self.brokers = brokers
+        self.health = [BrokerHealth() for x in brokers]
+        self.failover_after = max(1, failover_after)
+        self.metrics = metrics
+        self.preferred = self.get_ranked()[0]   # First broker with the lowest priority number
+        self.index = self.preferred
+
+    def incr(self, name):
+        if (self.metrics is not None):
+            self.metrics.incr(name)
+
+    # Broker indexes by priority, then by the last connect time (a broker that never connected is tried first), e.g. [0, 2, 1]
+    def get_ranked(self):
+        return sorted(range(len(self.brokers)), key=lambda i: (self.brokers[i][4], self.health[i].connect_ms))
+
+    # (server, port, user, password, priority) of the broker used by the next connect
+    def get_current(self):
+        return self.brokers[self.index]
+
+    def is_preferred(self):
+        return self.brokers[self.index][4] == self.brokers[self.preferred][4]
+
+    def select(self, index):
+        self.index = index
+        self.health[index].failures_in_row = 0
+        if (self.metrics is not None):
+            self.metrics.set("broker_index", index)
+
+    # Connect to the current broker succeeded, e.g. method(850)
+    def on_connected(self, connect_ms):
+        health = self.health[self.index]
+        health.connects += 1
+        health.failures_in_row = 0
+        health.connect_ms = connect_ms
+
+    # Connect to the current broker failed, returns True if the next connect uses another broker
+    def on_connect_failed(self):
+        health = self.health[self.index]
+        health.failures += 1
+        health.failures_in_row += 1
+        if (health.failures_in_row < self.failover_after or len(self.brokers) < 2):
+            return False
+        ranked = self.get_ranked()
+        self.select(ranked[(ranked.index(self.index) + 1) % len(ranked)])
+        self.incr("broker_failovers")
+        return True
+
+    # TCP connect to a broker at addr (resolved address, no DNS lookup) within timeout_in_ms (e.g. the preferred broker while a backup is used)
+    # e.g. method(0, ("203.0.113.7", 8883), 3000) returns True if it answered
+    async def probe(self, index, addr, timeout_in_ms):
+        health = self.health[index]
+        start_ticks = utime.ticks_ms()
+        try:
+            reader, writer = await asyncio.wait_for_ms(asyncio.open_connection(addr[0], addr[1]), timeout_in_ms)
+        except (OSError, asyncio.TimeoutError):
+            self.incr("broker_probes_failed")
+            return False
+        health.probe_ms = utime.ticks_diff(utime.ticks_ms(), start_ticks)
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return True
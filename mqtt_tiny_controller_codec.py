@@ -0,0 +1,97 @@
+
+# Binary payload codec library for mqtt_tiny_controller (works on MicroPython and CPython, e.g. for a backend decoder)
+# Optional compact encoding for the binary topic (mqtt_binary_topic), JSON stays the default on mqtt_topic for the "IoT MQTT Panel" app.
+# All values are little endian, bit x of a mask is GPx, GPIO values are the human readable values (1 = On, 0 = Off)
+#
+# State (18 bytes), published by the controller:
+#   [0x01, flags, values (uint32), pins (uint32), epoch (uint32), seq (uint32)]   flags bit 0 = full list, pins = GPIOs included in this message
+#   e.g. {"GP16": 1, "GP17": 0, "SEQ": 7, "TIME": "..."} is 01 00 00000100 00000300 <epoch> 07000000 instead of ~60 bytes of JSON
+# Commands, published by clients:
+#   [0x10, pins (uint32), values (uint32)]                  Set GPIOs, e.g. {"GP16": 1, "GP17": 0}
+#   [0x11, pins (uint32), values (uint32), totp (uint32)]   Set GPIOs with MFA, e.g. {"GP16": 1, "MFA": 123456}
+#   [0x20, command (uint16)]                                Command by number in config commands, e.g. 501 for {"CMD": "stats"}
+
+import struct
+
+MSG_STATE = 0x01
+OP_SET = 0x10
+OP_SET_MFA = 0x11
+OP_COMMAND = 0x20
+
+STATE_FORMAT = "<BBIIII"
+SET_FORMAT = "<BII"
+SET_MFA_FORMAT = "<BIII"
+COMMAND_FORMAT = "<BH"
+
+FLAG_FULL = 0x01
+
+
+# e.g. method({"GP16": 1, "GP17": 0}, 1767571200, True, 7) returns 18 bytes
+def encode_state(gpio_status, epoch, full=False, seq=0, gpio_prefix="GP"):
+    values, pins = get_masks(gpio_status, gpio_prefix)
+    return struct.pack(STATE_FORMAT, MSG_STATE, FLAG_FULL if full else 0, values, pins, epoch, seq)
+
+
+# e.g. method(payload) returns {"GP16": 1, "GP17": 0, "TIME": 1767571200, "FULL": True, "SEQ": 7}, None if it's not a state message
+def decode_state(payload, gpio_prefix="GP"):
+    if (len(payload) != struct.calcsize(STATE_FORMAT) or payload[0] != MSG_STATE):
+        return None
+    msg_type, flags, values, pins, epoch, seq = struct.unpack(STATE_FORMAT, payload)
+    result = get_gpio_values(values, pins, gpio_prefix)
+    result["TIME"] = epoch
+    result["FULL"] = (flags & FLAG_FULL) != 0
+    result["SEQ"] = seq
+    return result
+
+
+# e.g. method({"GP16": 1}) or method({"GP16": 1}, 123456) with MFA
+def encode_set_command(gpio_values, totp=None, gpio_prefix="GP"):
+    values, pins = get_masks(gpio_values, gpio_prefix)
+    if (totp is None):
+        return struct.pack(SET_FORMAT, OP_SET, pins, values)
+    return struct.pack(SET_MFA_FORMAT, OP_SET_MFA, pins, values, totp)
+
+
+# e.g. method(501) for "stats"
+def encode_command(command):
+    return struct.pack(COMMAND_FORMAT, OP_COMMAND, command)
+
+
+# Decode a command, returns (opcode, gpio values, totp or None, command) or None if the payload is not a command (e.g. a state message echoed back)
+# e.g. method(payload) returns (0x10, {"GP16": 1}, None, 0) or (0x20, None, None, 501)
+def decode_command(payload, gpio_prefix="GP"):
+    if (len(payload) == 0):
+        return None
+    opcode = payload[0]
+    if (opcode == OP_SET and len(payload) == struct.calcsize(SET_FORMAT)):
+        opcode, pins, values = struct.unpack(SET_FORMAT, payload)
+        return opcode, get_gpio_values(values, pins, gpio_prefix), None, 0
+    if (opcode == OP_SET_MFA and len(payload) == struct.calcsize(SET_MFA_FORMAT)):
+        opcode, pins, values, totp = struct.unpack(SET_MFA_FORMAT, payload)
+        return opcode, get_gpio_values(values, pins, gpio_prefix), totp, 0
+    if (opcode == OP_COMMAND and len(payload) == struct.calcsize(COMMAND_FORMAT)):
+        opcode, command = struct.unpack(COMMAND_FORMAT, payload)
+        return opcode, None, None, command
+    return None
+
+
+# e.g. method({"GP16": 1, "GP17": 0}) returns (values, pins) = (0x10000, 0x30000)
+def get_masks(gpio_values, gpio_prefix="GP"):
+    values = 0
+    pins = 0
+    for name in gpio_values:
+        if (name.startswith(gpio_prefix)):
+            bit = 1 << int(name[len(gpio_prefix):])
+            pins |= bit
+            if (gpio_values[name]):
+                values |= bit
+    return values, pins
+
+
+# e.g. method(0x10000, 0x30000) returns {"GP16": 1, "GP17": 0} (sorted by GPIO number)
+def get_gpio_values(values, pins, gpio_prefix="GP"):
+    result = {}
+    for x in range(32):
+        if (pins & (1 << x)):
+            result[gpio_prefix + str(x)] = (values >> x) & 1
+    return result
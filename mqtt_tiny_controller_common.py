@@ -1,37 +1,44 @@
 
 # Common library for mqtt_tiny_controller
+# Optional subsystems are imported on first use (urequests for "getip", ntptime for clock sync, pico_2fa_totp for MFA),
+# so they cost no boot time or RAM when they are not used
 
-import ntptime, utime, network, urequests, machine
-import json, re, gc, os
-from mqtt_tiny_controller_config import *
-from pico_2fa_totp import *
+import utime, network, machine
+import json, gc
+import uasyncio as asyncio
 
-# Start up loop for connecting wifi
-def connect_wifi(toggle_onboard_led_delegate):
+# Start Wi-Fi association without waiting, using wifi settings in compiled config (no reconnect if it's already connected)
+# e.g. method(mqtt_config)
+def start_wifi(mqtt_config):
     wlan = network.WLAN(network.STA_IF)
-    wlan.active(True)
-    wlan.config(pm = 0xa11140) # Diable powersave mode
-    wlan.connect(wifi_ssid, wifi_pass)
+    if (not wlan.isconnected()):
+        wlan.active(True)
+        wlan.config(pm = 0xa11140) # Diable powersave mode
+        wlan.connect(mqtt_config.wifi_ssid, mqtt_config.wifi_pass)
+    return wlan
+
 
-    max_wait = wifi_max_retries
-    while max_wait > 0:
-        toggle_onboard_led_delegate()       # Note: Cannot call asnyc function onboard_led_online_status() before "mqtt_as" starts
+# Start up loop for connecting wifi without blocking the event loop (other boot tasks keep running), returns True if connected
+# Waits up to max_retries seconds, the onboard LED is toggled every second
+# e.g. await method(wlan, toggle_onboard_led, mqtt_config.wifi_max_retries)
+async def wait_for_wifi(wlan, toggle_onboard_led_delegate, max_retries, poll_in_ms=100):
+    polls_per_second = 1000 // poll_in_ms
+    polls = max_retries * polls_per_second
+    while polls > 0:
         if wlan.status() < 0 or wlan.status() >= 3:
             break
-        max_wait -= 1     
-        print('Device started: Waiting for connection...')
-        utime.sleep(1)        
-    
+        if (polls % polls_per_second == 0):
+            toggle_onboard_led_delegate()       # Note: Cannot call asnyc function onboard_led_online_status() before "mqtt_as" starts
+            print('Device started: Waiting for connection...')
+        polls -= 1
+        await asyncio.sleep_ms(poll_in_ms)
+
     if wlan.status() != 3:
-        # raise RuntimeError('Wifi connection permanently Failed')        
-        print('Wifi connection permanently Failed, machine will reboot...')
-        utime.sleep(wifi_reset_delay_in_seconds)        
-        machine.reset()
-    else:
-        print('Wifi Connected')
-        print(wlan.ifconfig())
-        
-    return wlan
+        print('Wifi connection permanently Failed')
+        return False
+    print('Wifi Connected')
+    print(wlan.ifconfig())
+    return True
         
 
 # Get wifi strength in percentage with given ssid
@@ -94,30 +101,35 @@ def format_time(time_tuple, time_zone_name):
         time_zone_name
     )
 
-# Function to get formatted time based on time zone
-def get_formatted_time_now(time_zone_name):
-    utc_time = utime.time()  # Get current UTC time (in seconds since epoch)
-
-    if time_zone_name == "UTC":
+# Offset of local time to UTC in seconds, e.g. method(utime.time(), "EST") returns -18000 (EST) or -14400 (EDT, DST)
+def get_utc_offset_in_seconds(utc_time, time_zone_name):
+    if time_zone_name == "EST":  # Only supports EST, implement your own time zone if you wish
         utc_time_tuple = utime.localtime(utc_time)
-        return format_time(utc_time_tuple, time_zone_name)
-
-    elif time_zone_name == "EST":  # Only supports EST, implement your own time zone if you wish
-        local_time = utime.localtime(utc_time)
-        year, month, day = local_time[0], local_time[1], local_time[2]
+        year, month, day = utc_time_tuple[0], utc_time_tuple[1], utc_time_tuple[2]
 
         # EST is UTC-5, EDT is UTC-4 (DST)
         offset = -5 if not is_dst(year, month, day) else -4
+        return offset * 3600
+    return 0
 
-        # Adjust time for the EST/EDT offset
-        est_time = utime.localtime(utc_time + offset * 3600)
+# Function to get formatted time based on time zone
+def get_formatted_time_now(time_zone_name):
+    utc_time = utime.time()  # Get current UTC time (in seconds since epoch)
 
-        return format_time(est_time, time_zone_name)
+    if time_zone_name in ("UTC", "EST"):
+        # Adjust time for the time zone offset (e.g. EST/EDT)
+        local_time = utime.localtime(utc_time + get_utc_offset_in_seconds(utc_time, time_zone_name))
+        return format_time(local_time, time_zone_name)
 
     else:
         return "Unsupported time zone"
 
     
+# Set RTC from NTP server (blocking)
+def set_time_from_ntp():
+    import ntptime   # Lazy import, only loaded when the clock is synced
+    ntptime.settime()
+    
 # Get memory usage to check memory leak 
 def get_formatted_memory_usage(full=False):
   gc.collect()
@@ -141,6 +153,7 @@ def calculate_time(seconds):
 
 # Get IP address from provider
 def get_public_ip_from_provider(json_provider):
+    import urequests   # Lazy import, only loaded when "getip" is used
     result_ip = None
     response = urequests.get(json_provider)
     if response.status_code == 200:
@@ -148,9 +161,10 @@ def get_public_ip_from_provider(json_provider):
         result_ip = data.get('ip', None)   # Json ip provider look for "ip"        
     return result_ip
 
-# MFA get TOTP with key return a list of existing code and expired code allowed
+# MFA get TOTP with key (decoded secret bytes from compiled config, or Base32 string) return a list of existing code and expired code allowed
 # Returns e.g. [105687, 124004, 13357, 168469, 211798]
 def get_totp(secret_key, number_of_expired_code_allowed, step_secs=30):
+    from pico_2fa_totp import totp   # Lazy import, only loaded when MFA is enabled for a GPIO
     result_list  = []
     value = 0
     for x in range(number_of_expired_code_allowed):           
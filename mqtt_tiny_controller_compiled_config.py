@@ -0,0 +1,281 @@
+
+# Compiled configuration library for mqtt_tiny_controller
+# mqtt_tiny_controller_config.py is compiled once at init(): values are validated (types, pin overlaps, TOTP pins, topics) and
+# lookup tables are precomputed (sorted pin lists, pin names, encoded topics, decoded TOTP secrets), so nothing is merged or
+# decoded again while messages are handled. Config errors stop the startup with one ValueError listing all problems.
+#
+# e.g.
+#     import mqtt_tiny_controller_config
+#     mqtt_config = compile_config(mqtt_tiny_controller_config, mqtt_topic="fleet/device1")   # Overrides must be existing config names
+#     mqtt_config.all_pins          # (0, 1, 2, 3, 16, 17, 18, 19)
+#     mqtt_config.gpio_names[16]    # "GP16"
+
+max_gpio_pin = 29   # RP2040 has GPIO 0-29
+supported_time_zones = ("UTC", "EST")
+automation_rule_keys = ("trigger", "when", "action", "value", "delay_in_seconds", "min_interval_in_seconds", "if")
+broker_keys = ("server", "port", "user", "password", "priority")
+
+
+# Read-only config, e.g. mqtt_config.mqtt_topic = "x" raises AttributeError
+class CompiledConfig:
+
+    def __init__(self, values):
+        for name in values:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Compiled config is read-only, {name} cannot be set")
+
+
+# Names defined in the config module (no functions, modules or private names)
+def get_config_values(source):
+    values = {}
+    for name in dir(source):
+        value = getattr(source, name)
+        if (not name.startswith("_") and isinstance(value, (bool, int, float, str, bytes, set, dict, list, tuple))):
+            values[name] = value
+    return values
+
+
+def check_type(errors, values, name, types, type_name):
+    if (name not in values):
+        errors.append(f"{name} is missing")
+    elif (not isinstance(values[name], types) or (types != bool and isinstance(values[name], bool))):
+        errors.append(f"{name} must be {type_name}")
+
+
+def check_pins(errors, name, pins):
+    for pin in pins:
+        if (not isinstance(pin, int) or pin < 0 or pin > max_gpio_pin):
+            errors.append(f"{name} has invalid GPIO {pin} (0-{max_gpio_pin})")
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# Validate automation rules and index them by trigger GPIO, so a contact switch change only looks at its own rules
+# Each rule is a tuple (rule number, when, action name, value, delay_in_ms, min_interval_in_ms, ((condition name, value), ...)), when is None for any change
+# e.g. [{"trigger": 0, "when": 0, "action": 18}] returns {0: ((0, 0, "GP18", 1, 0, 0, ()),)}
+def compile_automation_rules(errors, rules, contact_pins, relay_pins, all_pins, gpio_prefix):
+    rules_by_pin = {}
+    for i in range(len(rules)):
+        rule = rules[i]
+        label = f"automation_rules[{i}]"
+        if (not isinstance(rule, dict)):
+            errors.append(f"{label} must be a dict")
+            continue
+        for key in rule:
+            if (key not in automation_rule_keys):
+                errors.append(f"{label} has unknown key {key}")
+        trigger = rule.get("trigger")
+        action = rule.get("action")
+        when = rule.get("when")
+        value = rule.get("value", 1)
+        delay = rule.get("delay_in_seconds", 0)
+        min_interval = rule.get("min_interval_in_seconds", 0)
+        conditions = rule.get("if", {})
+        if (trigger not in contact_pins):
+            errors.append(f"{label} trigger must be a contact switch GPIO")
+        if (action not in relay_pins):
+            errors.append(f"{label} action must be a relay GPIO")
+        if (when not in (None, 0, 1) or isinstance(when, bool)):
+            errors.append(f"{label} when must be 0 or 1")
+        if (value not in (0, 1) or isinstance(value, bool)):
+            errors.append(f"{label} value must be 0 or 1")
+        if (not is_number(delay) or delay < 0 or not is_number(min_interval) or min_interval < 0):
+            errors.append(f"{label} delay_in_seconds and min_interval_in_seconds must be 0 or more seconds")
+            continue
+        if (not isinstance(conditions, dict)):
+            errors.append(f"{label} if must be a dict {{GPIO_ID: VALUE}}")
+            continue
+        for pin in conditions:
+            if (pin not in all_pins or conditions[pin] not in (0, 1)):
+                errors.append(f"{label} if has invalid GPIO {pin} or value (configured GPIO, 0 or 1)")
+        if (trigger in contact_pins and action in relay_pins):
+            condition_values = tuple([(gpio_prefix + str(x), conditions[x]) for x in sorted(conditions)])
+            compiled_rule = (i, when, gpio_prefix + str(action), value, int(delay * 1000), int(min_interval * 1000), condition_values)
+            rules_by_pin[trigger] = rules_by_pin.get(trigger, ()) + (compiled_rule,)
+    return rules_by_pin
+
+
+# Brokers by priority for failover, broker_server first with priority 0, each broker is a tuple (server, port, user, password, priority)
+# e.g. [{"server": "192.168.1.10"}] returns (("xxx.hivemq.cloud", 8883, "user", "pass", 0), ("192.168.1.10", 8883, "user", "pass", 1))
+def compile_brokers(errors, values):
+    brokers = [(values["broker_server"], values["broker_port"], values["broker_user"], values["broker_pass"], 0)]
+    for i in range(len(values["broker_failover_servers"])):
+        entry = values["broker_failover_servers"][i]
+        label = f"broker_failover_servers[{i}]"
+        if (not isinstance(entry, dict) or not isinstance(entry.get("server"), str) or len(entry["server"]) == 0):
+            errors.append(f"{label} must be a dict with \"server\"")
+            continue
+        for key in entry:
+            if (key not in broker_keys):
+                errors.append(f"{label} has unknown key {key}")
+        port = entry.get("port", 8883)
+        user = entry.get("user", values["broker_user"])
+        password = entry.get("password", values["broker_pass"])
+        priority = entry.get("priority", 1)
+        if (not isinstance(port, int) or isinstance(port, bool) or port < 1 or port > 65535):
+            errors.append(f"{label} port must be 1-65535")
+        if (not isinstance(user, str) or not isinstance(password, str)):
+            errors.append(f"{label} user and password must be strings")
+        if (not isinstance(priority, int) or isinstance(priority, bool) or priority < 0):
+            errors.append(f"{label} priority must be 0 or more")
+        brokers.append((entry["server"], port, user, password, priority))
+    return tuple(brokers)
+
+
+# Compile and validate config, overrides replace config values (e.g. per simulated device), returns CompiledConfig
+# e.g. method(mqtt_tiny_controller_config, gpio_backend_name="sim")
+def compile_config(source, **overrides):
+    values = get_config_values(source)
+    errors = []
+    for name in overrides:
+        if (name not in values):
+            errors.append(f"Unknown config override {name}")
+        values[name] = overrides[name]
+
+    for name in ("wifi_ssid", "wifi_pass", "broker_server", "broker_user", "broker_pass", "mqtt_topic", "gpio_prefix", "mqtt_binary_topic", "mqtt_state_topic",
+                 "command_keyname", "json_ip_provider", "ip_keyname", "time_keyname", "time_zone_name", "metrics_keyname", "notification_keyname",
+                 "seq_keyname", "since_keyname", "totp_keyname", "gpio_backend_name", "journal_file_prefix", "lan_error_keyname", "schedule_keyname", "schedule_file"):
+        check_type(errors, values, name, str, "a string")
+    for name in ("wifi_max_retries", "wifi_reset_delay_in_seconds", "mqtt_qos", "mqtt_response_qos", "mqtt_log_qos", "publish_counter_max", "publish_threshold_in_seconds", "publish_diagnostic_counter_max", "log_messages_max",
+                 "hardware_modified_cooldown_period_in_seconds", "command_settle_window_in_ms", "mqtt_queue_len", "command_workers", "command_queue_len",
+                 "hardware_modified_max", "hardware_modified_threshold_in_seconds", "hardware_violation_max", "scheduled_publish_in_seconds",
+                 "momentary_switch_default_wait_in_seconds", "scheduled_metrics_publish_in_seconds", "loop_lag_monitor_period_in_ms",
+                 "scheduled_clock_sync_in_seconds", "forced_clock_sync_wait_in_seconds", "default_clock_year_in_unix_timestamp", "totp_max_expired_codes",
+                 "state_history_len", "journal_flush_interval_in_seconds", "journal_max_bytes", "core1_sample_period_in_ms", "gpio_debounce_in_ms",
+                 "core1_ring_len", "lan_port", "lan_max_clients", "lan_idle_timeout_in_seconds", "lan_max_line_bytes", "lan_mfa_max_failures",
+                 "lan_mfa_backoff_in_seconds", "automation_poll_period_in_ms", "schedules_max", "broker_port", "broker_failover_after_failures",
+                 "broker_failback_probe_in_seconds", "broker_probe_timeout_in_ms", "broker_dns_ttl_in_seconds"):
+        check_type(errors, values, name, int, "an integer")
+    for name in ("mqtt_retain", "mqtt_clean", "publish_lockout_enabled", "hardware_lockout_enabled", "task_profiling_enabled", "mqtt_json_status_enabled",
+                 "journal_enabled", "core1_enabled", "lan_enabled"):
+        check_type(errors, values, name, bool, "True or False")
+    check_type(errors, values, "mqtt_client_id", bytes, "bytes (e.g. b\"uniqueclient1234\")")
+    check_type(errors, values, "commands", dict, "a dict")
+    check_type(errors, values, "gpio_pins_for_momentary_relay_switch", dict, "a dict {GPIO_ID: WAIT_IN_SECONDS}")
+    check_type(errors, values, "gpio_pins_for_totp_enabled", (dict, set), "a dict {GPIO_ID: [KEYS]} (empty to disable)")
+    for name in ("gpio_pins_for_relay_switch", "gpio_pins_for_contact_switch", "gpio_pins_for_notification"):
+        check_type(errors, values, name, (set, list, tuple), "a set of GPIO IDs")
+    check_type(errors, values, "lan_totp_secrets", (list, tuple), "a list of Base32 keys")
+    check_type(errors, values, "automation_rules", (list, tuple), "a list of rules (empty to disable)")
+    check_type(errors, values, "relay_schedules", (list, tuple), "a list of schedules (empty to disable)")
+    check_type(errors, values, "broker_failover_servers", (list, tuple), "a list of brokers (empty to disable)")
+    if (len(errors) > 0):
+        raise ValueError("Invalid config: " + "; ".join(errors))
+
+    # Values
+    for name in ("mqtt_qos", "mqtt_response_qos", "mqtt_log_qos"):
+        if (values[name] not in (0, 1)):
+            errors.append(f"{name} must be 0 or 1")
+    if (values["time_zone_name"] not in supported_time_zones):
+        errors.append(f"time_zone_name must be one of {supported_time_zones}")
+    if (len(values["mqtt_topic"]) == 0 or len(values["mqtt_client_id"]) == 0 or len(values["gpio_prefix"]) == 0):
+        errors.append("mqtt_topic, mqtt_client_id and gpio_prefix cannot be empty")
+    for name in ("gpio_debounce_in_ms", "broker_dns_ttl_in_seconds", "lan_mfa_backoff_in_seconds"):
+        if (values[name] < 0):
+            errors.append(f"{name} cannot be negative")
+    if (values["journal_enabled"] and len(values["journal_file_prefix"]) == 0):
+        errors.append("journal_file_prefix cannot be empty when journal_enabled is True")
+    if (values["lan_enabled"] and len(values["lan_totp_secrets"]) == 0):
+        errors.append("lan_totp_secrets cannot be empty when lan_enabled is True")
+    for name in ("lan_port", "broker_port"):
+        if (values[name] < 1 or values[name] > 65535):
+            errors.append(f"{name} must be 1-65535")
+    for name in ("mqtt_binary_topic", "mqtt_state_topic"):
+        if (values[name] == values["mqtt_topic"]):
+            errors.append(f"{name} must be different from mqtt_topic")
+    if (values["mqtt_binary_topic"] and values["mqtt_binary_topic"] == values["mqtt_state_topic"]):
+        errors.append("mqtt_binary_topic and mqtt_state_topic must be different")
+    for name in ("publish_counter_max", "publish_threshold_in_seconds", "publish_diagnostic_counter_max", "log_messages_max", "mqtt_queue_len", "command_workers", "command_queue_len",
+                 "hardware_modified_max", "hardware_modified_threshold_in_seconds", "state_history_len", "totp_max_expired_codes",
+                 "journal_flush_interval_in_seconds", "journal_max_bytes", "core1_sample_period_in_ms", "core1_ring_len", "lan_max_clients",
+                 "lan_idle_timeout_in_seconds", "lan_max_line_bytes", "lan_mfa_max_failures", "automation_poll_period_in_ms", "schedules_max",
+                 "broker_failover_after_failures", "broker_probe_timeout_in_ms"):
+        if (values[name] < 1):
+            errors.append(f"{name} must be at least 1")
+
+    # Pins: each GPIO has one role (relay, momentary relay or contact switch)
+    relay_pins = set(values["gpio_pins_for_relay_switch"])
+    momentary_pins = values["gpio_pins_for_momentary_relay_switch"]
+    contact_pins = set(values["gpio_pins_for_contact_switch"])
+    check_pins(errors, "gpio_pins_for_relay_switch", relay_pins)
+    check_pins(errors, "gpio_pins_for_momentary_relay_switch", momentary_pins)
+    check_pins(errors, "gpio_pins_for_contact_switch", contact_pins)
+    for pin in sorted([x for x in relay_pins if x in momentary_pins]):
+        errors.append(f"GPIO {pin} is both relay and momentary relay")
+    for pin in sorted([x for x in contact_pins if x in relay_pins or x in momentary_pins]):
+        errors.append(f"GPIO {pin} is both relay and contact switch")
+
+    momentary_relay_waits = {}
+    for pin in momentary_pins:
+        wait = momentary_pins[pin]
+        if (wait is None):
+            wait = values["momentary_switch_default_wait_in_seconds"]   # e.g. {18:None} uses the default wait
+        if (not isinstance(wait, (int, float)) or wait <= 0):
+            errors.append(f"GPIO {pin} momentary wait must be a positive number of seconds")
+        momentary_relay_waits[pin] = wait
+
+    all_relay_pins = relay_pins.copy()
+    all_relay_pins.update(momentary_pins)
+    all_pins = all_relay_pins.copy()
+    all_pins.update(contact_pins)
+
+    for pin in values["gpio_pins_for_notification"]:
+        if (pin not in all_pins):
+            errors.append(f"GPIO {pin} in gpio_pins_for_notification is not configured")
+
+    # TOTP secrets are decoded from Base32 once (not on every MFA check), only relays can be MFA protected
+    totp_secrets = {}
+    if (len(values["gpio_pins_for_totp_enabled"]) > 0 or len(values["lan_totp_secrets"]) > 0):
+        from pico_2fa_totp import base32_decode   # Lazy import, TOTP library is not loaded when MFA is disabled
+    for pin in values["gpio_pins_for_totp_enabled"]:
+        name = values["gpio_prefix"] + str(pin)
+        if (pin not in all_relay_pins):
+            errors.append(f"GPIO {pin} in gpio_pins_for_totp_enabled is not a relay")
+            continue
+        totp_secrets[name] = []
+        for secret_key in values["gpio_pins_for_totp_enabled"][pin]:
+            try:
+                totp_secrets[name].append(base32_decode(secret_key))
+            except Exception:
+                errors.append(f"GPIO {pin} TOTP key is not Base32 encoded")
+    lan_totp_secrets = []
+    for secret_key in values["lan_totp_secrets"]:
+        try:
+            lan_totp_secrets.append(base32_decode(secret_key))
+        except Exception:
+            errors.append("lan_totp_secrets key is not Base32 encoded")
+
+    automation_rules = compile_automation_rules(errors, values["automation_rules"], contact_pins, all_relay_pins, all_pins, values["gpio_prefix"])
+    relay_schedules = ()
+    if (len(values["relay_schedules"]) > 0):
+        from mqtt_tiny_controller_schedule import compile_schedules   # Lazy import, schedule library is not loaded without schedules
+        relay_schedules, schedule_errors = compile_schedules(values["relay_schedules"], all_relay_pins, values["gpio_prefix"], values["schedules_max"])
+        errors.extend(["relay_schedules: " + x for x in schedule_errors])
+    brokers = compile_brokers(errors, values)
+
+    if (len(errors) > 0):
+        raise ValueError("Invalid config: " + "; ".join(errors))
+
+    # Precomputed tables
+    values["relay_pins"] = tuple(sorted(all_relay_pins))   # Relays and momentary relays
+    values["momentary_relay_waits"] = momentary_relay_waits   # {GPIO_ID: WAIT_IN_SECONDS}
+    values["contact_pins"] = tuple(sorted(contact_pins))
+    values["all_pins"] = tuple(sorted(all_pins))   # Sorted by GPIO number (not "GP1", "GP16", "GP2")
+    values["gpio_names"] = dict([(x, values["gpio_prefix"] + str(x)) for x in all_pins])   # e.g. {16: "GP16"}
+    values["gpio_pins"] = dict([(values["gpio_prefix"] + str(x), x) for x in all_pins])    # e.g. {"GP16": 16}
+    values["notification_pins"] = set(values["gpio_pins_for_notification"])
+    values["totp_secrets"] = totp_secrets   # e.g. {"GP16": [b"..."]}
+    values["lan_totp_secrets"] = tuple(lan_totp_secrets)   # e.g. (b"...",)
+    values["automation_rules"] = automation_rules   # Index by trigger GPIO, e.g. {0: ((0, 0, "GP18", 1, 0, 60000, ()),)}
+    values["compiled_relay_schedules"] = relay_schedules   # e.g. ((0, 390, 31, "GP16", 1),) for GP16 on at 06:30 on weekdays
+    values["brokers"] = brokers   # broker_server and broker_failover_servers, e.g. (("xxx.hivemq.cloud", 8883, "user", "pass", 0),)
+    values["response_keys"] = set([values["ip_keyname"], values["notification_keyname"], values["time_keyname"], values["metrics_keyname"]])
+    values["mqtt_topic_bytes"] = values["mqtt_topic"].encode()
+    values["mqtt_binary_topic_bytes"] = values["mqtt_binary_topic"].encode() if values["mqtt_binary_topic"] else None
+    values["mqtt_client_id_text"] = values["mqtt_client_id"].decode("utf-8")
+    values["wifi_ssid_bytes"] = values["wifi_ssid"].encode("utf-8")
+    return CompiledConfig(values)
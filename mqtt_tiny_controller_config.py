@@ -1,70 +1,171 @@
-# Wifi and Broker settings
-wifi_ssid = "xxxxxxxxxxxxxxxxxxx"
-wifi_pass = "yyyyyyyyyyyyyyyyyyy"
-wifi_max_retries = 30   # Max retries for first time starting up to connect Wifi after initial powered up
-wifi_reset_delay_in_seconds = 600  # Sleep for 10 minutes (600 seconds) if wifi has permanently failed after wifi_max_retries
-broker_server = "zzzzzzzzzzzzzzz.hivemq.cloud"
-broker_user = "aaaaaaaa"
-broker_pass = "bbbbbbbb"
-
-# Mqtt and GPIO settings
-mqtt_topic = "topicname/actionname"
-mqtt_client_id = b"uniqueclient1234"  # Do not remove b in front, it's to encode client_id to byte
-mqtt_qos = 1  # Use QoS1 for auto message recovery
-mqtt_retain = False # Always DO NOT use Retain message
-mqtt_clean = False  # Set this to False (clear session) for reconnection to work Qos1 message recovery during outage
-gpio_prefix = "GP"   # use it on JSON message as key (e.g. "GP15" = GPIO Pin 15)
-
-# Safeguard to stop publishing forever (until hardware reset) if it publishes exceeding x times in y seconds
-publish_counter_max = 20
-publish_threshold_in_seconds = 10
-
-# Safeguard to protect hardware from massive number of messages flooding the device after disconnect and then reconnect with QoS1
-hardware_modified_cooldown_period_in_seconds = 2
-
-# Safeguard to protect hardware from excessive x number of connections in y seconds, resets counter to 0 after y seconds
-hardware_modified_max = 5
-hardware_modified_threshold_in_seconds = 60
-hardware_violation_max = 3  # Hardware PIN will stop changing value if it exceeded x number of violation, ref: GpioHardwareViolationCounter {}
-
-# Publishing to broker with existing status even nothing changes
-scheduled_publish_in_seconds = 7200  # broadcast every 120min, -1 disable scheduled publish
-
-# Momentary Switch closes after x seconds
-momentary_switch_default_wait_in_seconds = 2
-
-# Define the physical GPIO PIN number on the PicoW board
-gpio_pins_for_relay_switch = {16, 17}           # {[GPIO ID]}: List of GPIO IDs regular relay switches
-gpio_pins_for_momentary_relay_switch = {18:2, 19:2}  # {[GPIO ID]}: List of GPIO IDs relay switches and make them into momentary relay, {GPIO_ID:WAIT_IN_SECONDS}
-gpio_pins_for_contact_switch = {0, 1, 2, 3}     # {[GPIO ID]}: List of GPIO IDs for Normally Open (NO) contact switches such as magnetic contact
-
-# Additional features 
-command_keyname = "CMD"   # Request commands in JSON:  e.g {"CMD": "stats"} to check device status)
-commands = {"stats":501, "refresh":502, "getip":503, "ntp":504}  # Use dict as enum without hardcoding
-json_ip_provider = "https://jsonip.com" # Returns device public IP address in JSON format
-ip_keyname = "IP"   # Response in JSON, {"IP":"111.222.333.444"}
-time_keyname = "TIME" # Time in UTC/local for microcontroller response, e.g. {"GP26": 1, "GP27": 1, "TIME": "2030-01-15 00:37:39 UTC"}
-time_zone_name = "EST"  # Only support "UTC" and "EST" (EST supports DST auto switch, implement your own time zone in _common.py lib)
-
-# Notification
-notification_keyname = "NOTIFY"   # Response in JSON, e.g. {"NOTIFY": {"GP16": 1, "GP17": 0}}
-gpio_pins_for_notification = {0, 1, 16, 17}   # Only send notification when GPIO values are changed
-
-# NTP clock sync for RTC (Real time clock)
-scheduled_clock_sync_in_seconds = 86400  # sync everyday (86400 sec), -1 disable clock sync. Need to enable sync if MFA (TOTP) is used
-forced_clock_sync_wait_in_seconds = 180  # forced ntp sync wait (180 sec, 3 min) before next sync command e.g. {"CMD":"ntp"} is allowed, -1 disable force NTP sync
-default_clock_year_in_unix_timestamp = 1609459200 # picoW default clock 2021-01-01 00:00:00 UTC. This is for auto NTP sync.
-
-# Multi-factor authentication (MFA) using Time-based One-time password (TOTP)
-totp_keyname = "MFA"  # Request command "MFA" is easier to type than "TOTP", e.g. {"MFA": 123456}
-totp_max_expired_codes = 5   #  Allow x number of expired code due to different clocks between devices are not sync perfectly
-
-# To disable MFA, use an empty list
-gpio_pins_for_totp_enabled = {}
-
-# Only configure for PINs with mode=Pin.OUT that can be changed by MQTT message, e.g. Relays
-# Note: You need to ENCODE your secret key with Base32 encoding online tool before copy-paste here:
-#gpio_pins_for_totp_enabled = {16: ["ONSWG4TFOQQHI33UOAQGG3DJMVXHIIBR", "MNWGSZLOOQQDEIDTMVRXEZLU"],
-#                              17: ["ONSWG4TFOQQHI33UOAQGG3DJMVXHIIBR", "MNWGSZLOOQQDEIDTMVRXEZLU"],
-#                              18: ["ONSWG4TFOQQHI33UOAQGG3DJMVXHIIBR"],
+# Wifi and Broker settings
+wifi_ssid = "xxxxxxxxxxxxxxxxxxx"
+wifi_pass = "yyyyyyyyyyyyyyyyyyy"
+wifi_max_retries = 30   # Max retries for first time starting up to connect Wifi after initial powered up
+wifi_reset_delay_in_seconds = 600  # Sleep for 10 minutes (600 seconds) if wifi has permanently failed after wifi_max_retries
+broker_server = "zzzzzzzzzzzzzzz.hivemq.cloud"
+broker_user = "aaaaaaaa"
+broker_pass = "bbbbbbbb"
+broker_port = 8883   # MQTT over TLS
+broker_dns_ttl_in_seconds = 3600   # Broker address is looked up again after a successful reconnect after x seconds (DNS blocks, never during an outage), the last good address is used if DNS fails, 0 only once
+# Note: TLS session resumption on reconnect is inactive on PicoW, MicroPython ussl has no sessions (every reconnect is a full handshake), it only works in host_sim with CPython ssl
+
+# Broker failover (optional): backup brokers used when broker_server is down, e.g. a self hosted Mosquitto as backup of the HiveMQ cluster.
+# Each is a dict: {"server": "192.168.1.10", "port": 8883, "user": "xxx", "password": "yyy", "priority": 1}, broker_server has priority 0 (preferred).
+# port (8883), user and password (broker_user, broker_pass) and priority (1) can be omitted. Commands and status use the same topics on every broker.
+broker_failover_servers = []
+broker_failover_after_failures = 3      # Switch to the next broker after x failed connects in a row
+broker_failback_probe_in_seconds = 300  # While a backup broker is used, the preferred broker is probed (TCP connect to its cached address, no DNS lookup) every x seconds and used again when it answers, -1 disable
+broker_probe_timeout_in_ms = 3000
+
+# Mqtt and GPIO settings
+mqtt_topic = "topicname/actionname"
+mqtt_client_id = b"uniqueclient1234"  # Do not remove b in front, it's to encode client_id to byte
+mqtt_qos = 1  # Use QoS1 for auto message recovery
+mqtt_response_qos = 1  # QoS of command responses (stats, getip, metrics, SINCE, SCHEDULE, MFA errors), GPIO status and notifications use mqtt_qos
+mqtt_log_qos = 1       # QoS of logs and diagnostics, 0 saves a PUBACK round trip per log line (lost during outages), they are published after state and responses
+mqtt_retain = False # Always DO NOT use Retain message
+mqtt_clean = False  # Set this to False (clear session) for reconnection to work Qos1 message recovery during outage
+gpio_prefix = "GP"   # use it on JSON message as key (e.g. "GP15" = GPIO Pin 15)
+
+# Optional binary payloads (see mqtt_tiny_controller_codec.py): GPIO status as type, flags, values, pins, epoch and SEQ (18 bytes), commands as opcodes
+mqtt_binary_topic = ""   # e.g. "topicname/actionname/bin" to publish status and accept commands in binary on this topic, "" disable (JSON only)
+mqtt_json_status_enabled = True   # False to publish GPIO status only on mqtt_binary_topic (logs and responses stay JSON on mqtt_topic)
+
+# Optional retained state snapshot: full GPIO status is published with the retain flag on a separate topic (only when values change),
+# new clients get it from the broker without sending "refresh". The last will clears it (empty retained message) when the device goes offline.
+mqtt_state_topic = ""   # e.g. "topicname/actionname/state", "" disable (the last will stays "Disconnected for ClientID" on mqtt_topic)
+
+# Safeguard to limit publishing to x times in y seconds (token bucket), publishes over the limit are held and sent together when allowed
+# GPIO status has its own limit, command responses and logs are limited separately and never take its tokens (state never waits behind diagnostics)
+publish_counter_max = 20
+publish_threshold_in_seconds = 10
+publish_diagnostic_counter_max = 20   # Command responses and logs published in publish_threshold_in_seconds
+publish_lockout_enabled = False   # True to stop publishing forever (until hardware reset) if it publishes exceeding x times in y seconds
+log_messages_max = 50   # Max number of log messages waiting to be published, the oldest is dropped
+
+# Safeguard to protect hardware from massive number of messages flooding the device after disconnect and then reconnect with QoS1
+hardware_modified_cooldown_period_in_seconds = 2
+
+# Latest-wins command coalescing: each GPIO keeps only the latest pending command, so a QoS1 backlog replayed after reconnect
+# (e.g. 50 toggles on GP16) results in one hardware write and one status publish
+command_settle_window_in_ms = 2000   # After (re)connect, hold GPIO commands for x ms before applying the latest value per GPIO, 0 disable
+mqtt_queue_len = 10   # Incoming message queue of mqtt_as, messages are discarded (oldest first) if more than x arrive before they are processed
+
+# Command executor for stats, getip, ntp and metrics: x worker tasks with y waiting commands, one pending command per type
+command_workers = 1     # Number of commands running at the same time (e.g. wlan.scan for stats blocks the event loop)
+command_queue_len = 4   # Max number of waiting commands, commands are rejected (counter "commands_rejected") if the queue is full
+
+# Safeguard to protect hardware from excessive x number of changes in y seconds (token bucket per relay: burst of x, then one change every y/x seconds)
+# Changes over the limit are deferred, the latest command per relay is applied when the relay is allowed to change again
+hardware_modified_max = 5
+hardware_modified_threshold_in_seconds = 60
+hardware_lockout_enabled = False   # True to permanently disable a relay (until hardware reset) when it exceeded hardware_violation_max
+hardware_violation_max = 3  # Hardware PIN will stop changing value if it exceeded x number of violation (only with hardware_lockout_enabled)
+
+# Publishing to broker with existing status even nothing changes
+scheduled_publish_in_seconds = 7200  # broadcast every 120min, -1 disable scheduled publish
+
+# Momentary Switch closes after x seconds
+momentary_switch_default_wait_in_seconds = 2
+
+# Define the physical GPIO PIN number on the PicoW board
+gpio_pins_for_relay_switch = {16, 17}           # {[GPIO ID]}: List of GPIO IDs regular relay switches
+gpio_pins_for_momentary_relay_switch = {18:2, 19:2}  # {[GPIO ID]}: List of GPIO IDs relay switches and make them into momentary relay, {GPIO_ID:WAIT_IN_SECONDS}
+gpio_pins_for_contact_switch = {0, 1, 2, 3}     # {[GPIO ID]}: List of GPIO IDs for Normally Open (NO) contact switches such as magnetic contact
+
+# Additional features 
+command_keyname = "CMD"   # Request commands in JSON:  e.g {"CMD": "stats"} to check device status)
+commands = {"stats":501, "refresh":502, "getip":503, "ntp":504, "metrics":505}  # Use dict as enum without hardcoding
+json_ip_provider = "https://jsonip.com" # Returns device public IP address in JSON format
+ip_keyname = "IP"   # Response in JSON, {"IP":"111.222.333.444"}
+time_keyname = "TIME" # Time in UTC/local for microcontroller response, e.g. {"GP26": 1, "GP27": 1, "TIME": "2030-01-15 00:37:39 UTC"}
+time_zone_name = "EST"  # Only support "UTC" and "EST" (EST supports DST auto switch, implement your own time zone in _common.py lib)
+
+# Sequence number on GPIO status publish, e.g. {"GP16": 1, "SEQ": 7, "TIME": "..."}. A client that sees a gap (e.g. SEQ 5 then 7) requests {"SINCE": 5}
+seq_keyname = "SEQ"
+since_keyname = "SINCE"   # Response is the merged changes after SEQ 5, e.g. {"GP16": 1, "SEQ": 7, "SINCE": 5, "TIME": "..."}, or a full publish if SEQ 5 is too old
+state_history_len = 16    # Number of recent publishes kept in memory for {"SINCE": N}
+
+# Metrics (counters, gauges and latency histograms), request with {"CMD": "metrics"}
+metrics_keyname = "METRICS"   # Response in JSON, e.g. {"METRICS": {"C": {...}, "G": {...}, "H": {"puback_rtt_ms": [count, avg, p50, p90, p99, max]}}}
+scheduled_metrics_publish_in_seconds = -1  # publish metrics every x seconds (e.g. 3600), -1 disable scheduled metrics publish
+
+# Event loop lag monitor and task timing, reported in stats and metrics
+loop_lag_monitor_period_in_ms = 1000  # measure event loop scheduling lag every x ms, -1 disable lag monitor
+task_profiling_enabled = False  # True to record run time and max single step duration of controller tasks (small overhead on every step)
+
+# GPIO backend for reading and setting pins
+gpio_backend_name = "auto"   # "auto" (SIO registers on RP2040, Pin objects on other boards), "sio" or "pin" (one Pin object per GPIO)
+
+# Persistent state journal on flash (see mqtt_tiny_controller_journal.py): relay states and counters (outages, SEQ, burnout violations,
+# last clock sync) are restored in init() after a power blip, instead of turning all relays off. Momentary relays always start off.
+journal_enabled = False
+journal_file_prefix = "/mqtt_journal"   # Files /mqtt_journal_a.log and /mqtt_journal_b.log (A/B compaction)
+journal_flush_interval_in_seconds = 30   # At most one flash write every x seconds, changes in between are written as one record
+journal_max_bytes = 4096   # Compact the journal into the other file when the active file is larger than x bytes
+
+# Optional second core service (RP2040, _thread, see mqtt_tiny_controller_core1.py): core 1 samples and debounces the contact switches and
+# precomputes TOTP codes, core 0 (event loop) reads them from lock protected ring buffers, so an MFA check is a lookup instead of SHA1 on the event loop
+core1_enabled = False
+core1_sample_period_in_ms = 5   # Contact switches are sampled every x ms on core 1
+gpio_debounce_in_ms = 20        # A contact switch change is used when the level is stable for x ms, 0 disable debounce
+core1_ring_len = 16             # Size of the ring buffers between core 1 and core 0, the oldest item is dropped if core 0 falls behind
+
+# Optional LAN control endpoint (see mqtt_tiny_controller_lan.py): TCP server accepting the same JSON commands, one per line, from clients on the
+# same network. Relays are controlled without the cloud broker (also when the internet is down), changes are still published to the broker when it's reachable.
+# Every line needs a TOTP code of lan_totp_secrets in "MFA" (no TLS or broker login on LAN), relays in gpio_pins_for_totp_enabled also check their own keys.
+# Lines are plaintext: a code is bound to the connection that used it first until it expires (a sniffed code cannot be replayed on another connection),
+# so a second LAN client in the same 30 seconds step waits for the next code.
+lan_enabled = False
+lan_port = 8765
+lan_totp_secrets = []   # Base32 encoded keys accepted on LAN, e.g. ["ONSWG4TFOQQHI33UOAQGG3DJMVXHIIBR"], required when lan_enabled is True
+lan_max_clients = 2     # Connections over the limit are closed right away
+lan_idle_timeout_in_seconds = 60   # Close a connection without any line for x seconds
+lan_max_line_bytes = 256   # Close a connection sending a longer line
+lan_mfa_max_failures = 5   # Close a connection after x bad TOTP codes and reject all LAN codes for lan_mfa_backoff_in_seconds (brute force of the 6 digits)
+lan_mfa_backoff_in_seconds = 60
+lan_error_keyname = "ERROR"   # LAN response for a rejected line, e.g. {"ERROR": "MFA", "TIME": "..."} ("JSON" if it's not a JSON object)
+
+# On-device automation rules: a contact switch change switches a relay right away, without a client subscribed to the topic (also during outages).
+# Rule keys: "trigger" contact switch GPIO, "when" new value of the trigger (0 or 1, omit for any change), "action" relay GPIO, "value" 0 or 1 (default 1,
+# a momentary relay is pressed), optional "delay_in_seconds", "min_interval_in_seconds" (rate limit per rule) and "if" {GPIO_ID: VALUE} conditions.
+# Actions go through the same burnout protection as MQTT commands, fired rules are logged (once per hardware_modified_threshold_in_seconds per rule).
+automation_rules = []
+#automation_rules = [{"trigger": 0, "when": 0, "action": 18, "value": 1, "min_interval_in_seconds": 60},       # GP0 door contact opens -> press GP18
+#                    {"trigger": 1, "when": 1, "action": 16, "value": 0, "delay_in_seconds": 30, "if": {17: 1}}]   # GP1 closes -> GP16 off after 30s if GP17 is on
+automation_poll_period_in_ms = 50   # Trigger contact switches are checked every x ms for changes (debounced on core 1 if core1_enabled)
+
+# On-device relay schedules (see mqtt_tiny_controller_schedule.py): local time (time_zone_name) per relay, run without a cloud cron (also during outages).
+# Schedule keys: "at" "HH:MM", "days" 0 (Monday) to 6 (Sunday) (omit for every day), "action" relay GPIO, "value" 0 or 1 (default 1).
+# The command {"SCHEDULE": [...]} replaces them (saved to schedule_file and used after restart), {"SCHEDULE": "get"} logs the active schedules.
+# Schedules only run when the clock is synced (NTP), actions go through the same burnout protection as MQTT commands.
+relay_schedules = []
+#relay_schedules = [{"at": "06:30", "days": [0, 1, 2, 3, 4], "action": 16, "value": 1},   # GP16 on at 06:30 on weekdays
+#                   {"at": "22:00", "action": 16, "value": 0}]                            # GP16 off at 22:00 every day
+schedule_keyname = "SCHEDULE"
+schedule_file = "/mqtt_schedules.json"   # Schedules received by command, "" to keep them only until restart
+schedules_max = 16
+
+# Notification
+notification_keyname = "NOTIFY"   # Response in JSON, e.g. {"NOTIFY": {"GP16": 1, "GP17": 0}}
+gpio_pins_for_notification = {0, 1, 16, 17}   # Only send notification when GPIO values are changed
+
+# NTP clock sync for RTC (Real time clock)
+scheduled_clock_sync_in_seconds = 86400  # sync everyday (86400 sec), -1 disable clock sync. Need to enable sync if MFA (TOTP) is used
+forced_clock_sync_wait_in_seconds = 180  # forced ntp sync wait (180 sec, 3 min) before next sync command e.g. {"CMD":"ntp"} is allowed, -1 disable force NTP sync
+default_clock_year_in_unix_timestamp = 1609459200 # picoW default clock 2021-01-01 00:00:00 UTC. This is for auto NTP sync.
+
+# Multi-factor authentication (MFA) using Time-based One-time password (TOTP)
+totp_keyname = "MFA"  # Request command "MFA" is easier to type than "TOTP", e.g. {"MFA": 123456}
+totp_max_expired_codes = 5   #  Allow x number of expired code due to different clocks between devices are not sync perfectly
+
+# To disable MFA, use an empty list
+gpio_pins_for_totp_enabled = {}
+
+# Only configure for PINs with mode=Pin.OUT that can be changed by MQTT message, e.g. Relays
+# Note: You need to ENCODE your secret key with Base32 encoding online tool before copy-paste here:
+#gpio_pins_for_totp_enabled = {16: ["ONSWG4TFOQQHI33UOAQGG3DJMVXHIIBR", "MNWGSZLOOQQDEIDTMVRXEZLU"],
+#                              17: ["ONSWG4TFOQQHI33UOAQGG3DJMVXHIIBR", "MNWGSZLOOQQDEIDTMVRXEZLU"],
+#                              18: ["ONSWG4TFOQQHI33UOAQGG3DJMVXHIIBR"],
 #                              19: ["ONSWG4TFOQQHI33UOAQGG3DJMVXHIIBR"]}
\ No newline at end of file
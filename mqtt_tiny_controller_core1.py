@@ -0,0 +1,163 @@
+
+# Second core service library for mqtt_tiny_controller (RP2040, _thread runs on core 1)
+# Core 1 samples and debounces the contact switches and precomputes TOTP codes once per 30 seconds step, so core 0 (uasyncio loop with
+# TLS, MQTT and JSON) only reads the results. Both sides talk through fixed-size ring buffers protected by a lock (no allocation per item
+# on core 1 besides the tuples, no unbounded queues). Core 1 never touches the event loop, the relays or the broker.
+# Runs the same way under CPython threads for the host benchmark (python -m host_sim.core1), where the GIL adds contention.
+#
+# e.g.
+#     service = Core1Service(gpio_backend, input_mask, 5, 20, 16, totp_secrets, 5)
+#     service.start()
+#     levels = service.get_input_levels()       # Debounced levels of the contact switches (bitmask)
+#     codes = service.get_totp_codes(secret)    # Current and expired codes, None if core 1 has not computed this step yet
+
+import _thread
+import utime
+
+
+# Fixed-size ring buffer shared by both cores, the oldest item is dropped when it's full (counter "drops")
+class RingBuffer:
+
+    def __init__(self, size):
+        self.items = [None] * size
+        self.size = size
+        self.read_index = 0
+        self.count = 0
+        self.drops = 0
+        self.contentions = 0   # Lock was held by the other core
+        self.lock = _thread.allocate_lock()
+
+    def acquire(self):
+        if (not self.lock.acquire(0)):
+            self.contentions += 1
+            self.lock.acquire()
+
+    def put(self, item):
+        self.acquire()
+        try:
+            self.items[(self.read_index + self.count) % self.size] = item
+            if (self.count == self.size):
+                self.read_index = (self.read_index + 1) % self.size
+                self.drops += 1
+            else:
+                self.count += 1
+        finally:
+            self.lock.release()
+
+    # All items in order, the buffer is empty afterwards, e.g. method() returns [(ticks, levels), ...]
+    def get_all(self):
+        self.acquire()
+        try:
+            result = []
+            for i in range(self.count):
+                index = (self.read_index + i) % self.size
+                result.append(self.items[index])
+                self.items[index] = None
+            self.read_index = 0
+            self.count = 0
+            return result
+        finally:
+            self.lock.release()
+
+
+class Core1Service:
+
+    def __init__(self, gpio_backend, input_mask, sample_period_in_ms=5, debounce_in_ms=20, ring_len=16, totp_secrets=(), totp_max_expired_codes=5):
+        self.gpio_backend = gpio_backend
+        self.input_mask = input_mask
+        self.sample_period_in_ms = sample_period_in_ms
+        self.debounce_in_ms = debounce_in_ms
+        self.gpio_events = RingBuffer(ring_len)   # (ticks_ms, debounced levels) when a contact switch changed
+        self.totp_results = RingBuffer(ring_len)  # (step, secret, codes) once per 30 seconds step
+        self.totp_secrets = list(totp_secrets)
+        self.totp_max_expired_codes = totp_max_expired_codes
+        self.totp_codes = {}   # Core 0 copy, secret -> (step, codes)
+        self.totp_step = -1
+        self.input_levels = 0   # Core 0 copy of the debounced levels
+        self.is_running = False
+        self.is_stopped = True
+        self.samples = 0
+        if (len(self.totp_secrets) > 0):
+            from mqtt_tiny_controller_common import get_totp
+            import pico_2fa_totp   # Import on core 0 before the thread starts
+            self.get_totp = get_totp
+
+    # Start sampling on core 1, the first sample is taken here so get_input_levels() is valid right away
+    def start(self):
+        self.sample_first()
+        self.is_running = True
+        self.is_stopped = False
+        _thread.start_new_thread(self.run, ())
+
+    def stop(self):
+        self.is_running = False
+
+    # Core 1 loop
+    def run(self):
+        try:
+            while self.is_running:
+                self.sample_inputs()
+                if (len(self.totp_secrets) > 0):
+                    self.compute_totp()
+                utime.sleep_ms(self.sample_period_in_ms)
+        finally:
+            self.is_stopped = True
+
+    # First sample without debounce (also used by the host benchmark to call sample_inputs() on a virtual clock without the thread)
+    def sample_first(self):
+        levels = self.gpio_backend.read_inputs() & self.input_mask
+        self.stable_levels = levels
+        self.candidate_levels = levels
+        self.changed_ticks = {}   # Pin bit -> ticks_ms of the last level change (debounce per pin)
+        self.input_levels = levels
+
+    # A pin is stable when its level did not change for debounce_in_ms, only stable changes are sent to core 0
+    def sample_inputs(self):
+        now = utime.ticks_ms()
+        levels = self.gpio_backend.read_inputs() & self.input_mask
+        self.samples += 1
+        changed = levels ^ self.candidate_levels
+        self.candidate_levels = levels
+        bit = 1
+        while changed:
+            if (changed & 1):
+                self.changed_ticks[bit] = now
+            changed >>= 1
+            bit <<= 1
+
+        pending = self.candidate_levels ^ self.stable_levels
+        if (pending == 0):
+            return
+        stable_levels = self.stable_levels
+        for bit in self.changed_ticks:
+            if (pending & bit and utime.ticks_diff(now, self.changed_ticks[bit]) >= self.debounce_in_ms):
+                stable_levels ^= bit
+        if (stable_levels != self.stable_levels):
+            self.stable_levels = stable_levels
+            self.gpio_events.put((now, stable_levels))
+
+    # Codes for all secrets when the 30 seconds step changes (SHA1 in Python takes tens of ms per code on PicoW)
+    def compute_totp(self):
+        step = utime.time() // 30
+        if (step == self.totp_step):
+            return
+        self.totp_step = step
+        for secret in self.totp_secrets:
+            self.totp_results.put((step, secret, self.get_totp(secret, self.totp_max_expired_codes)))
+
+    # Core 0: debounced levels after draining the events, e.g. method(lambda age: ...) to record the event age
+    def get_input_levels(self, event_age_delegate=None):
+        for ticks, levels in self.gpio_events.get_all():
+            self.input_levels = levels
+            if (event_age_delegate is not None):
+                event_age_delegate(utime.ticks_diff(utime.ticks_ms(), ticks))
+        return self.input_levels
+
+    # Core 0: codes of the current step for secret, None if they are not ready (caller computes them itself)
+    def get_totp_codes(self, secret):
+        for step, result_secret, codes in self.totp_results.get_all():
+            self.totp_codes[result_secret] = (step, codes)
+        entry = self.totp_codes.get(secret)
+        if (entry is None or entry[0] != utime.time() // 30):
+            return None
+        return entry[1]
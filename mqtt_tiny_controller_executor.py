@@ -0,0 +1,57 @@
+
+# Command executor library for mqtt_tiny_controller
+# Fixed number of worker tasks with a bounded queue, so a burst of commands (e.g. 50 x {"CMD":"stats"} replayed after an outage)
+# cannot create unbounded tasks. Commands are deduplicated by key: one pending or running "stats", "getip", "ntp" at a time.
+
+import uasyncio as asyncio
+
+
+class CommandExecutor:
+
+    # e.g. CommandExecutor(1, 4, mqtt_metrics) runs one command at a time with up to 4 waiting
+    def __init__(self, workers=1, queue_len=4, metrics=None):
+        self.workers = workers
+        self.queue_len = queue_len
+        self.metrics = metrics
+        self.queue = []   # Waiting commands [(key, async function, args)]
+        self.active_keys = set()   # Keys of waiting and running commands
+        self.event = asyncio.Event()
+
+    def _incr(self, name):
+        if (self.metrics is not None):
+            self.metrics.incr(name)
+
+    # Queue async function call, returns False if rejected (same key is waiting or running, or queue is full)
+    # The coroutine is only created when a worker runs it, rejected commands cost nothing
+    # e.g. method("stats", get_stats) or method("metrics", get_metrics, client)
+    def submit(self, key, func, *args):
+        if (key in self.active_keys):
+            self._incr("commands_deduplicated")
+            return False
+        if (len(self.queue) >= self.queue_len):
+            self._incr("commands_rejected")
+            print(f"Command executor queue is full, command {key} is rejected")
+            return False
+        self.queue.append((key, func, args))
+        self.active_keys.add(key)
+        self.event.set()
+        return True
+
+    async def worker(self):
+        while True:
+            while len(self.queue) == 0:
+                self.event.clear()
+                await self.event.wait()
+            key, func, args = self.queue.pop(0)
+            try:
+                await func(*args)
+            except Exception as e:
+                print(f"Error in command {key}={e}")
+            finally:
+                self.active_keys.discard(key)
+
+    # Start the worker tasks, create_task_delegate(coro, name) is used so the workers can be profiled
+    # e.g. method(create_profiled_task)
+    def start(self, create_task_delegate):
+        for i in range(self.workers):
+            create_task_delegate(self.worker(), "command_worker")
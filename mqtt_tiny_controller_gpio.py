@@ -0,0 +1,94 @@
+
+# GPIO backend library for mqtt_tiny_controller
+# Bulk "read all pins as a bitmask" and "apply set/clear masks" API, so change detection reads the hardware once per round
+# and a multi-relay command ({"GP16": 1, "GP17": 1}) switches all relays with one write.
+# Note: levels are the real pin levels (Pin.PULL_UP: disconnected = 1 and connected = 0), not the flipped human readable values
+
+from machine import Pin
+from sys import platform
+
+
+# Fallback backend using one Pin object per GPIO (works on any MicroPython board)
+class PinGpioBackend:
+
+    def __init__(self):
+        self.pins = {}   # Pin id -> Pin object, created once (not on every write)
+        self.output_mask = 0
+        self.input_mask = 0
+
+    # e.g. method(16, 1) for a relay, value=1 is high voltage (relay off)
+    def setup_output(self, pin_id, level):
+        self.pins[pin_id] = Pin(pin_id, mode=Pin.OUT, value=level)
+        self.output_mask |= 1 << pin_id
+
+    # e.g. method(0) for a contact switch, with a pull up resistor
+    def setup_input(self, pin_id):
+        self.pins[pin_id] = Pin(pin_id, Pin.IN, Pin.PULL_UP)
+        self.input_mask |= 1 << pin_id
+
+    # Level of one pin (0 or 1)
+    def read(self, pin_id):
+        return self.pins[pin_id].value()
+
+    # Levels of all configured pins (inputs and outputs) as bitmask, bit x = level of GPx
+    def read_inputs(self):
+        levels = 0
+        for pin_id in self.pins:
+            if (self.pins[pin_id].value()):
+                levels |= 1 << pin_id
+        return levels
+
+    def write(self, pin_id, level):
+        if (level):
+            self.apply(1 << pin_id, 0)
+        else:
+            self.apply(0, 1 << pin_id)
+
+    # Drive output pins high (set_mask) and low (clear_mask), pins not configured as output are ignored
+    def apply(self, set_mask, clear_mask):
+        for pin_id in self.pins:
+            bit = 1 << pin_id
+            if (set_mask & bit & self.output_mask):
+                self.pins[pin_id].value(1)
+            elif (clear_mask & bit & self.output_mask):
+                self.pins[pin_id].value(0)
+
+
+# RP2040 backend using the SIO registers: all GPIO levels are read from one register and outputs are set/cleared atomically with masks
+# Pins are still configured with Pin objects (function, direction and pull), only reads and writes go through the registers
+class SioGpioBackend(PinGpioBackend):
+    sio_base = 0xd0000000
+    gpio_in = 0x004        # GPIO_IN: input levels of GPIO 0-29
+    gpio_out_set = 0x014   # GPIO_OUT_SET: write 1 to drive output high
+    gpio_out_clr = 0x018   # GPIO_OUT_CLR: write 1 to drive output low
+
+    def __init__(self):
+        super().__init__()
+        from machine import mem32
+        self.mem32 = mem32
+
+    def read(self, pin_id):
+        return (self.mem32[self.sio_base + self.gpio_in] >> pin_id) & 1
+
+    def read_inputs(self):
+        return self.mem32[self.sio_base + self.gpio_in] & (self.input_mask | self.output_mask)
+
+    def apply(self, set_mask, clear_mask):
+        set_mask &= self.output_mask
+        clear_mask &= self.output_mask
+        if (set_mask):
+            self.mem32[self.sio_base + self.gpio_out_set] = set_mask
+        if (clear_mask):
+            self.mem32[self.sio_base + self.gpio_out_clr] = clear_mask
+
+
+# Backend name in config -> class, e.g. host simulation registers "sim"
+gpio_backend_classes = {"pin": PinGpioBackend, "sio": SioGpioBackend}
+
+
+# Create backend by name, "auto" uses SIO registers on RP2040 and Pin objects on other boards
+# e.g. method("auto") returns SioGpioBackend on PicoW
+def create_gpio_backend(name="auto"):
+    if (name == "auto"):
+        name = "sio" if platform == "rp2" else "pin"
+    return gpio_backend_classes[name]()
@@ -0,0 +1,144 @@
+
+# Persistent state journal library for mqtt_tiny_controller
+# Relay states and counters are appended to a file on flash as CRC protected records, and restored in init() after a power blip.
+# One record per line: "<crc32 in hex> <json>", only changed values are appended, e.g. 5f1d2a9c {"GP16": 1, "seq": 42}
+# A torn or corrupted record (e.g. power lost while writing) fails the CRC check and is skipped.
+#
+# Compaction (A/B files): when the active file grows over max_bytes, the merged state is written as the first record of the other
+# file with the next generation number. The old file is removed only after the new one is written, so a power loss during
+# compaction keeps the previous state. Alternating files also spreads the writes (LittleFS on PicoW does its own wear levelling).
+# Flash writes are rate limited (token bucket, one write every flush_interval_in_ms), changes in between are merged into one record.
+#
+# e.g.
+#     journal = StateJournal("/journal", 4096, 30000)
+#     state = journal.load()          # {"GP16": 1, "outages": 3}
+#     journal.update({"GP16": 0})     # Kept in memory until the next flush
+#     journal.flush()                 # Appends one record if a write is allowed, returns True if written
+
+import os, json
+from ubinascii import crc32
+from mqtt_tiny_controller_limiter import TokenBucket
+
+generation_keyname = "_gen"   # First record of a file, e.g. {"_gen": 7, "GP16": 1, ...}
+
+
+class StateJournal:
+
+    def __init__(self, path_prefix, max_bytes=4096, flush_interval_in_ms=30000):
+        self.paths = (path_prefix + "_a.log", path_prefix + "_b.log")
+        self.max_bytes = max_bytes
+        self.write_bucket = TokenBucket(1, flush_interval_in_ms)
+        self.active = 0        # Index of the file records are appended to
+        self.generation = 0    # Generation of the active file, 0 if there is no valid file yet
+        self.size = 0          # Bytes in the active file
+        self.state = {}        # Values written to flash
+        self.pending = {}      # Changed values waiting for the next flush
+        self.writes = 0
+        self.compactions = 0
+        self.corrupt_records = 0
+
+    # Encode record as one line with CRC, e.g. method({"GP16": 1}) returns '5f1d2a9c {"GP16": 1}\n'
+    def encode(self, record):
+        payload = json.dumps(record)
+        return "%08x %s\n" % (crc32(payload.encode()) & 0xffffffff, payload)
+
+    # Decode one line, returns the record or None if the CRC does not match (torn write)
+    def decode(self, line):
+        parts = line.rstrip("\n").split(" ", 1)
+        if (len(parts) != 2 or len(parts[0]) != 8):
+            return None
+        try:
+            if (int(parts[0], 16) != crc32(parts[1].encode()) & 0xffffffff):
+                return None
+            record = json.loads(parts[1])
+        except ValueError:
+            return None
+        return record if isinstance(record, dict) else None
+
+    # Valid records of a file, [] if the file does not exist
+    def read_records(self, path):
+        records = []
+        try:
+            f = open(path, "r")
+        except OSError:
+            return records
+        with f:
+            for line in f:
+                record = self.decode(line)
+                if (record is None):
+                    self.corrupt_records += 1
+                else:
+                    records.append(record)
+        return records
+
+    # Load the newest valid file (highest generation) and merge its records, returns a copy of the state
+    def load(self):
+        best = None
+        for i in range(len(self.paths)):
+            records = self.read_records(self.paths[i])
+            if (len(records) > 0 and generation_keyname in records[0]):   # File is valid only if its compaction record was written
+                if (best is None or records[0][generation_keyname] > best[1]):
+                    best = (i, records[0][generation_keyname], records)
+
+        self.state = {}
+        self.pending = {}
+        self.size = 0
+        if (best is not None):
+            self.active, self.generation, records = best
+            for record in records:
+                self.state.update(record)
+            self.state.pop(generation_keyname, None)
+            try:
+                self.size = os.stat(self.paths[self.active])[6]
+            except OSError:
+                self.size = 0
+        return dict(self.state)
+
+    # Keep changed values for the next flush, e.g. method({"GP16": 1, "outages": 3})
+    def update(self, values):
+        for key in values:
+            if (self.pending.get(key, self.state.get(key)) != values[key]):
+                self.pending[key] = values[key]
+
+    def is_dirty(self):
+        return len(self.pending) > 0
+
+    # Write pending changes as one record (or compact), returns True if written
+    # force=True ignores the rate limit (e.g. before a planned reset), OSError is raised if the flash write fails (changes stay pending for the next flush)
+    def flush(self, force=False):
+        if (len(self.pending) == 0):
+            return False
+        if (not force and not self.write_bucket.consume()):
+            return False
+        record = self.pending
+        if (self.size == 0 or self.size > self.max_bytes):
+            self.compact(record)   # No valid file yet (first write or corrupted files) or the active file is full
+        else:
+            line = self.encode(record)
+            with open(self.paths[self.active], "a") as f:
+                f.write(line)
+            self.size += len(line)
+        self.state.update(record)   # Only after the write succeeded
+        self.pending = {}
+        self.writes += 1
+        return True
+
+    # Write the merged state with the pending changes to the other file with the next generation, then remove the old file
+    def compact(self, pending=None):
+        next_active = 1 - self.active
+        record = {generation_keyname: self.generation + 1}
+        record.update(self.state)
+        if (pending is not None):
+            record.update(pending)
+        line = self.encode(record)
+        with open(self.paths[next_active], "w") as f:
+            f.write(line)
+        old_path = self.paths[self.active]
+        self.active = next_active
+        self.generation += 1
+        self.size = len(line)
+        self.compactions += 1
+        try:
+            os.remove(old_path)
+        except OSError:
+            pass   # First compaction, there is no old file
@@ -0,0 +1,110 @@
+
+# LAN control endpoint library for mqtt_tiny_controller
+# TCP server on the device for clients on the same network, the same JSON commands as on mqtt_topic, one per line (e.g. {"GP16": 1, "MFA": 123456}).
+# Commands do not take the round trip through the cloud broker (no internet RTT or TLS), and relays can still be controlled when the internet
+# is down but Wi-Fi is up. Each line is answered with one JSON line built by the handler (e.g. the full GPIO status after the command).
+# Connections are limited to max_clients, idle connections are closed after idle_timeout_in_ms, a line over max_line_bytes closes the connection
+# (lines are read in chunks of at most max_line_bytes, MicroPython StreamReader.readline has no size limit). The handler gets the LanConnection
+# of the line, e.g. to bind a TOTP code to the connection that used it first, and closes the connection after the response with is_closing.
+#
+# e.g.
+#     server = LanServer(8765, 2, 60000, 256, metrics)
+#     await server.start(handler)    # handler(line, connection) returns the response line (str), e.g. '{"GP16": 1, ..., "TIME": "..."}'
+#     server.close()
+
+import uasyncio as asyncio
+
+
+# State of one client connection, kept by the handler
+class LanConnection:
+
+    def __init__(self, number):
+        self.number = number      # Connection number since start, unique per connection
+        self.mfa_failures = 0     # Lines with a bad TOTP code on this connection
+        self.is_closing = False   # Set by the handler to close the connection after the response
+
+
+class LanServer:
+
+    def __init__(self, port, max_clients=2, idle_timeout_in_ms=60000, max_line_bytes=256, metrics=None):
+        self.port = port
+        self.max_clients = max_clients
+        self.idle_timeout_in_ms = idle_timeout_in_ms
+        self.max_line_bytes = max_line_bytes
+        self.metrics = metrics
+        self.handler = None
+        self.server = None
+        self.clients = 0
+        self.connections = 0   # Connection number of the last accepted connection
+
+    def incr(self, name):
+        if (self.metrics is not None):
+            self.metrics.incr(name)
+
+    # Listen on all interfaces, raises OSError if the port cannot be used
+    async def start(self, handler):
+        self.handler = handler
+        self.server = await asyncio.start_server(self.serve, "0.0.0.0", self.port)
+
+    def close(self):
+        if (self.server is not None):
+            self.server.close()
+            self.server = None
+
+    # One task per connection, lines are handled in order
+    async def serve(self, reader, writer):
+        if (self.clients >= self.max_clients):
+            self.incr("lan_rejected")
+            await self.close_writer(writer)
+            return
+        self.clients += 1
+        self.connections += 1
+        connection = LanConnection(self.connections)
+        self.incr("lan_connections")
+        try:
+            buffer = b""   # Received bytes after the last line
+            while not connection.is_closing:
+                try:
+                    line, buffer = await asyncio.wait_for_ms(self.read_line(reader, buffer), self.idle_timeout_in_ms)
+                except asyncio.TimeoutError:
+                    self.incr("lan_timeouts")
+                    break
+                if (line is None):
+                    self.incr("lan_rejected")
+                    break   # Too long or incomplete (connection closed in the middle of a line)
+                if (not line):
+                    break   # Closed by the client
+                line = line.strip()
+                if (len(line) == 0):
+                    continue
+                self.incr("lan_commands")
+                writer.write(self.handler(line, connection).encode() + b"\n")
+                await writer.drain()
+        except Exception as e:
+            print(f"Error in LAN connection={e}")
+        finally:
+            self.clients -= 1
+            await self.close_writer(writer)
+
+    # Next line with its newline and the bytes after it, reads at most max_line_bytes per line
+    # e.g. method(reader, b"") returns (b'{"GP16": 1}\n', b""), (b"", b"") if closed by the client, (None, b"") if the line is too long or incomplete
+    async def read_line(self, reader, buffer):
+        while True:
+            index = buffer.find(b"\n")
+            if (index >= 0):
+                if (index + 1 > self.max_line_bytes):
+                    return None, b""
+                return buffer[:index + 1], buffer[index + 1:]
+            if (len(buffer) >= self.max_line_bytes):
+                return None, b""
+            chunk = await reader.read(self.max_line_bytes - len(buffer))
+            if (not chunk):
+                return (b"" if len(buffer) == 0 else None), b""
+            buffer += chunk
+
+    async def close_writer(self, writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
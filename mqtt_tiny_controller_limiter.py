@@ -0,0 +1,45 @@
+
+# Rate limiter library for mqtt_tiny_controller
+# Token bucket with O(1) checks: up to "capacity" actions in a burst, then one action every "refill_interval_in_ms".
+# Tokens are refilled lazily from ticks_ms() when the bucket is checked, no task or timer is needed.
+
+import utime
+
+
+class TokenBucket:
+
+    # e.g. TokenBucket(5, 12000) allows 5 relay changes at once, then one change every 12 seconds (5 changes per minute)
+    # tokens is the initial number of tokens, e.g. 0 to start empty (default is full)
+    def __init__(self, capacity, refill_interval_in_ms, tokens=None):
+        self.capacity = capacity
+        self.refill_interval_in_ms = max(1, int(refill_interval_in_ms))
+        self.tokens = capacity if tokens is None else tokens
+        self.last_refill_ticks = utime.ticks_ms()
+
+    def refill(self):
+        now = utime.ticks_ms()
+        elapsed = utime.ticks_diff(now, self.last_refill_ticks)
+        if (elapsed < 0 or elapsed >= self.capacity * self.refill_interval_in_ms):
+            self.tokens = self.capacity   # Idle long enough to be full (also covers ticks wrap around after days of idle)
+            self.last_refill_ticks = now
+        elif (elapsed >= self.refill_interval_in_ms):
+            refilled = elapsed // self.refill_interval_in_ms
+            self.tokens = min(self.capacity, self.tokens + refilled)
+            self.last_refill_ticks = utime.ticks_add(self.last_refill_ticks, refilled * self.refill_interval_in_ms)   # Keep the remainder
+            if (self.tokens == self.capacity):
+                self.last_refill_ticks = now
+
+    # Take n tokens if available, e.g. method() returns False if the bucket is empty
+    def consume(self, n=1):
+        self.refill()
+        if (self.tokens >= n):
+            self.tokens -= n
+            return True
+        return False
+
+    # Time until the next token is available, 0 if a token is available now
+    def get_wait_in_ms(self):
+        self.refill()
+        if (self.tokens >= 1):
+            return 0
+        return max(1, self.refill_interval_in_ms - utime.ticks_diff(utime.ticks_ms(), self.last_refill_ticks))
@@ -0,0 +1,198 @@
+
+# Metrics library for mqtt_tiny_controller
+# Compact fixed-bucket counters, gauges and histograms, small enough to keep running 24/7 on PicoW
+
+import utime
+import uasyncio as asyncio
+from array import array
+
+# Number of log2 buckets in a histogram. Bucket 0 holds value 0, bucket i holds values in [2^(i-1), 2^i)
+# e.g. with 20 buckets, the last bucket holds everything >= 262144 (ms or us depending on metric name)
+histogram_buckets = 20
+
+
+# Histogram with log-scaled buckets stored in array, memory usage is fixed regardless of number of samples
+class Histogram:
+
+    def __init__(self, buckets=histogram_buckets):
+        self.counts = array('L', [0] * buckets)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    # Record one sample (int, negative values are treated as 0)
+    # e.g. method(35) adds 35 to bucket 6 (values 32-63)
+    def observe(self, value):
+        value = int(value)
+        if (value < 0):
+            value = 0
+        index = value.bit_length()
+        if (index >= len(self.counts)):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if (value > self.max):
+            self.max = value
+
+    # Estimate percentile using upper bound of the bucket, capped by max value seen
+    # e.g. method(90) returns 63 if 90% of the samples are below 64
+    def percentile(self, p):
+        if (self.count == 0):
+            return 0
+        target = (self.count * p + 99) // 100
+        running = 0
+        for i in range(len(self.counts)):
+            running += self.counts[i]
+            if (running >= target):
+                upper = (1 << i) - 1 if i > 0 else 0
+                return min(upper, self.max)
+        return self.max
+
+    # Summary list for JSON: [count, avg, p50, p90, p99, max]
+    def summary(self):
+        avg = self.total // self.count if self.count > 0 else 0
+        return [self.count, avg, self.percentile(50), self.percentile(90), self.percentile(99), self.max]
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+# Timing stats for a profiled coroutine, aggregated by task name (e.g. many get_stats tasks)
+class TaskStats:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.steps = 0      # Number of times the event loop resumed the task
+        self.total_us = 0   # Cumulative run time (time between resume and next await)
+        self.max_us = 0     # Maximum single step duration, i.e. how long the task blocked the event loop
+
+    def record(self, duration_us):
+        self.steps += 1
+        self.total_us += duration_us
+        if (duration_us > self.max_us):
+            self.max_us = duration_us
+
+
+# Wrap a coroutine to time each step, works with both uasyncio and CPython asyncio since both drive tasks with send() and throw()
+# e.g. asyncio.create_task(TimedCoroutine(get_stats(), task_stats))
+class TimedCoroutine:
+
+    def __init__(self, coro, stats):
+        self.coro = coro
+        self.stats = stats
+
+    def __await__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+    def send(self, value):
+        start_time = utime.ticks_us()
+        try:
+            return self.coro.send(value)
+        finally:
+            self.stats.record(utime.ticks_diff(utime.ticks_us(), start_time))
+
+    def throw(self, *args):
+        start_time = utime.ticks_us()
+        try:
+            return self.coro.throw(*args)
+        finally:
+            self.stats.record(utime.ticks_diff(utime.ticks_us(), start_time))
+
+    def close(self):
+        return self.coro.close()
+
+
+# Registry to hold all the counters, gauges and histograms by name
+# Metric names ending with "_ms" or "_us" indicate the unit of the histogram
+class MetricsRegistry:
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.tasks = {}
+
+    # Increase counter by n, e.g. method("queue_discards")
+    def incr(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # Set gauge to latest value, e.g. method("mem_alloc", 12345)
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    # Add a sample to histogram, histogram is created on first use, e.g. method("puback_rtt_ms", 120)
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if (histogram is None):
+            histogram = Histogram()
+            self.histograms[name] = histogram
+        histogram.observe(value)
+
+    # Wrap coroutine with timing hooks, stats are aggregated by name, e.g. method(get_stats(), "get_stats")
+    def profile(self, coro, name):
+        stats = self.tasks.get(name)
+        if (stats is None):
+            stats = TaskStats()
+            self.tasks[name] = stats
+        return TimedCoroutine(coro, stats)
+
+    # Get the slowest tasks sorted by maximum single step duration
+    # e.g. method(2) returns [("get_stats", TaskStats), ("messages", TaskStats)]
+    def get_slowest_tasks(self, n=3):
+        items = []
+        for name in self.tasks:
+            items.append((name, self.tasks[name]))
+        items.sort(key=lambda item: item[1].max_us, reverse=True)
+        return items[:n]
+
+    def get_counter(self, name):
+        return self.counters.get(name, 0)
+
+    def get_histogram(self, name):
+        return self.histograms.get(name)
+
+    # Compact dictionary for JSON publish, histograms are in [count, avg, p50, p90, p99, max]
+    # Profiled tasks (slowest first) are in [steps, total_ms, max_step_us]
+    # e.g. {"C": {"queue_discards": 2}, "G": {"mem_alloc": 12345}, "H": {"puback_rtt_ms": [10, 85, 63, 127, 127, 120]}, "T": {"get_stats": [3, 2400, 810000]}}
+    def snapshot(self, slowest_tasks=5):
+        histograms = {}
+        for name in self.histograms:
+            histograms[name] = self.histograms[name].summary()
+        snapshot = {"C": self.counters, "G": self.gauges, "H": histograms}
+        if (len(self.tasks) > 0):
+            tasks = {}
+            for name, stats in self.get_slowest_tasks(slowest_tasks):
+                tasks[name] = [stats.steps, stats.total_us // 1000, stats.max_us]
+            snapshot["T"] = tasks
+        return snapshot
+
+    def reset(self):
+        self.counters = {}
+        self.gauges = {}
+        for name in self.histograms:
+            self.histograms[name].reset()
+        for name in self.tasks:
+            self.tasks[name].reset()   # Keep the same instance, running TimedCoroutine holds a reference
+
+
+# Event loop lag monitor, sleeps for a fixed period and records how late it was woken up
+# Blocking calls (urequests, ntptime, wlan.scan, TOTP SHA1) show up as lag in histogram "loop_lag_ms"
+async def loop_lag_monitor(registry, period_in_ms):
+    while True:
+        start_time = utime.ticks_ms()
+        await asyncio.sleep_ms(period_in_ms)
+        lag = utime.ticks_diff(utime.ticks_ms(), start_time) - period_in_ms
+        registry.observe("loop_lag_ms", lag)
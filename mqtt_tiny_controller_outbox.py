@@ -0,0 +1,60 @@
+# Priority outbox library for mqtt_tiny_controller
+# Outbound messages by priority class: state (GPIO status, retained snapshot, notifications) before command responses (stats, getip, SINCE, ...)
+# before logs and diagnostics. One publisher task takes the oldest message of the most urgent class, so a state change queued while a log line
+# is in flight goes out next instead of after the log backlog. Each class has its own QoS (e.g. logs demoted to QoS0) and the oldest message of a full class is dropped.
+
+import uasyncio as asyncio
+
+PRIORITY_STATE = 0
+PRIORITY_RESPONSE = 1
+PRIORITY_LOG = 2
+dropped_metric_names = ("state_dropped", "responses_dropped", "logs_dropped")
+
+
+class Outbox:
+
+    # qos per class (state, response, log), e.g. Outbox((1, 1, 0), 50, mqtt_metrics) publishes logs as QoS0 with up to 50 waiting per class
+    def __init__(self, qos, max_len=50, metrics=None):
+        self.qos = qos
+        self.max_len = max_len
+        self.metrics = metrics
+        self.queues = [[] for x in qos]   # Waiting messages per class [(topic, msg, retain, queued ticks_ms)]
+        self.event = asyncio.Event()
+
+    # Queue a message, returns False if the oldest message of the class was dropped to make room
+    # e.g. method(PRIORITY_LOG, "topicname/actionname", "Uptime=...", False, utime.ticks_ms())
+    def put(self, priority, topic, msg, retain, queued_ticks):
+        queue = self.queues[priority]
+        queue.append((topic, msg, retain, queued_ticks))
+        self.event.set()
+        if (len(queue) > self.max_len):
+            queue.pop(0)   # Publish rate limit reached or broker down for a long time
+            if (self.metrics is not None):
+                self.metrics.incr(dropped_metric_names[priority])
+            return False
+        return True
+
+    def get_count(self, priority):
+        return len(self.queues[priority])
+
+    # Most urgent class with waiting messages, -1 if the outbox is empty
+    def get_next_priority(self):
+        for priority in range(len(self.queues)):
+            if (len(self.queues[priority]) > 0):
+                return priority
+        return -1
+
+    # Remove and return the oldest message of the class, e.g. method(PRIORITY_STATE) returns (topic, msg, retain, queued ticks_ms)
+    def pop(self, priority):
+        return self.queues[priority].pop(0)
+
+    # Wait until a message is queued (or timeout_in_ms passed, e.g. to retry when a publish token is available)
+    async def wait(self, timeout_in_ms=None):
+        self.event.clear()
+        if (timeout_in_ms is None):
+            await self.event.wait()
+            return
+        try:
+            await asyncio.wait_for_ms(self.event.wait(), timeout_in_ms)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,95 @@
+
+# Relay schedule library for mqtt_tiny_controller
+# Cron-like schedules run on the device ("GP16 on at 06:30 on weekdays"), so they keep working during outages and need no cloud cron.
+# Each schedule is a dict: {"at": "06:30", "days": [0, 1, 2, 3, 4], "action": 16, "value": 1}, days are 0 = Monday to 6 = Sunday (omit for every day).
+# Times are local (time_zone_name, EST switches with DST), the next fire time of each schedule is an entry in the timer service min-heap
+# and is calculated again after it fired or when the clock is synced.
+#
+# e.g.
+#     schedules, errors = compile_schedules([{"at": "06:30", "days": [0, 1, 2, 3, 4], "action": 16, "value": 1}], (16, 17), "GP", 16)
+#     fire_time = get_next_fire_time(utime.time(), schedules[0], "EST")   # UTC seconds
+#     save_schedules("/mqtt_schedules.json", entries)                     # entries as received, loaded again by the controller after restart
+
+import os, json
+import utime
+from mqtt_tiny_controller_common import get_utc_offset_in_seconds
+
+schedule_keys = ("at", "days", "action", "value")
+
+
+# Validate schedules and compile them into tuples (schedule number, minute of day, days mask, action name, value), returns (schedules, errors)
+# e.g. method([{"at": "06:30", "action": 16}], (16, 17), "GP", 16) returns (((0, 390, 127, "GP16", 1),), [])
+def compile_schedules(entries, relay_pins, gpio_prefix, max_schedules):
+    schedules = []
+    errors = []
+    if (not isinstance(entries, (list, tuple))):
+        return (), ["schedules must be a list"]
+    if (len(entries) > max_schedules):
+        errors.append(f"max {max_schedules} schedules")
+    for i in range(len(entries)):
+        entry = entries[i]
+        label = f"schedule[{i}]"
+        if (not isinstance(entry, dict)):
+            errors.append(f"{label} must be a dict")
+            continue
+        for key in entry:
+            if (key not in schedule_keys):
+                errors.append(f"{label} has unknown key {key}")
+        minute_of_day = get_minute_of_day(entry.get("at"))
+        if (minute_of_day is None):
+            errors.append(f"{label} at must be \"HH:MM\"")
+        days = entry.get("days", [0, 1, 2, 3, 4, 5, 6])
+        days_mask = 0
+        if (isinstance(days, (list, tuple)) and len(days) > 0):
+            for day in days:
+                if (type(day) is not int or day < 0 or day > 6):   # JSON 1.0 equals 1 but cannot be shifted
+                    days_mask = 0
+                    break
+                days_mask |= 1 << day
+        if (days_mask == 0):
+            errors.append(f"{label} days must be a list of 0 (Monday) to 6 (Sunday)")
+        action = entry.get("action")
+        if (type(action) is not int or action not in relay_pins):   # JSON 16.0 would become "GP16.0"
+            errors.append(f"{label} action must be a relay GPIO")
+        value = entry.get("value", 1)
+        if (type(value) is not int or value not in (0, 1)):
+            errors.append(f"{label} value must be 0 or 1")
+        schedules.append((i, minute_of_day, days_mask, gpio_prefix + str(action), value))
+    if (len(errors) > 0):
+        return (), errors
+    return tuple(schedules), errors
+
+
+# e.g. method("06:30") returns 390, None if it's not a valid time
+def get_minute_of_day(at):
+    if (not isinstance(at, str)):
+        return None
+    parts = at.split(":")
+    try:
+        hours, minutes = int(parts[0]), int(parts[1])
+    except (ValueError, IndexError):
+        return None
+    if (len(parts) != 2 or hours < 0 or hours > 23 or minutes < 0 or minutes > 59):
+        return None
+    return hours * 60 + minutes
+
+
+# Next UTC time (seconds) after utc_now the schedule fires, e.g. method(utime.time(), (0, 390, 31, "GP16", 1), "EST")
+def get_next_fire_time(utc_now, schedule, time_zone_name):
+    minute_of_day, days_mask = schedule[1], schedule[2]
+    local_now = utc_now + get_utc_offset_in_seconds(utc_now, time_zone_name)
+    local_day = local_now - local_now % 86400
+    for i in range(8):   # Today (if the time is still ahead) to the same weekday next week
+        local_time = local_day + i * 86400 + minute_of_day * 60
+        if (local_time > local_now and (days_mask >> utime.localtime(local_time)[6]) & 1):
+            offset = get_utc_offset_in_seconds(local_time - get_utc_offset_in_seconds(local_time, time_zone_name), time_zone_name)   # Offset on that day (DST)
+            return local_time - offset
+    return None
+
+
+# Save schedules as received in the command, written to a temp file first, so a power loss while writing keeps the previous schedules, OSError is raised if the flash write fails
+def save_schedules(path, entries):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(entries, f)
+    os.rename(temp_path, path)
@@ -0,0 +1,50 @@
+
+# Startup benchmark for mqtt_tiny_controller: import time, init() time and heap used (gc.mem_alloc) after init
+# Lists the optional subsystems (TOTP, HTTP, NTP) that were loaded, with MFA disabled none of them should be imported at startup.
+#
+# On PicoW: copy this file with the controller files and run it in Thonny (it does not connect Wi-Fi or start the event loop)
+# On Linux: python -m host_sim.startup
+#
+# e.g.
+#     import mqtt_tiny_controller_startup_benchmark
+#     result = mqtt_tiny_controller_startup_benchmark.run()   # {"import_ms": 412.5, "init_ms": 35.1, "mem_alloc_after_init": 61440, ...}
+
+import sys, gc, utime
+
+optional_modules = ("pico_2fa_totp", "urequests", "ntptime", "mqtt_tiny_controller_journal", "mqtt_tiny_controller_core1", "mqtt_tiny_controller_lan",
+                    "mqtt_tiny_controller_schedule", "mqtt_tiny_controller_broker")   # TOTP, HTTP, NTP, state journal, core 1 service, LAN endpoint, relay schedules and broker failover
+
+
+# Get optional modules already imported
+def get_loaded_optional_modules():
+    return [x for x in optional_modules if x in sys.modules]
+
+
+def get_mem_alloc():
+    gc.collect()
+    return gc.mem_alloc()
+
+
+# Import the controller and run init(), e.g. method({"gpio_backend_name": "sim"}) on host
+def run(init_overrides=None):
+    result = {}
+    result["mem_alloc_baseline"] = get_mem_alloc()
+
+    start = utime.ticks_us()
+    import mqtt_tiny_controller
+    result["import_ms"] = utime.ticks_diff(utime.ticks_us(), start) / 1000
+    result["mem_alloc_after_import"] = get_mem_alloc()
+
+    start = utime.ticks_us()
+    mqtt_tiny_controller.init(**(init_overrides or {}))
+    result["init_ms"] = utime.ticks_diff(utime.ticks_us(), start) / 1000
+    result["mem_alloc_after_init"] = get_mem_alloc()
+    result["optional_modules_loaded"] = get_loaded_optional_modules()
+
+    for name in result:
+        print(f"{name}={result[name]}")
+    return result
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,73 @@
+
+# Timer service library for mqtt_tiny_controller
+# One task runs all delayed actions (e.g. "release momentary relay GP18 at time T") from a min-heap, so concurrent
+# momentary presses cost one heap entry each instead of one sleeping coroutine each
+
+import utime
+import heapq
+import uasyncio as asyncio
+
+
+class TimerService:
+    max_sleep_in_ms = 60000   # Wake up at least every x ms to keep the ms counter monotonic (ticks_ms wraps around)
+
+    def __init__(self):
+        self.heap = []   # Entries [due_ms, timer_id, callback, arg], sorted by due time then by insertion order
+        self.cancelled = set()
+        self.counter = 0
+        self.event = asyncio.Event()   # Set when an entry is added so the service recalculates its sleep
+        self.elapsed_ms = 0
+        self.last_ticks = utime.ticks_ms()
+
+    # Monotonic ms since the service was created, built from ticks_diff so it does not wrap around
+    def now_ms(self):
+        ticks = utime.ticks_ms()
+        self.elapsed_ms += utime.ticks_diff(ticks, self.last_ticks)
+        self.last_ticks = ticks
+        return self.elapsed_ms
+
+    # Call callback(arg) after delay, callback must be a normal (not async) function and should return quickly
+    # e.g. method(2000, release_momentary_relay, ("GP18", 1709164800, None)) returns timer id
+    def call_later(self, delay_in_ms, callback, arg=None):
+        self.counter += 1
+        heapq.heappush(self.heap, [self.now_ms() + int(delay_in_ms), self.counter, callback, arg])
+        self.event.set()
+        return self.counter
+
+    # Cancel a pending timer by id, e.g. method(3)
+    def cancel(self, timer_id):
+        for entry in self.heap:
+            if (entry[1] == timer_id):
+                self.cancelled.add(timer_id)
+                return True
+        return False
+
+    # Number of pending timers
+    def get_pending_count(self):
+        return len(self.heap) - len(self.cancelled)
+
+    # Run due timers, returns ms until the next timer
+    def run_due(self):
+        now = self.now_ms()
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            due_ms, timer_id, callback, arg = heapq.heappop(self.heap)
+            if (timer_id in self.cancelled):
+                self.cancelled.discard(timer_id)
+                continue
+            try:
+                callback(arg)
+            except Exception as e:
+                print(f"Error in timer callback={e}")
+        if (len(self.heap) == 0):
+            return self.max_sleep_in_ms
+        return min(self.heap[0][0] - now, self.max_sleep_in_ms)
+
+    # Task to run the timers forever, e.g. asyncio.create_task(timer_service.run())
+    async def run(self):
+        while True:
+            self.event.clear()   # Clear first, timers added by the callbacks set it again
+            wait_in_ms = self.run_due()
+            try:
+                await asyncio.wait_for_ms(self.event.wait(), wait_in_ms)
+            except asyncio.TimeoutError:
+                pass
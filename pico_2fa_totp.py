@@ -150,7 +150,9 @@ def totp(time, key, step_secs=30, digits=6):
     ('524508', 15)
     """
 
-    hmac = hmac_sha1(base32_decode(key), struct.pack(">Q", time // step_secs))
+    if isinstance(key, str):
+        key = base32_decode(key)   # Key can also be decoded once by the caller (bytes)
+    hmac = hmac_sha1(key, struct.pack(">Q", time // step_secs))
     offset = hmac[-1] & 0xF
     code = ((hmac[offset] & 0x7F) << 24 |
             (hmac[offset + 1] & 0xFF) << 16 |